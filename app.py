@@ -1,6 +1,8 @@
 import os
 import time
 import streamlit as st
+import pandas as pd
+from dataclasses import asdict
 from sensor.pipeline.training_pipeline import TrainingPipeline
 from sensor.pipeline.batch_prediction import SensorBatchPrediction
 from sensor.entity.config_entity import TrainingPipelineConfig, BatchPredictionConfig
@@ -38,8 +40,15 @@ if st.button("Upload Data"):
     except Exception as e:
         st.error(f"Exception occurred: {str(e)}")
 
+def show_stage_metrics(stages):
+    # one row per stage of the run, failed stages included
+    if len(stages):
+        st.write("Stage metrics")
+        st.table(pd.DataFrame([asdict(stage_metrics) for stage_metrics in stages]).set_index("stage"))
+
 # Train on uploaded data in mongodb
 def train():
+    training_pipeline = None
     try:
         training_pipeline_config = TrainingPipelineConfig()
         training_pipeline = TrainingPipeline(training_pipeline_config)
@@ -53,8 +62,13 @@ def train():
             st.write("Transforming data")
             data_transformation_artifact = training_pipeline.start_data_transformation(data_validation_artifact)
             status.success("Data transformed")
+            model_tuner_artifact = None
+            if training_pipeline_config.use_model_tuner:
+                st.write("Searching hyperparameters")
+                model_tuner_artifact = training_pipeline.start_model_tuner(data_transformation_artifact)
+                status.success(f"Hyperparameter search done, best f1 {model_tuner_artifact.best_score}")
             st.write("Model Training started")
-            model_trainer_artifact = training_pipeline.start_model_trainer(data_transformation_artifact)
+            model_trainer_artifact = training_pipeline.start_model_trainer(data_transformation_artifact, model_tuner_artifact)
             status.success("Model training successful")
             st.write("Evaluating Model")
             model_evaluation_artifact = training_pipeline.start_model_evaluation(data_validation_artifact=data_validation_artifact,
@@ -68,6 +82,11 @@ def train():
         st.success("Training Completed, Success")
     except Exception as e:
         st.exception(f"An Exception occured: {str(e)}")
+    finally:
+        # wait for the artifacts still being written in the background
+        if training_pipeline is not None:
+            training_pipeline.close()
+            show_stage_metrics(training_pipeline.metrics_recorder.stages)
 
 # predict on the uploaded file
 train_button = st.button("Train", on_click=train, key="train_button")
@@ -90,13 +109,21 @@ except Exception as e:
     st.error(e)
 
 def predict():
+    batch_pred_pipeline = None
     try:
         with st.spinner("Predicting data"):
             batch_pred_pipeline = SensorBatchPrediction(batch_pred_config)
-            batch_pred_pipeline.start_prediction()
-        st.success("Prediction saved in output folder")
+            results = batch_pred_pipeline.start_prediction()
+        failed = [result for result in results if result["status"] != "success"]
+        for result in failed:
+            st.warning(f"Prediction failed for {os.path.basename(result['input_file'])}: {result['error']}")
+        if len(failed) < len(results):
+            st.success("Prediction saved in output folder")
     except Exception as e:
         st.exception(f"An exception occured: {str(e)}")
+    finally:
+        if batch_pred_pipeline is not None:
+            show_stage_metrics(batch_pred_pipeline.metrics_recorder.stages)
 
 # predict on the uploaded file
 predict_button = st.button("Predict", on_click=predict, key="predict")
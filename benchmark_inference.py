@@ -0,0 +1,67 @@
+import sys
+import json
+import time
+import tracemalloc
+import numpy as np
+from sklearn.preprocessing import RobustScaler, LabelEncoder
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from xgboost import XGBClassifier
+from sensor.ml.model_bundle import ModelBundle
+from sensor.entity.schema_entity import load_schema
+from sensor.utils import read_csv_with_schema
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+def measure(predict, n_repeats:int) -> dict:
+    # best wall time of n_repeats calls and the peak of memory allocated during one call
+    try:
+        seconds = []
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            predict()
+            seconds.append(time.perf_counter() - start)
+        tracemalloc.start()
+        predict()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"best_ms": round(min(seconds) * 1000, 2), "peak_allocated_mb": round(peak_bytes / 2**20, 2)}
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def benchmark_inference(file_path:str, schema_file_path:str="schema.yaml", n_repeats:int=5) -> dict:
+    # Latency and allocations of the sklearn pipeline + XGBClassifier path against the fused
+    # ModelBundle path on the same fitted objects, and whether their predictions match.
+    try:
+        schema = load_schema(schema_file_path)
+        df = read_csv_with_schema(file_path, schema_file_path, columns=schema.used_columns)
+        target_encoder = LabelEncoder().fit(df[schema.target_column])
+        y = target_encoder.transform(df.pop(schema.target_column))
+        transformer = Pipeline(steps=[('Imputer', SimpleImputer(strategy='constant', fill_value=0)),
+                                      ('RobustScaler', RobustScaler())])
+        model = XGBClassifier(tree_method="hist")
+        model.fit(transformer.fit_transform(df), y)
+        model_bundle = ModelBundle.from_objects(transformer, model, target_encoder)
+        input_features = list(transformer.feature_names_in_)
+
+        results = {
+            "rows": int(len(df)),
+            "predictions_match": bool(np.array_equal(model.predict(transformer.transform(df[input_features])),
+                                                     model_bundle.predict(df))),
+            "sklearn": measure(lambda: model.predict(transformer.transform(df[input_features])), n_repeats),
+            "fused": measure(lambda: model_bundle.predict(df), n_repeats),
+        }
+        logging.info(f"Inference benchmark: {results}")
+        return results
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python benchmark_inference.py <training csv> [schema file]")
+        sys.exit(1)
+    results = benchmark_inference(*sys.argv[1:3])
+    print(json.dumps(results, indent=2))
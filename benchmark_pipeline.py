@@ -0,0 +1,200 @@
+import os, sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, List, Optional
+from sensor.config import set_mongo_client
+from sensor.metrics import MetricsRecorder, add_stage_rows
+from sensor.synthetic_data import write_aps_csv
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+BENCHMARK_DIR = os.path.join("datadir", "benchmarks")
+BASELINE_FILE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+# 1M rows take about 20 GB in mongomock, pass them with --rows to include them
+BENCHMARK_ROWS = [10_000, 100_000]
+# metrics compared against the baseline; a ratio above 1 + tolerance is reported as a regression
+COMPARED_METRICS = ["wall_seconds", "peak_rss_mb"]
+# smaller absolute differences are timer noise, whatever the ratio
+MIN_COMPARED_DIFFERENCE = {"wall_seconds": 0.1, "peak_rss_mb": 10}
+
+
+def measure_stage(stage_name:str, run:Callable, n_rows:int, results:dict):
+    # metrics of one stage with the benchmark size as its rows; the pipeline stages measure
+    # themselves too, their inner measurement only starts after the stage setup
+    try:
+        with MetricsRecorder().measure(stage_name) as stage_metrics:
+            output = run()
+            add_stage_rows(n_rows)
+        results[stage_name] = {key: value for key, value in asdict(stage_metrics).items()
+                               if key not in ("stage", "started", "status", "cached")}
+        logging.info(f"Benchmark {stage_name} at {n_rows} rows: {results[stage_name]}")
+        print(f"{n_rows:>9} rows  {stage_name:<20} {stage_metrics.wall_seconds:9.2f}s  {stage_metrics.peak_rss_mb or 0:9.0f} MB")
+        return output
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def load_csv_into_collection(file_path:str, collection, chunk_size:int=10_000) -> int:
+    # fields typed like dump_csv_to_mongodb stores them, without its unique row hash index:
+    # mongomock checks unique indexes by scanning the collection, which is quadratic in rows
+    try:
+        import pandas as pd
+        from sensor.utils import get_stored_records
+        n_inserted = 0
+        for df in pd.read_csv(file_path, chunksize=chunk_size):
+            n_inserted += len(collection.insert_many(get_stored_records(df)).inserted_ids)
+        return n_inserted
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def benchmark_pipeline(n_rows:int, work_dir:str, schema_file_path:str="schema.yaml", seed:int=42) -> dict:
+    # One training pipeline run and one batch prediction on n_rows synthetic rows loaded into an
+    # in-process mongomock collection, every stage measured on its own. Relative paths of the
+    # configs resolve inside work_dir.
+    try:
+        import mongomock
+        from sensor.entity.config_entity import TrainingPipelineConfig, BatchPredictionConfig, DataIngestionConfig
+        from sensor.pipeline.training_pipeline import TrainingPipeline
+        from sensor.pipeline.batch_prediction import SensorBatchPrediction
+
+        os.makedirs(work_dir, exist_ok=True)
+        shutil.copy(schema_file_path, os.path.join(work_dir, "schema.yaml"))
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            results = dict()
+            train_file_path = measure_stage("generate_data", lambda: write_aps_csv(os.path.join("data", "train.csv"), n_rows, seed=seed),
+                                            n_rows, results)
+            mongo_client = mongomock.MongoClient()
+            set_mongo_client(mongo_client)
+            training_pipeline_config = TrainingPipelineConfig()
+            # every stage runs, nothing comes from earlier runs
+            training_pipeline_config.use_stage_cache = False
+            data_ingestion_config = DataIngestionConfig(training_pipeline_config)
+            collection = mongo_client[data_ingestion_config.database_name][data_ingestion_config.collection_name]
+            measure_stage("mongo_upload", lambda: load_csv_into_collection(train_file_path, collection), n_rows, results)
+
+            training_pipeline = TrainingPipeline(training_pipeline_config)
+            try:
+                data_ingestion_artifact = measure_stage("data_ingestion", training_pipeline.start_data_ingestion, n_rows, results)
+                data_validation_artifact = measure_stage("data_validation", lambda: training_pipeline.start_data_validation(data_ingestion_artifact),
+                                                         n_rows, results)
+                data_transformation_artifact = measure_stage("data_transformation",
+                                                             lambda: training_pipeline.start_data_transformation(data_validation_artifact),
+                                                             n_rows, results)
+                model_trainer_artifact = measure_stage("model_trainer", lambda: training_pipeline.start_model_trainer(data_transformation_artifact),
+                                                       n_rows, results)
+                measure_stage("model_evaluation", lambda: training_pipeline.start_model_evaluation(data_validation_artifact=data_validation_artifact,
+                                                                                                   data_transformation_artifact=data_transformation_artifact,
+                                                                                                   model_trainer_artifact=model_trainer_artifact),
+                              n_rows, results)
+                measure_stage("model_pusher", lambda: training_pipeline.start_model_pusher(data_transformation_artifact=data_transformation_artifact,
+                                                                                           model_trainer_artifact=model_trainer_artifact),
+                              n_rows, results)
+            finally:
+                # artifacts still being written in the background
+                measure_stage("artifact_flush", training_pipeline.close, n_rows, results)
+
+            batch_config = BatchPredictionConfig()
+            # new rows from the training distribution, so the drift summary reflects real drift only
+            write_aps_csv(os.path.join(batch_config.inbox_dir, "batch.csv"), n_rows, seed=seed, row_seed=seed + 1)
+            measure_stage("batch_prediction", SensorBatchPrediction(batch_config).start_prediction, n_rows, results)
+            return results
+        finally:
+            os.chdir(cwd)
+            set_mongo_client(None)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def compare_to_baseline(benchmark:dict, baseline:dict, tolerance:float=0.2) -> List[dict]:
+    # stages of row counts present in both runs whose compared metrics grew by more than tolerance
+    try:
+        regressions = []
+        for n_rows, stages in benchmark["results"].items():
+            for stage_name, metrics in stages.items():
+                baseline_metrics = baseline["results"].get(n_rows, {}).get(stage_name)
+                if baseline_metrics is None:
+                    continue
+                for metric in COMPARED_METRICS:
+                    current, previous = metrics.get(metric), baseline_metrics.get(metric)
+                    if current is None or not previous:
+                        continue
+                    ratio = current / previous
+                    if ratio > 1 + tolerance and current - previous > MIN_COMPARED_DIFFERENCE[metric]:
+                        regressions.append({"rows": n_rows, "stage": stage_name, "metric": metric,
+                                            "baseline": previous, "current": current, "ratio": round(ratio, 3)})
+        return regressions
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def run_benchmarks(rows:List[int], schema_file_path:str="schema.yaml", seed:int=42, work_dir:Optional[str]=None) -> dict:
+    try:
+        import numpy, pandas, sklearn, xgboost
+        benchmark = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "seed": seed,
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "numpy": numpy.__version__,
+                "pandas": pandas.__version__,
+                "sklearn": sklearn.__version__,
+                "xgboost": xgboost.__version__,
+            },
+            "results": dict(),
+        }
+        schema_file_path = os.path.abspath(schema_file_path)
+        for n_rows in rows:
+            # every size gets a fresh work dir, registry and mock collection
+            if work_dir is None:
+                with tempfile.TemporaryDirectory(prefix="sensor-benchmark-") as tmp_dir:
+                    benchmark["results"][str(n_rows)] = benchmark_pipeline(n_rows, tmp_dir, schema_file_path, seed)
+            else:
+                size_dir = os.path.join(work_dir, str(n_rows))
+                shutil.rmtree(size_dir, ignore_errors=True)
+                benchmark["results"][str(n_rows)] = benchmark_pipeline(n_rows, size_dir, schema_file_path, seed)
+        return benchmark
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory profile every pipeline stage on synthetic data in a mock mongodb")
+    parser.add_argument("--rows", type=int, nargs="+", default=BENCHMARK_ROWS, help=f"row counts to run, default {BENCHMARK_ROWS}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--schema", default="schema.yaml")
+    parser.add_argument("--work-dir", default=None, help="keep the generated data and artifacts here instead of a temporary dir")
+    parser.add_argument("--output", default=None, help=f"result json, default {BENCHMARK_DIR}/benchmark_<timestamp>.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE_PATH, help="compare against this result json if it exists")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    benchmark = run_benchmarks(args.rows, schema_file_path=args.schema, seed=args.seed, work_dir=args.work_dir)
+    output_file_path = args.output or os.path.join(BENCHMARK_DIR, f"benchmark_{datetime.now().strftime('%m%d%Y__%H%M%S')}.json")
+    for file_path in [output_file_path] + ([args.baseline] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, "w") as file_obj:
+            json.dump(benchmark, file_obj, indent=2)
+    print(f"Results saved at {output_file_path}")
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file_obj:
+            baseline = json.load(file_obj)
+        regressions = compare_to_baseline(benchmark, baseline, tolerance=args.tolerance)
+        print(f"Compared against {args.baseline} ({baseline['created']}): {len(regressions)} regressions")
+        for regression in regressions:
+            print(f"  {regression['rows']:>9} rows  {regression['stage']:<20} {regression['metric']:<14} "
+                  f"{regression['baseline']} -> {regression['current']} (x{regression['ratio']})")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,60 @@
+import sys
+import json
+import time
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import RobustScaler, LabelEncoder
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.metrics import f1_score
+from xgboost import XGBClassifier
+from sensor.ml.resampling import Resampler, RESAMPLING_STRATEGIES
+from sensor.entity.schema_entity import load_schema
+from sensor.utils import read_csv_with_schema
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+def benchmark_resampling(file_path:str, schema_file_path:str="schema.yaml", n_jobs:int=-1) -> dict:
+    # Resampling time, training time and F1 on the untouched test split for every resampling
+    # strategy, on the same split and transformation the training pipeline uses.
+    try:
+        schema = load_schema(schema_file_path)
+        df = read_csv_with_schema(file_path, schema_file_path, columns=schema.used_columns)
+        y = LabelEncoder().fit_transform(df.pop(schema.target_column))
+        x_train, x_test, y_train, y_test = train_test_split(df, y, test_size=0.2, random_state=42, stratify=y)
+        transformer = Pipeline(steps=[('Imputer', SimpleImputer(strategy='constant', fill_value=0)),
+                                      ('RobustScaler', RobustScaler())])
+        x_train = transformer.fit_transform(x_train)
+        x_test = transformer.transform(x_test)
+
+        results = dict()
+        for strategy in RESAMPLING_STRATEGIES:
+            resampler = Resampler(strategy=strategy, n_jobs=n_jobs, random_state=42)
+            start = time.perf_counter()
+            x_resampled, y_resampled = resampler.fit_resample(x_train, y_train)
+            resample_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            model = XGBClassifier(scale_pos_weight=resampler.get_scale_pos_weight(y_resampled))
+            model.fit(x_resampled, y_resampled)
+            train_seconds = time.perf_counter() - start
+
+            results[strategy] = {
+                "resample_seconds": round(resample_seconds, 3),
+                "train_seconds": round(train_seconds, 3),
+                "train_rows": int(len(y_resampled)),
+                "f1_test": float(f1_score(y_test, model.predict(x_test))),
+            }
+            logging.info(f"Resampling benchmark {strategy}: {results[strategy]}")
+        return results
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python benchmark_resampling.py <training csv> [schema file]")
+        sys.exit(1)
+    results = benchmark_resampling(*sys.argv[1:3])
+    print(json.dumps(results, indent=2))
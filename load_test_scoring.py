@@ -0,0 +1,96 @@
+import sys
+import json
+import threading
+import time
+import http.client
+from urllib.parse import urlparse
+import numpy as np
+from sensor.pipeline.scoring_service import SensorScoringService
+from sensor.entity.config_entity import ScoringServiceConfig
+from sensor.entity.schema_entity import load_schema
+from sensor.utils import read_csv_with_schema
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+def run_client(url:str, bodies:list, latencies:list, errors:list) -> None:
+    # one keep-alive connection posting its request bodies one after the other
+    parsed_url = urlparse(url)
+    connection = http.client.HTTPConnection(parsed_url.hostname, parsed_url.port)
+    try:
+        for body in bodies:
+            start = time.perf_counter()
+            connection.request("POST", "/predict", body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                errors.append(response.status)
+    finally:
+        connection.close()
+
+
+def load_test_scoring(file_path:str, n_clients:int=8, n_requests:int=2000, rows_per_request:int=1,
+                      url:str=None, schema_file_path:str="schema.yaml") -> dict:
+    # Concurrent clients post readings sampled from file_path. Without a url the service is
+    # started in this process on a free localhost port and stopped afterwards.
+    try:
+        schema = load_schema(schema_file_path)
+        df = read_csv_with_schema(file_path, schema_file_path, columns=schema.feature_columns)
+        rng = np.random.default_rng(42)
+        bodies = []
+        for _ in range(n_requests):
+            rows = df.iloc[rng.integers(0, len(df), rows_per_request)]
+            records = [{col: (None if np.isnan(value) else float(value)) for col, value in record.items()}
+                       for record in rows.to_dict(orient="records")]
+            bodies.append(json.dumps(records[0] if rows_per_request == 1 else records))
+
+        scoring_service = None
+        if url is None:
+            scoring_service = SensorScoringService(ScoringServiceConfig(port=0))
+            threading.Thread(target=scoring_service.serve_forever, daemon=True).start()
+            url = scoring_service.address
+        try:
+            latencies, errors = [], []
+            clients = [threading.Thread(target=run_client, args=(url, bodies[client_idx::n_clients], latencies, errors))
+                       for client_idx in range(n_clients)]
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            seconds = time.perf_counter() - start
+
+            parsed_url = urlparse(url)
+            connection = http.client.HTTPConnection(parsed_url.hostname, parsed_url.port)
+            connection.request("GET", "/stats")
+            server_stats = json.loads(connection.getresponse().read())
+            connection.close()
+        finally:
+            if scoring_service is not None:
+                scoring_service.shutdown()
+
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        results = {
+            "clients": n_clients,
+            "requests": len(latencies),
+            "rows_per_request": rows_per_request,
+            "errors": len(errors),
+            "seconds": round(seconds, 3),
+            "requests_per_second": round(len(latencies) / seconds, 2),
+            "client_latency_ms": {"p50": round(float(p50), 3), "p99": round(float(p99), 3)},
+            "server": server_stats,
+        }
+        logging.info(f"Scoring load test: {results}")
+        return results
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python load_test_scoring.py <csv> [clients] [requests] [rows per request] [url]")
+        sys.exit(1)
+    args = sys.argv[1:]
+    results = load_test_scoring(args[0], *[int(arg) for arg in args[1:4]], *args[4:5])
+    print(json.dumps(results, indent=2))
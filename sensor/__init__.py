@@ -1,4 +0,0 @@
-from dotenv import load_dotenv
-
-print(f"Parsing .env file")
-load_dotenv()  # take environment variables from .env.
\ No newline at end of file
@@ -0,0 +1,118 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sensor.exception import SensorException
+from sensor.logger import logging
+from sensor.utils import (save_dataframe, load_dataframe, save_object, load_object,
+                          save_numpy_array_data, load_numpy_array, save_numpy_arrays, load_numpy_arrays)
+from sensor.entity.schema_entity import load_schema
+
+
+class ArtifactStore:
+    # Artifacts handed from one pipeline stage to the next, keyed by their artifact file path.
+    # With in_memory=True every saved dataframe, array and object is kept in memory for the
+    # next stage and written to disk by a background thread (write-behind), so stages never
+    # wait on disk. With in_memory=False it simply reads and writes the files synchronously.
+
+    def __init__(self, in_memory:bool=True) -> None:
+        try:
+            self.in_memory = in_memory
+            self._artifacts:Dict[str, object] = dict()
+            self._pending_writes = []
+            self._lock = threading.Lock()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer") if in_memory else None
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def _put(self, file_path:str, obj, writer) -> None:
+        if not self.in_memory:
+            writer(file_path, obj)
+            return
+        with self._lock:
+            self._artifacts[file_path] = obj
+            self._pending_writes.append(self._writer.submit(writer, file_path, obj))
+
+    def _get(self, file_path:str):
+        with self._lock:
+            return self._artifacts.get(file_path)
+
+    def save_dataframe(self, file_path:str, df:pd.DataFrame) -> None:
+        try:
+            self._put(file_path, df, save_dataframe)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load_dataframe(self, file_path:str, schema_file_path:str, columns:Optional[List[str]]=None) -> pd.DataFrame:
+        try:
+            df = self._get(file_path)
+            if df is None:
+                return load_dataframe(file_path, schema_file_path, columns=columns)
+            columns = load_schema(schema_file_path).required_column_set if columns is None else set(columns)
+            # column selection returns a copy, callers may modify it while it is being written
+            return df[[col for col in df.columns if col in columns]]
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save_numpy_array_data(self, file_path:str, data:np.ndarray) -> None:
+        try:
+            self._put(file_path, data, save_numpy_array_data)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load_numpy_array(self, file_path:str) -> np.ndarray:
+        try:
+            data = self._get(file_path)
+            return load_numpy_array(file_path) if data is None else data
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save_numpy_arrays(self, file_path:str, arrays:dict) -> None:
+        try:
+            self._put(file_path, arrays, save_numpy_arrays)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load_numpy_arrays(self, file_path:str) -> dict:
+        try:
+            arrays = self._get(file_path)
+            return load_numpy_arrays(file_path) if arrays is None else arrays
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save_object(self, file_path:str, obj:object) -> None:
+        try:
+            self._put(file_path, obj, save_object)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load_object(self, file_path:str) -> object:
+        try:
+            obj = self._get(file_path)
+            return load_object(file_path) if obj is None else obj
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def flush(self) -> None:
+        # block until every pending write is on disk, re-raising the first failed write
+        try:
+            with self._lock:
+                pending_writes, self._pending_writes = self._pending_writes, []
+            if len(pending_writes) > 0:
+                logging.info(f"Waiting for {len(pending_writes)} pending artifact writes")
+            for future in pending_writes:
+                future.result()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+            with self._lock:
+                self._artifacts.clear()
+            if self._writer is not None:
+                self._writer.shutdown(wait=True)
+        except Exception as e:
+            raise SensorException(e, sys)
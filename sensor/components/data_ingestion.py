@@ -1,6 +1,7 @@
 import os
 import sys
 import numpy as np
+from typing import Optional
 from sklearn.model_selection import train_test_split
 from dataclasses import dataclass
 from sensor.exception import SensorException
@@ -8,38 +9,71 @@ from sensor.logger import logging
 from sensor.entity.config_entity import DataIngestionConfig
 from sensor.entity.artifact_entity import DataIngestionArtifact
 from sensor.utils import export_collection_as_dataframe
+from sensor.entity.schema_entity import load_schema
+from sensor.artifact_store import ArtifactStore
+from sensor.snapshot import CollectionSnapshot
+from sensor.metrics import add_stage_rows
 
 
 
 class DataIngestion:
 
-    def __init__(self, data_ingestion_config:DataIngestionConfig) -> None:
+    def __init__(self, data_ingestion_config:DataIngestionConfig,
+                 artifact_store:Optional[ArtifactStore]=None) -> None:
         try:
             self.data_ingestion_config = data_ingestion_config
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
         except Exception as e:
             raise SensorException(e, sys)
         
 
     def initiate_data_ingestion(self) -> DataIngestionArtifact:
         try:
-            logging.info(f"Exporting collection as dataframe")
-            df = export_collection_as_dataframe(
-                database_name=self.data_ingestion_config.database_name,
-                collection_name=self.data_ingestion_config.collection_name
-                )
-            # correct missing value format
-            logging.info(f"Replacing missing value na with NAN")
-            df.replace({'na':np.NAN}, inplace=True)
+            schema = load_schema(self.data_ingestion_config.schema_file_path)
+            target_column = schema.target_column
+            # project only the columns that survive validation, dropped columns never leave the server
+            columns = schema.used_columns
+
+            if self.data_ingestion_config.use_snapshot:
+                logging.info(f"Loading collection through local snapshot")
+                collection_snapshot = CollectionSnapshot(
+                    snapshot_dir=self.data_ingestion_config.snapshot_dir,
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name,
+                    columns=columns,
+                    target_column=target_column,
+                    batch_size=self.data_ingestion_config.export_batch_size,
+                    n_workers=self.data_ingestion_config.export_n_workers
+                    )
+                df = collection_snapshot.get_dataframe()
+            else:
+                logging.info(f"Exporting collection as dataframe")
+                # missing value markers (na) are coerced to NAN while streaming
+                df = export_collection_as_dataframe(
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name,
+                    columns=columns,
+                    target_column=target_column,
+                    batch_size=self.data_ingestion_config.export_batch_size,
+                    n_workers=self.data_ingestion_config.export_n_workers
+                    )
+            if df is None:
+                raise Exception(f"Collection {self.data_ingestion_config.collection_name} not found in database {self.data_ingestion_config.database_name}")
+            add_stage_rows(len(df))
             # split into train and test df
             logging.info(f"Splitting dataset into train and test")
             train_df, test_df = train_test_split(df, test_size=self.data_ingestion_config.test_size, random_state=42)
             # create dataset directory if not exists
             logging.info(f"Creating dataset directory")
             os.makedirs(self.data_ingestion_config.dataset_dir, exist_ok=True)
-            # save train and test csv
-            logging.info(f"Saving train and test csv")
-            train_df.to_csv(self.data_ingestion_config.train_file_path, index=False, header=True)
-            test_df.to_csv(self.data_ingestion_config.test_file_path, index=False, header=True)
+            # save train and test dataset
+            logging.info(f"Saving train and test dataset as {self.data_ingestion_config.file_format}")
+            self.artifact_store.save_dataframe(self.data_ingestion_config.train_file_path, train_df)
+            self.artifact_store.save_dataframe(self.data_ingestion_config.test_file_path, test_df)
+            if self.data_ingestion_config.export_csv:
+                logging.info(f"Saving train and test csv for debugging")
+                self.artifact_store.save_dataframe(self.data_ingestion_config.train_csv_file_path, train_df)
+                self.artifact_store.save_dataframe(self.data_ingestion_config.test_csv_file_path, test_df)
             
             logging.info(f"Preparing data ingestion artifact")
             data_ingestion_artifact = DataIngestionArtifact(
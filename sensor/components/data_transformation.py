@@ -5,20 +5,26 @@ import numpy as np
 from sklearn.preprocessing import RobustScaler, LabelEncoder
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
-from imblearn.combine import SMOTETomek
+from sklearn.model_selection import train_test_split
 from sensor.logger import logging
 from sensor.exception import SensorException
-from sensor.utils import read_yaml_file, save_numpy_array_data, save_object
+from sensor.entity.schema_entity import load_schema
+from sensor.artifact_store import ArtifactStore
+from sensor.ml.drift import build_feature_profile
+from sensor.ml.resampling import Resampler
+from sensor.metrics import add_stage_rows
 from sensor.entity.config_entity import DataTransformationConfig
 from sensor.entity.artifact_entity import DataValidationArtifact, DataTransformationArtifact
 
 class DataTransformation:
     def __init__(self, data_transformation_config:DataTransformationConfig,
-                 data_validation_artifact:DataValidationArtifact) -> None:
+                 data_validation_artifact:DataValidationArtifact,
+                 artifact_store:Optional[ArtifactStore]=None) -> None:
         try:
             logging.info(f"{'==='*20}Data Transformation{'==='*20}")
             self.data_transformation_config = data_transformation_config
             self.data_validation_artifact = data_validation_artifact
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
         except Exception as e:
             raise SensorException(e, sys)
         
@@ -43,20 +49,21 @@ class DataTransformation:
         except Exception as e:
             raise SensorException(e, sys)
         
-    def get_sampling_obj(self)-> SMOTETomek:
+    def get_sampling_obj(self)-> Resampler:
         try:
-            return SMOTETomek(random_state=42)
+            return Resampler(strategy=self.data_transformation_config.resampling_strategy,
+                             n_jobs=self.data_transformation_config.resampling_n_jobs, random_state=42)
         except Exception as e:
             raise SensorException(e, sys)
         
     def initiate_data_transformation(self)-> DataTransformationArtifact:
         try:
-            schema_info = read_yaml_file(self.data_transformation_config.schema_file_path)
-            target_column = schema_info['target_column']
+            target_column = load_schema(self.data_transformation_config.schema_file_path).target_column
             
             logging.info(f"Reading valid training and testing data")
-            train_df = pd.read_csv(self.data_validation_artifact.train_file_path)
-            test_df = pd.read_csv(self.data_validation_artifact.test_file_path)
+            train_df = self.artifact_store.load_dataframe(self.data_validation_artifact.train_file_path, self.data_transformation_config.schema_file_path)
+            test_df = self.artifact_store.load_dataframe(self.data_validation_artifact.test_file_path, self.data_transformation_config.schema_file_path)
+            add_stage_rows(len(train_df) + len(test_df))
 
             logging.info(f"Seperate input and target feature")
             input_feature_train_df=train_df.drop(target_column, axis=1)
@@ -64,6 +71,11 @@ class DataTransformation:
             target_feature_train_df = train_df[target_column]
             target_feature_test_df = test_df[target_column]
 
+            logging.info(f"Profiling training features as baseline for drift checks at prediction time")
+            feature_profile = build_feature_profile(input_feature_train_df.to_numpy(dtype=np.float32),
+                                                    columns=list(input_feature_train_df.columns),
+                                                    n_bins=self.data_transformation_config.profile_n_bins)
+
             logging.info(f"Converting target categorical column into numerical using label encoder")
             lbl_enc = self.get_target_encoder_obj()
             lbl_enc.fit(target_feature_train_df)
@@ -76,35 +88,55 @@ class DataTransformation:
             input_feature_train_arr = transformation_pipe.transform(input_feature_train_df)
             input_feature_test_arr = transformation_pipe.transform(input_feature_test_df)
 
-            logging.info(f"Resampling dataset to handle imbalance")
+            # the holdout is split off before resampling, synthetic rows interpolated from the fit
+            # rows would otherwise end up in it
+            valid_arr = None
+            if self.data_transformation_config.validation_fraction:
+                logging.info(f"Holding out {self.data_transformation_config.validation_fraction} of the train rows for validation")
+                input_feature_train_arr, input_feature_valid_arr, target_feature_train_arr, target_feature_valid_arr = train_test_split(
+                    input_feature_train_arr, target_feature_train_arr, random_state=42, stratify=target_feature_train_arr,
+                    test_size=self.data_transformation_config.validation_fraction)
+                valid_arr = np.c_[input_feature_valid_arr, target_feature_valid_arr]
+
             smt = self.get_sampling_obj()
+            logging.info(f"Handling imbalance with {smt.strategy} resampling strategy")
+            scale_pos_weight = smt.get_scale_pos_weight(target_feature_train_arr)
             logging.info(f"Before resampling in training set, Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
             input_feature_train_arr, target_feature_train_arr = smt.fit_resample(input_feature_train_arr, target_feature_train_arr)
             logging.info(f"After resampling in training set Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
             
-            logging.info(f"Before resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
-            input_feature_test_arr, target_feature_test_arr = smt.fit_resample(input_feature_test_arr, target_feature_test_arr)
-            logging.info(f"After resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
+            if self.data_transformation_config.resample_test_set:
+                logging.info(f"Before resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
+                input_feature_test_arr, target_feature_test_arr = smt.fit_resample(input_feature_test_arr, target_feature_test_arr)
+                logging.info(f"After resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
 
             # concat input and target array
             train_arr = np.c_[input_feature_train_arr, target_feature_train_arr]
             test_arr = np.c_[input_feature_test_arr, target_feature_test_arr]
 
             logging.info('saving the data')
-            save_numpy_array_data(self.data_transformation_config.transformed_train_path, data=train_arr)
-            save_numpy_array_data(self.data_transformation_config.transformed_test_path, data=test_arr)
+            self.artifact_store.save_numpy_array_data(self.data_transformation_config.transformed_train_path, data=train_arr)
+            self.artifact_store.save_numpy_array_data(self.data_transformation_config.transformed_test_path, data=test_arr)
+            if valid_arr is not None:
+                self.artifact_store.save_numpy_array_data(self.data_transformation_config.transformed_valid_path, data=valid_arr)
 
             logging.info("Saving transformer pipeline obj")
-            save_object(self.data_transformation_config.transformer_obj_path, transformation_pipe)
+            self.artifact_store.save_object(self.data_transformation_config.transformer_obj_path, transformation_pipe)
 
             logging.info("Saving target encoder obj")
-            save_object(self.data_transformation_config.target_encoder_obj_path, lbl_enc)
+            self.artifact_store.save_object(self.data_transformation_config.target_encoder_obj_path, lbl_enc)
+
+            logging.info("Saving feature profile")
+            self.artifact_store.save_numpy_arrays(self.data_transformation_config.feature_profile_path, feature_profile)
 
             data_transformation_artifact = DataTransformationArtifact(
                 transformed_train_path=self.data_transformation_config.transformed_train_path,
                 transformed_test_path=self.data_transformation_config.transformed_test_path,
                 transformer_object_path=self.data_transformation_config.transformer_obj_path,
-                target_encoder_path=self.data_transformation_config.target_encoder_obj_path
+                target_encoder_path=self.data_transformation_config.target_encoder_obj_path,
+                feature_profile_path=self.data_transformation_config.feature_profile_path,
+                scale_pos_weight=scale_pos_weight,
+                transformed_valid_path=None if valid_arr is None else self.data_transformation_config.transformed_valid_path
             )
 
             return data_transformation_artifact
@@ -1,11 +1,15 @@
 import os, sys
+import json
 from typing import Optional
 import pandas as pd
 import numpy as np
-from scipy.stats import ks_2samp
 from sensor.entity.config_entity import DataValidationConfig
 from sensor.entity.artifact_entity import DataIngestionArtifact, DataValidationArtifact
-from sensor.utils import read_yaml_file, write_yaml_file
+from sensor.utils import write_yaml_file, UNPARSABLE_VALUES_COLUMN
+from sensor.entity.schema_entity import load_schema
+from sensor.artifact_store import ArtifactStore
+from sensor.ml.drift import ks_2samp_column_blocks
+from sensor.metrics import add_stage_rows
 from sensor.logger import logging
 from sensor.exception import SensorException
 
@@ -14,12 +18,15 @@ class DataValidation:
 
     def __init__(self,
                  data_validation_config:DataValidationConfig,
-                 data_ingestion_artifact:DataIngestionArtifact
+                 data_ingestion_artifact:DataIngestionArtifact,
+                 artifact_store:Optional[ArtifactStore]=None
             ) -> None:
         try:
             logging.info(f"{'='*20} Data Validation {'='*20}")
             self.data_validation_config = data_validation_config
             self.data_ingestion_artifact = data_ingestion_artifact
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
+            self.schema = load_schema(self.data_validation_config.schema_file_path)
             self.validation_error = dict()
         except Exception as e:
             raise SensorException(e, sys)
@@ -30,7 +37,8 @@ class DataValidation:
             null_report = df.isna().sum()/df.shape[0]
             logging.info(f"Selecting the columns in the dataframe which contains null values above threshold {threshold}")
             drop_column_names = null_report[null_report>threshold].index
-            logging.info(f"Columns to drop: {list(drop_column_names)}")
+            logging.info(f"Dropping {len(drop_column_names)} columns")
+            logging.debug("Columns to drop: %s", drop_column_names)
             self.validation_error[report_key_name] = list(drop_column_names)
             df.drop(list(drop_column_names), axis=1, inplace=True)
 
@@ -43,19 +51,16 @@ class DataValidation:
     
     def is_required_column_exists(self, df:pd.DataFrame, report_key_name:str)->bool:
         try:
-            schema_info = read_yaml_file(file_path=self.data_validation_config.schema_file_path)
-            reqd_cols = schema_info['required_columns']
-            logging.info(f"Required Columns: {reqd_cols}")
-            missing_reqd_cols = []
-            for col in reqd_cols:
-                if col not in df.columns:
-                    missing_reqd_cols.append(col)
+            logging.info(f"Checking {len(self.schema.required_columns)} required columns")
+            missing_reqd_cols = self.schema.get_missing_columns(df.columns)
 
             if len(missing_reqd_cols) == 0:
                 return True
             
-            logging.info(f"Missing required columns: {missing_reqd_cols}")
+            logging.info(f"Missing {len(missing_reqd_cols)} required columns")
+            logging.debug("Missing required columns: %s", missing_reqd_cols)
             self.validation_error[report_key_name] = missing_reqd_cols
+            return False
 
         except Exception as e:
             raise SensorException(e, sys)
@@ -63,26 +68,30 @@ class DataValidation:
     def data_drift(self, base_df:pd.DataFrame, current_df:pd.DataFrame, report_key_name:str):
         try:
             drift_report = dict()
-            base_cols = base_df.columns
-            current_cols = current_df.columns
-            for base_col in base_cols:
+            base_cols = list(base_df.columns)
+            logging.info(f"Running KS test on {len(base_cols)} columns")
+            base_arr = np.empty((len(base_df), len(base_cols)), dtype=np.float32)
+            current_arr = np.empty((len(current_df), len(base_cols)), dtype=np.float32)
+            for col_idx, base_col in enumerate(base_cols):
                 base_data, current_data = base_df[base_col], current_df[base_col]
-                logging.info(f"Hypothesis {base_col}: {base_data.dtype}, {current_data.dtype}")
-                same_dist = ks_2samp(base_data, current_data)
-
-                if same_dist.pvalue > 0.05:
-                    # We accept null hypothesis
-                    drift_report[base_col] = {
-                        "p-values": float(same_dist.pvalue),
-                        "same distribution": True
-                    }
+                if pd.api.types.is_numeric_dtype(base_data) and pd.api.types.is_numeric_dtype(current_data):
+                    base_arr[:, col_idx], current_arr[:, col_idx] = base_data, current_data
                 else:
-                    drift_report[base_col] = {
-                        "p-values": float(same_dist.pvalue),
-                        "same distribution": False
-                    }
-                    # different distribution
-                
+                    # categorical columns (the target) are compared through their sorted category codes
+                    codes, _ = pd.factorize(pd.concat([base_data, current_data], ignore_index=True), sort=True)
+                    codes = np.where(codes < 0, np.nan, codes)
+                    base_arr[:, col_idx], current_arr[:, col_idx] = codes[:len(base_data)], codes[len(base_data):]
+            _, p_values = ks_2samp_column_blocks(base_arr, current_arr, n_jobs=self.data_validation_config.drift_n_jobs,
+                                                 method=self.data_validation_config.drift_ks_method)
+            for base_col, p_value in zip(base_cols, p_values):
+                # We accept null hypothesis (same distribution) above 0.05
+                drift_report[base_col] = {
+                    "p-values": float(p_value),
+                    "same distribution": bool(p_value > 0.05)
+                }
+            n_drifted = sum(not report["same distribution"] for report in drift_report.values())
+            logging.info(f"Columns with different distribution: {n_drifted} of {len(base_cols)}")
+
             self.validation_error[report_key_name] = drift_report
             
         except Exception as e:
@@ -90,19 +99,65 @@ class DataValidation:
         
     def drop_columns(self, df:pd.DataFrame)->pd.DataFrame:
         try:
-            schema_info = read_yaml_file(self.data_validation_config.schema_file_path)
-            drop_cols = schema_info["drop_columns"]
-            logging.info(f"Dropping columns based on schema provided: {drop_cols}")
-            df.drop(list(drop_cols), axis=1, inplace=True)
+            drop_cols = self.schema.drop_columns
+            logging.info(f"Dropping {len(drop_cols)} columns based on schema provided")
+            logging.debug("Schema drop columns: %s", drop_cols)
+            # columns may already have been left out by the ingestion projection
+            df.drop(list(drop_cols), axis=1, inplace=True, errors="ignore")
             return df
         
         except Exception as e:
             raise SensorException(e, sys)
         
+    def drop_invalid_rows(self, df:pd.DataFrame, unparsable_values:Optional[pd.Series],
+                          invalid_file_path:str, report_key_name:str)->pd.DataFrame:
+        # rows failing the schema dtype / range checks and rows holding feature values that did
+        # not parse as numbers during export are written to the invalid dir in one go, the run
+        # continues with the remaining rows
+        try:
+            invalid_rows, report = self.schema.get_invalid_rows(df)
+            unparsable_rows = np.zeros(len(df), dtype=bool)
+            if unparsable_values is not None:
+                unparsable_rows = unparsable_values.notna().to_numpy()
+                unparsable_counts = dict()
+                for values in unparsable_values[unparsable_rows]:
+                    for col in json.loads(values):
+                        unparsable_counts[col] = unparsable_counts.get(col, 0) + 1
+                logging.info(f"{int(unparsable_rows.sum())} rows hold feature values that are not numbers")
+                invalid_rows |= unparsable_rows
+                report["unparsable_values"] = unparsable_counts
+                report["invalid_rows"] = int(invalid_rows.sum())
+            self.validation_error[report_key_name] = report
+            n_invalid = int(invalid_rows.sum())
+            if n_invalid == 0:
+                return df
+
+            logging.info(f"Moving {n_invalid} of {len(df)} rows failing schema checks to {invalid_file_path}")
+            os.makedirs(self.data_validation_config.invalid_dir, exist_ok=True)
+            invalid_df = df[invalid_rows].reset_index(drop=True)
+            if unparsable_rows.any():
+                # the quarantined rows keep the raw values that did not parse
+                invalid_df[UNPARSABLE_VALUES_COLUMN] = unparsable_values[invalid_rows].to_numpy()
+            self.artifact_store.save_dataframe(invalid_file_path, invalid_df)
+            if n_invalid == len(df):
+                raise Exception(f"All rows failed schema checks, see {invalid_file_path}")
+            return df[~invalid_rows].reset_index(drop=True)
+
+        except Exception as e:
+            raise SensorException(e, sys)
+
     def initiate_data_validation(self)->DataValidationArtifact:
         try:
-            train_df = pd.read_csv(self.data_ingestion_artifact.train_file_path)
-            test_df = pd.read_csv(self.data_ingestion_artifact.test_file_path)
+            # schema drop columns are pruned while parsing
+            columns = self.schema.required_columns + [UNPARSABLE_VALUES_COLUMN]
+            train_df = self.artifact_store.load_dataframe(self.data_ingestion_artifact.train_file_path, self.data_validation_config.schema_file_path,
+                                                          columns=columns)
+            test_df = self.artifact_store.load_dataframe(self.data_ingestion_artifact.test_file_path, self.data_validation_config.schema_file_path,
+                                                         columns=columns)
+            add_stage_rows(len(train_df) + len(test_df))
+            # raw values export could not parse, present only when some row has one
+            train_unparsable_values = train_df.pop(UNPARSABLE_VALUES_COLUMN) if UNPARSABLE_VALUES_COLUMN in train_df.columns else None
+            test_unparsable_values = test_df.pop(UNPARSABLE_VALUES_COLUMN) if UNPARSABLE_VALUES_COLUMN in test_df.columns else None
 
             train_df = self.drop_columns(df=train_df)
             test_df = self.drop_columns(df=test_df)
@@ -127,6 +182,11 @@ class DataValidation:
 
             if not is_exist:
                 raise Exception("Required columns not available in test_df")
+
+            train_df = self.drop_invalid_rows(train_df, train_unparsable_values, self.data_validation_config.invalid_train_file_path,
+                                              report_key_name="train_invalid_rows")
+            test_df = self.drop_invalid_rows(test_df, test_unparsable_values, self.data_validation_config.invalid_test_file_path,
+                                             report_key_name="test_invalid_rows")
             
             if len(train_df.columns) != len(test_df.columns):
                 raise Exception("Train and Test dataframe does not have equal number of columns")
@@ -137,8 +197,11 @@ class DataValidation:
 
             os.makedirs(self.data_validation_config.valid_dir, exist_ok=True)
 
-            train_df.to_csv(self.data_validation_config.valid_train_file_path, header=True, index=False)
-            test_df.to_csv(self.data_validation_config.valid_test_file_path, header=True, index=False)
+            self.artifact_store.save_dataframe(self.data_validation_config.valid_train_file_path, train_df)
+            self.artifact_store.save_dataframe(self.data_validation_config.valid_test_file_path, test_df)
+            if self.data_validation_config.export_csv:
+                self.artifact_store.save_dataframe(self.data_validation_config.valid_train_csv_file_path, train_df)
+                self.artifact_store.save_dataframe(self.data_validation_config.valid_test_csv_file_path, test_df)
 
             data_validation_artifact = DataValidationArtifact(
                 report_file_path=self.data_validation_config.report_file_name,
@@ -1,10 +1,14 @@
 import os, sys
+from typing import Optional
 import pandas as pd
 from sklearn.metrics import f1_score
-from sensor.utils import load_object, read_yaml_file
+from sensor.entity.schema_entity import load_schema
+from sensor.artifact_store import ArtifactStore
 from sensor.entity.config_entity import ModelEvaluationConfig
 from sensor.entity.artifact_entity import DataTransformationArtifact, DataValidationArtifact, ModelTrainerArtifact, ModelEvaluationArtifact
 from sensor.ml.model_resolver import ModelResolver
+from sensor.ml.model_bundle import ModelBundle
+from sensor.metrics import add_stage_rows
 from sensor.exception import SensorException
 from sensor.logger import logging
 
@@ -14,7 +18,8 @@ class ModelEvaluation:
                  model_evaluation_config:ModelEvaluationConfig,
                  data_transformation_artifact:DataTransformationArtifact,
                  data_validation_artifact:DataValidationArtifact,
-                 model_trainer_artifact:ModelTrainerArtifact
+                 model_trainer_artifact:ModelTrainerArtifact,
+                 artifact_store:Optional[ArtifactStore]=None
                  ) -> None:
         try:
             logging.info(f"{'=='*20}  Model Evaluation {'=='*20}")
@@ -22,6 +27,7 @@ class ModelEvaluation:
             self.data_transformation_artifact = data_transformation_artifact
             self.data_validation_artifact = data_validation_artifact
             self.model_trainer_artifact = model_trainer_artifact
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
             self.model_resolver = ModelResolver()
         except Exception as e:
             raise SensorException(e, sys)
@@ -36,42 +42,42 @@ class ModelEvaluation:
                 return model_eval_artifact
             
             # if previous model available
-            logging.info("Finding location and loading objects of previous tranformer, target encoder and model")
-            transformer = load_object(self.model_resolver.get_latest_transformer_path())
-            target_encoder = load_object(self.model_resolver.get_latest_target_encoder_path())
-            model = load_object(self.model_resolver.get_latest_model_path())
+            logging.info("Loading previous model bundle")
+            model_bundle = self.model_resolver.load_latest_bundle()
 
             # Currently trained model
             logging.info("Loading currently trained model")
-            current_transformer = load_object(self.data_transformation_artifact.transformer_object_path)
-            current_target_encoder = load_object(self.data_transformation_artifact.target_encoder_path)
-            current_model = load_object(self.model_trainer_artifact.model_file_path)
+            current_transformer = self.artifact_store.load_object(self.data_transformation_artifact.transformer_object_path)
+            current_target_encoder = self.artifact_store.load_object(self.data_transformation_artifact.target_encoder_path)
+            current_model = self.artifact_store.load_object(self.model_trainer_artifact.model_file_path)
 
             # loading valid data
             logging.info("loading data to test models")
-            test_df = pd.read_csv(self.data_validation_artifact.test_file_path)
-            schema_info = read_yaml_file(self.model_eval_config.schema_file_path)
-            target_col = schema_info['target_column']
+            target_col = load_schema(self.model_eval_config.schema_file_path).target_column
+            # only the features either transformer was fitted on and the target are parsed
+            test_columns = set(model_bundle.feature_names) | set(current_transformer.feature_names_in_) | {target_col}
+            test_df = self.artifact_store.load_dataframe(self.data_validation_artifact.test_file_path,
+                                                        self.model_eval_config.schema_file_path, columns=list(test_columns))
+            add_stage_rows(len(test_df))
 
             # transform target column
             target_df = test_df[target_col]
-            y_true = target_encoder.transform(target_df)
+            y_true = model_bundle.transform_target(target_df)
 
             logging.info("Comparision between previous and curerntly trained model")
             # check prediction with previously trained model
-            input_features = list(transformer.feature_names_in_)
-            input_arr = transformer.transform(test_df[input_features])
-            y_pred = model.predict(input_arr)
-            logging.info(f"Prediction using previous model: {target_encoder.inverse_transform(y_pred[:5])}")
+            y_pred = model_bundle.predict(test_df)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Prediction using previous model: %s", model_bundle.inverse_transform(y_pred[:5]))
             prev_model_score = f1_score(y_true, y_pred)
             logging.info(f"Accuracy score using previous model: {prev_model_score}")
 
-            # check prediction with current model
-            y_true = current_target_encoder.transform(target_df)
-            input_features = list(current_transformer.feature_names_in_)
-            input_arr = current_transformer.transform(test_df[input_features])
-            y_pred = current_model.predict(input_arr)
-            logging.info(f"Prediction using Current model: {current_target_encoder.inverse_transform(y_pred[:5])}")
+            # check prediction with current model, through the same fused path it will be served with
+            current_model_bundle = ModelBundle.from_objects(current_transformer, current_model, current_target_encoder)
+            y_true = current_model_bundle.transform_target(target_df)
+            y_pred = current_model_bundle.predict(test_df)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Prediction using Current model: %s", current_model_bundle.inverse_transform(y_pred[:5]))
             current_model_score = f1_score(y_true, y_pred)
             logging.info(f"Accuracy score using current model: {current_model_score}")
 
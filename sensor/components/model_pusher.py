@@ -1,9 +1,15 @@
 import os, sys
+import shutil
+import hashlib
+from typing import Optional
+import numpy as np
 from sensor.exception import SensorException
 from sensor.logger import logging
-from sensor.utils import load_object,save_object
+from sensor.utils import save_numpy_arrays
+from sensor.ml.model_bundle import ModelBundle
+from sensor.artifact_store import ArtifactStore
 from sensor.ml.model_resolver import ModelResolver
-from sensor.entity.config_entity import ModelPusherConfig
+from sensor.entity.config_entity import ModelPusherConfig, FEATURE_PROFILE_FILE_NAME
 from sensor.entity.artifact_entity import DataTransformationArtifact, ModelTrainerArtifact, ModelPusherArtifact
 
 
@@ -12,12 +18,14 @@ class ModelPusher:
 
     def __init__(self,model_pusher_config:ModelPusherConfig,
                         data_transformation_artifact:DataTransformationArtifact,
-                        model_trainer_artifact:ModelTrainerArtifact):
+                        model_trainer_artifact:ModelTrainerArtifact,
+                        artifact_store:Optional[ArtifactStore]=None):
         try:
             logging.info(f"{'>>'*20} Model Pusher {'<<'*20}")
             self.model_pusher_config = model_pusher_config
             self.data_transformation_artifact = data_transformation_artifact
             self.model_trainer_artifact = model_trainer_artifact
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
             self.model_resolver = ModelResolver(model_registry=self.model_pusher_config.saved_model_dir)
         except Exception as e:
             raise SensorException(e, sys)
@@ -26,9 +34,10 @@ class ModelPusher:
         try:
             #load object
             logging.info(f"Loading transformer model and target encoder")
-            transformer = load_object(file_path=self.data_transformation_artifact.transformer_object_path)
-            model = load_object(file_path=self.model_trainer_artifact.model_file_path)
-            target_encoder = load_object(file_path=self.data_transformation_artifact.target_encoder_path)
+            transformer = self.artifact_store.load_object(file_path=self.data_transformation_artifact.transformer_object_path)
+            model = self.artifact_store.load_object(file_path=self.model_trainer_artifact.model_file_path)
+            target_encoder = self.artifact_store.load_object(file_path=self.data_transformation_artifact.target_encoder_path)
+            feature_profile = self.artifact_store.load_numpy_arrays(file_path=self.data_transformation_artifact.feature_profile_path)
 
             #model pusher dir
             # logging.info(f"Saving model into model pusher directory")
@@ -38,14 +47,28 @@ class ModelPusher:
 
 
             #saved model dir
-            logging.info(f"Saving model in saved model dir")
-            transformer_path=self.model_resolver.get_latest_save_transformer_path()
-            model_path=self.model_resolver.get_latest_save_model_path()
-            target_encoder_path=self.model_resolver.get_latest_save_target_encoder_path()
-        
-            save_object(file_path=transformer_path, obj=transformer)
-            save_object(file_path=model_path, obj=model)
-            save_object(file_path=target_encoder_path, obj=target_encoder)
+            # hash of the transformed training data the model was fitted on
+            train_arr = np.ascontiguousarray(self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_train_path))
+            data_hash = hashlib.sha256(train_arr.data).hexdigest()
+
+            logging.info(f"Saving model bundle in saved model dir")
+            staging_dir = self.model_resolver.get_staging_dir_path()
+            try:
+                bundle_dir_path = os.path.join(staging_dir, self.model_resolver.bundle_dir_name)
+                feature_profile_path = os.path.join(staging_dir, self.model_resolver.feature_profile_dir_name, FEATURE_PROFILE_FILE_NAME)
+                model_bundle = ModelBundle.from_objects(transformer=transformer, model=model, target_encoder=target_encoder)
+                model_bundle.save(bundle_dir_path)
+                save_numpy_arrays(file_path=feature_profile_path, arrays=feature_profile)
+            except Exception:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+
+            self.model_resolver.publish(staging_dir, metadata={
+                "f1_train_score": float(self.model_trainer_artifact.f1_train_score),
+                "f1_test_score": float(self.model_trainer_artifact.f1_test_score),
+                "data_hash": data_hash,
+                "format": "bundle",
+            })
 
             model_pusher_artifact = ModelPusherArtifact(pusher_model_dir=self.model_pusher_config.pusher_model_dir,
             saved_model_dir=self.model_pusher_config.saved_model_dir)
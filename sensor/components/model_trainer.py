@@ -1,52 +1,127 @@
 import os, sys
+import json
+from typing import Optional
+import numpy as np
+import xgboost as xgb
 from xgboost import XGBClassifier
 from sklearn.metrics import f1_score
 from sensor.entity.config_entity import ModelTrainerConfig
-from sensor.entity.artifact_entity import DataTransformationArtifact, ModelTrainerArtifact
-from sensor.utils import load_numpy_array, save_object
+from sensor.entity.artifact_entity import DataTransformationArtifact, ModelTunerArtifact, ModelTrainerArtifact
+from sensor.artifact_store import ArtifactStore
+from sensor.utils import read_yaml_file
+from sensor.metrics import add_stage_rows
 from sensor.exception import SensorException
 from sensor.logger import logging
 
 
 class ModelTrainer:
     def __init__(self, model_trainer_config:ModelTrainerConfig,
-                 data_transformation_artifact:DataTransformationArtifact
+                 data_transformation_artifact:DataTransformationArtifact,
+                 artifact_store:Optional[ArtifactStore]=None,
+                 model_tuner_artifact:Optional[ModelTunerArtifact]=None
                  ) -> None:
         try:
             logging.info(f"{'==='*20}Model Trainer{'==='*20}")
             self.data_transformation_artifact = data_transformation_artifact
+            self.model_tuner_artifact = model_tuner_artifact
             self.model_trainer_config = model_trainer_config
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
         except Exception as e:
             raise SensorException(e, sys)
-    
-    @staticmethod
-    def train_model(x, y):
+
+    def get_dmatrix(self, x:np.ndarray, y:np.ndarray, ref:Optional[xgb.DMatrix]=None) -> xgb.DMatrix:
+        # hist trains on pre-binned data; matrices built with the train matrix as ref share its bins
+        try:
+            if self.model_trainer_config.tree_method == "hist":
+                return xgb.QuantileDMatrix(x, y, ref=ref, max_bin=self.model_trainer_config.max_bin,
+                                           nthread=self.model_trainer_config.nthread)
+            return xgb.DMatrix(x, y, nthread=self.model_trainer_config.nthread)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_model_params(self, scale_pos_weight:float=1.0) -> dict:
         try:
-            xgb_clf = XGBClassifier()
-            xgb_clf.fit(x, y)
+            params = {
+                "n_estimators": self.model_trainer_config.n_estimators,
+                "learning_rate": self.model_trainer_config.learning_rate,
+                "max_depth": self.model_trainer_config.max_depth,
+                "tree_method": self.model_trainer_config.tree_method,
+                "max_bin": self.model_trainer_config.max_bin,
+                "n_jobs": self.model_trainer_config.nthread,
+                "scale_pos_weight": scale_pos_weight,
+                "objective": "binary:logistic",
+                "eval_metric": "logloss",
+            }
+            if self.model_tuner_artifact is not None:
+                # the best trial of the search overrides the configured hyperparameters
+                tuned_params = read_yaml_file(self.model_tuner_artifact.best_params_file_path)
+                logging.info(f"Using tuned hyperparameters: {tuned_params}")
+                params.update(tuned_params)
+            return params
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def train_model(self, dtrain:xgb.DMatrix, dvalid:Optional[xgb.DMatrix]=None, scale_pos_weight:float=1.0) -> XGBClassifier:
+        try:
+            xgb_clf = XGBClassifier(**self.get_model_params(scale_pos_weight=scale_pos_weight))
+            params = xgb_clf.get_xgb_params()
+            evals = [] if dvalid is None else [(dvalid, "valid")]
+            early_stopping_rounds = None if dvalid is None else self.model_trainer_config.early_stopping_rounds
+            booster = xgb.train(params, dtrain, num_boost_round=xgb_clf.n_estimators,
+                                evals=evals, early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+            if early_stopping_rounds is not None:
+                logging.info(f"Early stopping kept {booster.best_iteration + 1} of {booster.num_boosted_rounds()} rounds")
+                booster = booster[:booster.best_iteration + 1]
+            # load_model restores a fitted classifier from the booster and the scikit-learn metadata
+            # XGBClassifier.save_model stores with it
+            booster.set_attr(scikit_learn=json.dumps({"_estimator_type": "classifier", "n_classes_": 2, "classes_": [0, 1]}))
+            xgb_clf.load_model(bytearray(booster.save_raw(raw_format="ubj")))
             return xgb_clf
         except Exception as e:
             raise SensorException(e, sys)
-        
+
+    @staticmethod
+    def predict_labels(model:XGBClassifier, data:xgb.DMatrix) -> np.ndarray:
+        try:
+            return (model.get_booster().predict(data) > 0.5).astype(int)
+        except Exception as e:
+            raise SensorException(e, sys)
+
     def initiate_model_trainer(self) -> ModelTrainerArtifact:
         try:
             logging.info("loading train and test array")
-            train_arr = load_numpy_array(self.data_transformation_artifact.transformed_train_path)
-            test_arr = load_numpy_array(self.data_transformation_artifact.transformed_test_path)
+            train_arr = self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_train_path)
+            test_arr = self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_test_path)
+            add_stage_rows(len(train_arr) + len(test_arr))
 
             logging.info("Split features and targets")
-            x_train, y_train = train_arr[:, :-1], train_arr[:, -1]
-            x_test, y_test = test_arr[:, :-1], test_arr[:, -1]
+            x_train, y_train = train_arr[:, :-1].astype(np.float32), train_arr[:, -1]
+            x_test, y_test = test_arr[:, :-1].astype(np.float32), test_arr[:, -1]
+
+            # early stopping scores the holdout split off before resampling, never synthetic rows
+            valid_arr = None
+            if self.model_trainer_config.early_stopping_rounds is not None:
+                if self.data_transformation_artifact.transformed_valid_path is None:
+                    logging.info("No validation holdout, training all rounds without early stopping")
+                else:
+                    valid_arr = self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_valid_path)
+
+            logging.info(f"Building {self.model_trainer_config.tree_method} training matrices")
+            dtrain = self.get_dmatrix(x_train, y_train)
+            dvalid = None
+            if valid_arr is not None:
+                dvalid = self.get_dmatrix(valid_arr[:, :-1].astype(np.float32), valid_arr[:, -1], ref=dtrain)
+            dtest = self.get_dmatrix(x_test, y_test, ref=dtrain)
 
             logging.info("Train model")
-            model = ModelTrainer.train_model(x_train, y_train)
+            model = self.train_model(dtrain, dvalid, scale_pos_weight=self.data_transformation_artifact.scale_pos_weight)
 
             logging.info("Calculating f1 train score")
-            y_hat_train = model.predict(x_train)
+            y_hat_train = ModelTrainer.predict_labels(model, dtrain)
             f1_train_score = f1_score(y_train, y_hat_train)
 
             logging.info("Calculating f1 test score")
-            y_hat_test = model.predict(x_test)
+            y_hat_test = ModelTrainer.predict_labels(model, dtest)
             f1_test_score = f1_score(y_test, y_hat_test)
 
             logging.info(f"train score:{f1_train_score} and tests score {f1_test_score}")
@@ -55,15 +130,15 @@ class ModelTrainer:
             if f1_test_score < self.model_trainer_config.expected_score:
                 raise Exception(f"Model is not good as it is not able to give \
                 expected accuracy: {self.model_trainer_config.expected_score}: model actual score: {f1_test_score}")
-            
+
             logging.info(f"Checking if our model is overfiiting or not")
             diff = abs(f1_train_score-f1_test_score)
 
             if diff > self.model_trainer_config.overfitting_threshold:
                 raise Exception(f"Train and test score diff: {diff} is more than overfitting threshold {self.model_trainer_config.overfitting_threshold}")
-            
+
             logging.info("saving the trained model")
-            save_object(self.model_trainer_config.model_path, model)
+            self.artifact_store.save_object(self.model_trainer_config.model_path, model)
 
             # prepare artifact
             model_trainer_artifact = ModelTrainerArtifact(
@@ -77,4 +152,4 @@ class ModelTrainer:
 
         except Exception as e:
             raise SensorException(e, sys)
-        
\ No newline at end of file
+
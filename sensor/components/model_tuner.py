@@ -0,0 +1,91 @@
+import os, sys
+import shutil
+from typing import Optional
+import numpy as np
+from sensor.entity.config_entity import ModelTunerConfig
+from sensor.entity.artifact_entity import DataTransformationArtifact, ModelTunerArtifact
+from sensor.artifact_store import ArtifactStore
+from sensor.ml.tuning import run_hyperband, get_best_trial
+from sensor.metrics import add_stage_rows
+from sensor.utils import write_yaml_file
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+class ModelTuner:
+    def __init__(self, model_tuner_config:ModelTunerConfig,
+                 data_transformation_artifact:DataTransformationArtifact,
+                 artifact_store:Optional[ArtifactStore]=None
+                 ) -> None:
+        try:
+            logging.info(f"{'==='*20}Model Tuner{'==='*20}")
+            self.model_tuner_config = model_tuner_config
+            self.data_transformation_artifact = data_transformation_artifact
+            self.artifact_store = artifact_store if artifact_store is not None else ArtifactStore(in_memory=False)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save_shared_arrays(self, shared_dir:str):
+        # resampled train rows first and the holdout rows last in one float32 file the trial workers memory map;
+        # the trials are scored on the holdout, which was split off before resampling
+        try:
+            if self.data_transformation_artifact.transformed_valid_path is None:
+                raise Exception("The model tuner scores trials on the validation holdout, set DataTransformationConfig.validation_fraction")
+            train_arr = self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_train_path)
+            valid_arr = self.artifact_store.load_numpy_array(self.data_transformation_artifact.transformed_valid_path)
+            add_stage_rows(len(train_arr) + len(valid_arr))
+            x_fit, y_fit = train_arr[:, :-1], train_arr[:, -1]
+            x_valid, y_valid = valid_arr[:, :-1], valid_arr[:, -1]
+            os.makedirs(shared_dir, exist_ok=True)
+            features_path = os.path.join(shared_dir, "features.npy")
+            target_path = os.path.join(shared_dir, "target.npy")
+            features = np.lib.format.open_memmap(features_path, mode="w+", dtype=np.float32,
+                                                 shape=(len(y_fit) + len(y_valid), x_fit.shape[1]))
+            features[:len(y_fit)] = x_fit
+            features[len(y_fit):] = x_valid
+            features.flush()
+            del features
+            np.save(target_path, np.concatenate([y_fit, y_valid]).astype(np.int32))
+            return features_path, target_path, len(y_fit)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def initiate_model_tuner(self) -> ModelTunerArtifact:
+        try:
+            shared_dir = os.path.join(self.model_tuner_config.model_tuner_dir, "shared")
+            try:
+                logging.info("Writing train array for the trial workers")
+                features_path, target_path, n_fit = self.save_shared_arrays(shared_dir)
+
+                logging.info(f"Running {self.model_tuner_config.strategy} search with {self.model_tuner_config.n_jobs} workers "
+                             f"and a {self.model_tuner_config.time_budget}s budget")
+                trials = run_hyperband(features_path, target_path, n_fit,
+                                       search_space=self.model_tuner_config.search_space,
+                                       min_resource=self.model_tuner_config.min_resource,
+                                       max_resource=self.model_tuner_config.max_resource,
+                                       eta=self.model_tuner_config.eta,
+                                       strategy=self.model_tuner_config.strategy,
+                                       time_budget=self.model_tuner_config.time_budget,
+                                       n_jobs=self.model_tuner_config.n_jobs,
+                                       max_bin=self.model_tuner_config.max_bin,
+                                       random_state=self.model_tuner_config.random_state)
+            finally:
+                shutil.rmtree(shared_dir, ignore_errors=True)
+
+            write_yaml_file(self.model_tuner_config.trials_file_path, {"trials": trials})
+            best_trial = get_best_trial(trials)
+            if best_trial is None:
+                raise Exception(f"No trial finished within the {self.model_tuner_config.time_budget}s search budget")
+            logging.info(f"Best trial {best_trial['trial_id']} with f1 {best_trial['f1_score']}: {best_trial['params']}")
+            best_params = dict(best_trial["params"], n_estimators=best_trial["n_estimators"])
+            write_yaml_file(self.model_tuner_config.best_params_file_path, best_params)
+
+            model_tuner_artifact = ModelTunerArtifact(
+                trials_file_path=self.model_tuner_config.trials_file_path,
+                best_params_file_path=self.model_tuner_config.best_params_file_path,
+                best_score=best_trial["f1_score"]
+            )
+            logging.info(f"Model Tuner Artifact: {model_tuner_artifact}")
+            return model_tuner_artifact
+        except Exception as e:
+            raise SensorException(e, sys)
@@ -1,16 +1,64 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import os
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+import threading
 
 MONGO_DB_URL_ENV_KEY = "MONGO_DB_URL"
+CSV_ENGINE_ENV_KEY = "SENSOR_CSV_ENGINE"
+MONGO_MAX_POOL_SIZE_ENV_KEY = "SENSOR_MONGO_MAX_POOL_SIZE"
 
 @dataclass
 class EnvironmentVariable:
-    mongo_db_url:str = os.getenv(MONGO_DB_URL_ENV_KEY)
+    mongo_db_url:str = field(default_factory=lambda: os.getenv(MONGO_DB_URL_ENV_KEY))
+    # "pyarrow" parses csv files multithreaded, needs the optional pyarrow package
+    csv_engine:str = field(default_factory=lambda: os.getenv(CSV_ENGINE_ENV_KEY, "c"))
+    # connections shared by all threads, caps the number of concurrent export cursors
+    mongo_max_pool_size:int = field(default_factory=lambda: int(os.getenv(MONGO_MAX_POOL_SIZE_ENV_KEY, "16")))
 
 
-env_var = EnvironmentVariable()
+# Nothing here runs on import: the .env file is read and the client is built on first use,
+# so importing the package never touches the file system or the network.
+_env_file_loaded = False
+_env_var = None
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
 
-mongo_client = MongoClient(env_var.mongo_db_url, connectTimeoutMS=None, server_api=ServerApi('1'))
 
+def load_env_file() -> None:
+    # variables already set in the environment are kept
+    global _env_file_loaded
+    if not _env_file_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()  # take environment variables from .env.
+        _env_file_loaded = True
+
+
+def get_env_var() -> EnvironmentVariable:
+    global _env_var
+    if _env_var is None:
+        from sensor.logger import configure_logging
+        load_env_file()
+        # the log settings may come from the same .env file
+        configure_logging()
+        _env_var = EnvironmentVariable()
+    return _env_var
+
+
+def get_mongo_client():
+    # one MongoClient per process; its connection pool is shared by every thread using it
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                from pymongo.mongo_client import MongoClient
+                from pymongo.server_api import ServerApi
+                env_var = get_env_var()
+                _mongo_client = MongoClient(env_var.mongo_db_url, connectTimeoutMS=None, server_api=ServerApi('1'),
+                                            maxPoolSize=env_var.mongo_max_pool_size)
+    return _mongo_client
+
+
+def set_mongo_client(mongo_client) -> None:
+    # replaces the process client, e.g. with an in-process mock for benchmarks
+    global _mongo_client
+    with _mongo_client_lock:
+        _mongo_client = mongo_client
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 
@@ -23,6 +24,17 @@ class DataTransformationArtifact:
     transformed_train_path:str 
     transformed_test_path:str 
     target_encoder_path:str
+    feature_profile_path:str
+    scale_pos_weight:float
+    # train rows held out before resampling, None when no holdout was kept
+    transformed_valid_path:Optional[str] = None
+
+
+@dataclass
+class ModelTunerArtifact:
+    trials_file_path:str
+    best_params_file_path:str
+    best_score:float
 
 
 @dataclass
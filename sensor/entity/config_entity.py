@@ -5,15 +5,30 @@ from sensor.exception import SensorException
 
 TRAIN_FILE_NAME = "train.csv"
 TEST_FILE_NAME = "test.csv"
+VALID_FILE_NAME = "valid.csv"
 TRANSFORMER_OBJECT_FILE_NAME = "transformer.pkl"
 TARGET_ENCODER_OBJECT_FILE_NAME = "target_encoder.pkl"
 MODEL_FILE_NAME = "model.pkl"
+FEATURE_PROFILE_FILE_NAME = "feature_profile.npz"
+METRICS_FILE_NAME = "metrics.json"
+# format of the dataframes passed between stages: feather, parquet or csv
+ARTIFACT_FILE_FORMAT = "feather"
 
 class TrainingPipelineConfig:
     def __init__(self) -> None:
         try:
             timestamp = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
-            self.artifact_dir = os.path.join('datadir', 'artifact', timestamp)
+            self.artifact_root_dir = os.path.join('datadir', 'artifact')
+            self.artifact_dir = os.path.join(self.artifact_root_dir, timestamp)
+            # wall time, cpu time, rows and peak memory of every stage of the run
+            self.metrics_file_path = os.path.join(self.artifact_dir, METRICS_FILE_NAME)
+            # reuse stage outputs of earlier runs with identical inputs, config and code
+            self.use_stage_cache = True
+            self.stage_cache_max_size = 5 * 1024**3
+            # keep stage outputs in memory for the next stage and persist them in the background
+            self.in_memory_artifacts = True
+            # run the hyperparameter search stage between transformation and training
+            self.use_model_tuner = False
         except Exception as e:
             raise SensorException(e, sys)
 
@@ -23,11 +38,22 @@ class DataIngestionConfig:
         try:
             data_ingestion_dir = os.path.join(training_pipeline_config.artifact_dir, "data_ingestion")
             self.dataset_dir = os.path.join(data_ingestion_dir, "dataset")
-            self.train_file_path = os.path.join(self.dataset_dir, TRAIN_FILE_NAME)
-            self.test_file_path = os.path.join(self.dataset_dir, TEST_FILE_NAME)
+            self.file_format = ARTIFACT_FILE_FORMAT
+            self.train_file_path = os.path.join(self.dataset_dir, TRAIN_FILE_NAME.replace("csv", self.file_format))
+            self.test_file_path = os.path.join(self.dataset_dir, TEST_FILE_NAME.replace("csv", self.file_format))
+            # csv copies of the datasets, only written for debugging
+            self.export_csv = False
+            self.train_csv_file_path = os.path.join(self.dataset_dir, TRAIN_FILE_NAME)
+            self.test_csv_file_path = os.path.join(self.dataset_dir, TEST_FILE_NAME)
             self.database_name = "sensor"
             self.collection_name = "sensor_readings"
             self.test_size = 0.2
+            self.schema_file_path = os.path.join("schema.yaml")
+            self.export_batch_size = 10000
+            # _id ranges of the collection read concurrently, 1 reads it through a single cursor
+            self.export_n_workers = 4
+            self.use_snapshot = True
+            self.snapshot_dir = os.path.join("datadir", "snapshot")
         except Exception as e:
             raise SensorException(e, sys)
 
@@ -39,13 +65,22 @@ class DataValidationConfig:
             data_vaildation_dir = os.path.join(training_pipeline_config.artifact_dir, "data_validation")
             self.valid_dir = os.path.join(data_vaildation_dir, "valid")
             self.invalid_dir = os.path.join(data_vaildation_dir, "invalid")
-            self.valid_train_file_path = os.path.join(self.valid_dir, TRAIN_FILE_NAME)
-            self.invalid_train_file_path = os.path.join(self.invalid_dir, TRAIN_FILE_NAME)
-            self.valid_test_file_path = os.path.join(self.valid_dir, TEST_FILE_NAME)
-            self.invalid_test_file_path = os.path.join(self.invalid_dir, TEST_FILE_NAME)
+            self.file_format = ARTIFACT_FILE_FORMAT
+            self.valid_train_file_path = os.path.join(self.valid_dir, TRAIN_FILE_NAME.replace("csv", self.file_format))
+            self.invalid_train_file_path = os.path.join(self.invalid_dir, TRAIN_FILE_NAME.replace("csv", self.file_format))
+            self.valid_test_file_path = os.path.join(self.valid_dir, TEST_FILE_NAME.replace("csv", self.file_format))
+            self.invalid_test_file_path = os.path.join(self.invalid_dir, TEST_FILE_NAME.replace("csv", self.file_format))
+            # csv copies of the valid datasets, only written for debugging
+            self.export_csv = False
+            self.valid_train_csv_file_path = os.path.join(self.valid_dir, TRAIN_FILE_NAME)
+            self.valid_test_csv_file_path = os.path.join(self.valid_dir, TEST_FILE_NAME)
             self.report_file_name = os.path.join(data_vaildation_dir, "report", "report.yaml")
             self.schema_file_path = os.path.join("schema.yaml")
             self.missing_threshold = 0.7
+            # processes for the drift tests, 1 runs them in the calling process
+            self.drift_n_jobs = 1
+            # p-values of the drift tests, one of sensor.ml.drift.KS_METHODS
+            self.drift_ks_method = "auto"
         except Exception as e:
             raise SensorException(e, sys)
 
@@ -56,13 +91,50 @@ class DataTransformationConfig:
             self.transformer_obj_dir = os.path.join(self.transformation_dir, "transformer")
             self.transformer_obj_path = os.path.join(self.transformer_obj_dir, TRANSFORMER_OBJECT_FILE_NAME)
             self.target_encoder_obj_path = os.path.join(self.transformation_dir, "target_encoder", TARGET_ENCODER_OBJECT_FILE_NAME)
+            self.feature_profile_path = os.path.join(self.transformation_dir, "feature_profile", FEATURE_PROFILE_FILE_NAME)
+            self.profile_n_bins = 10
+            # one of sensor.ml.resampling.RESAMPLING_STRATEGIES
+            self.resampling_strategy = "smote_tomek"
+            # processes for the resampling neighbour searches, -1 uses every core
+            self.resampling_n_jobs = -1
+            self.resample_test_set = True
+            # stratified share of the train rows held out before resampling, for early stopping and
+            # the tuner's trials, so no synthetic neighbour of a fit row is scored; 0 keeps none
+            self.validation_fraction = 0.1
             self.transformed_data = os.path.join(self.transformation_dir, "transformed_data")
             self.transformed_train_path = os.path.join(self.transformed_data, TRAIN_FILE_NAME.replace("csv", "npz"))
             self.transformed_test_path = os.path.join(self.transformed_data, TEST_FILE_NAME.replace("csv", "npz"))
+            self.transformed_valid_path = os.path.join(self.transformed_data, VALID_FILE_NAME.replace("csv", "npz"))
             self.schema_file_path = os.path.join("schema.yaml")
         except Exception as e:
             raise SensorException(e, sys)
 
+class ModelTunerConfig:
+    def __init__(self, training_pipeline_config:TrainingPipelineConfig) -> None:
+        try:
+            self.model_tuner_dir = os.path.join(training_pipeline_config.artifact_dir, "model_tuner")
+            self.trials_file_path = os.path.join(self.model_tuner_dir, "trials.yaml")
+            self.best_params_file_path = os.path.join(self.model_tuner_dir, "best_params.yaml")
+            # hyperband or successive_halving, the resource is the number of boosting rounds
+            self.strategy = "hyperband"
+            self.min_resource = 10
+            self.max_resource = 270
+            self.eta = 3
+            # parameter: [low, high, kind], kind is int, float or log (log uniform)
+            self.search_space = {
+                "learning_rate": [0.01, 0.3, "log"],
+                "max_depth": [3, 10, "int"],
+                "min_child_weight": [1, 10, "log"],
+                "subsample": [0.5, 1.0, "float"],
+                "colsample_bytree": [0.5, 1.0, "float"],
+            }
+            self.time_budget = 600
+            self.n_jobs = os.cpu_count()
+            self.max_bin = 256
+            self.random_state = 42
+        except Exception as e:
+            raise SensorException(e, sys)
+
 class ModelTrainerConfig:
     def __init__(self, training_pipeline_config:TrainingPipelineConfig) -> None:
         try:
@@ -70,6 +142,16 @@ class ModelTrainerConfig:
             self.model_path = os.path.join(model_trainer_dir, "model", MODEL_FILE_NAME)
             self.expected_score = 0.7
             self.overfitting_threshold = 0.1
+            # xgboost hyperparameters
+            self.n_estimators = 100
+            self.learning_rate = 0.3
+            self.max_depth = 6
+            # performance profile: "hist" trains on a float32 QuantileDMatrix, "approx" on a DMatrix
+            self.tree_method = "hist"
+            self.nthread = os.cpu_count()
+            self.max_bin = 256
+            # early stopping on the validation holdout of the data transformation, None trains all rounds
+            self.early_stopping_rounds = 10
         except Exception as e:
             raise SensorException(e, sys)
 
@@ -93,9 +175,40 @@ class BatchPredictionConfig:
             self.inbox_dir = os.path.join("datadir", "data", "inbox")
             self.outbox_dir = os.path.join("datadir", "data", "outbox")
             self.archive_dir = os.path.join("datadir", "data", "archive")
+            # per file results of every batch run
+            self.report_dir = os.path.join("datadir", "data", "report")
+            self.schema_file_path = os.path.join("schema.yaml")
+            # features with a population stability index above this are reported as drifted
+            self.psi_threshold = 0.2
+            # inbox files processed in parallel, 1 processes them one by one in this process
+            self.n_workers = os.cpu_count()
+            # rows read, predicted and written at a time, None processes whole files at once
+            self.chunk_size = 100_000
+            # chunks of a file read ahead and waiting to be written, so reading, predicting and writing
+            # of one file overlap in threads; 0 does them one after the other
+            self.pipeline_depth = 2
             os.makedirs(self.inbox_dir, exist_ok=True)
             os.makedirs(self.outbox_dir ,exist_ok=True)
             os.makedirs(self.archive_dir,exist_ok=True)
         except Exception as e:
             raise SensorException(e, sys)        
 
+
+
+class ScoringServiceConfig:
+    def __init__(self, host:str="127.0.0.1", port:int=8000):
+        try:
+            self.host = host
+            self.port = port
+            self.model_registry = os.path.join("datadir", "saved_models")
+            self.schema_file_path = os.path.join("schema.yaml")
+            # a micro-batch is scored once it has max_batch_rows rows or its first request has
+            # waited batch_window_ms
+            self.batch_window_ms = 2
+            self.max_batch_rows = 1024
+            # larger requests are rejected, they belong in the inbox
+            self.max_request_rows = 10_000
+            # most recent request latencies the percentiles are computed over
+            self.latency_sample_size = 10_000
+        except Exception as e:
+            raise SensorException(e, sys)
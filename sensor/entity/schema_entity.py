@@ -0,0 +1,92 @@
+import os, sys
+import threading
+from typing import Dict, List, Tuple
+import yaml
+import numpy as np
+import pandas as pd
+from sensor.exception import SensorException
+
+
+class Schema:
+    # schema.yaml parsed once into the lookups the pipeline needs. The optional
+    # `target_values` and `feature_range` (min / max) entries drive the row validation.
+
+    def __init__(self, schema_info:dict) -> None:
+        try:
+            self.target_column = schema_info['target_column']
+            self.drop_columns = list(schema_info['drop_columns'])
+            self.required_columns = list(schema_info['required_columns'])
+            self.required_column_set = frozenset(self.required_columns)
+            self.feature_columns = [col for col in self.required_columns if col != self.target_column]
+            # columns worth reading from any source, schema drop columns are never used
+            self.used_columns = [col for col in self.required_columns if col not in set(self.drop_columns)]
+            target_values = schema_info.get('target_values')
+            self.target_values = None if target_values is None else [str(value) for value in target_values]
+            feature_range = schema_info.get('feature_range') or dict()
+            self.feature_min = feature_range.get('min')
+            self.feature_max = feature_range.get('max')
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_missing_columns(self, columns) -> List[str]:
+        try:
+            present = set(columns)
+            return [col for col in self.required_columns if col not in present]
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_invalid_rows(self, df:pd.DataFrame) -> Tuple[np.ndarray, Dict[str, dict]]:
+        # One sweep over the feature block: non numeric feature columns, values outside
+        # feature_range and target values outside target_values. Returns the mask of failing
+        # rows and a report of the failing columns. NAN is missing, not invalid.
+        try:
+            report = dict()
+            invalid_rows = np.zeros(len(df), dtype=bool)
+            feature_cols = [col for col in df.columns if col in self.required_column_set and col != self.target_column]
+            non_numeric_cols = [col for col in feature_cols if not pd.api.types.is_numeric_dtype(df[col])]
+            if len(non_numeric_cols) > 0:
+                report["non_numeric_columns"] = non_numeric_cols
+                feature_cols = [col for col in feature_cols if col not in set(non_numeric_cols)]
+
+            if len(feature_cols) > 0 and (self.feature_min is not None or self.feature_max is not None):
+                arr = df[feature_cols].to_numpy(dtype=np.float32, copy=False)
+                out_of_range = np.zeros(arr.shape, dtype=bool)
+                if self.feature_min is not None:
+                    out_of_range |= arr < self.feature_min
+                if self.feature_max is not None:
+                    out_of_range |= arr > self.feature_max
+                column_counts = out_of_range.sum(axis=0)
+                invalid_rows |= out_of_range.any(axis=1)
+                report["out_of_range_values"] = {col: int(count) for col, count in zip(feature_cols, column_counts) if count > 0}
+
+            if self.target_values is not None and self.target_column in df.columns:
+                invalid_target = ~df[self.target_column].isin(self.target_values).to_numpy()
+                invalid_rows |= invalid_target
+                report["invalid_target_values"] = int(invalid_target.sum())
+
+            report["invalid_rows"] = int(invalid_rows.sum())
+            return invalid_rows, report
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+_schema_cache:Dict[str, Tuple[int, Schema]] = dict()
+_schema_cache_lock = threading.Lock()
+
+
+def load_schema(schema_file_path:str) -> Schema:
+    # compiled schema, parsed again only when the file's mtime changes
+    try:
+        file_path = os.path.abspath(schema_file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        with _schema_cache_lock:
+            cached = _schema_cache.get(file_path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        with open(file_path, "rb") as yaml_file:
+            schema = Schema(yaml.safe_load(yaml_file))
+        with _schema_cache_lock:
+            _schema_cache[file_path] = (mtime, schema)
+        return schema
+    except Exception as e:
+        raise SensorException(e, sys)
@@ -13,8 +13,14 @@ class SensorException(Exception):
         _, _, exc_tb = error_detail.exc_info()
         file_name = exc_tb.tb_frame.f_code.co_filename
         line_no = exc_tb.tb_lineno
+        wrapped_error = error_message
         error_message = f"Error occured in script name [{file_name}] on line no. [{line_no}], error message: [{error_message}]"
-        logging.info(error_message)
+        # the original error is logged once where it is first wrapped, every re-raise layer
+        # would otherwise log the whole message again
+        if isinstance(wrapped_error, SensorException):
+            logging.debug("Re-raised at %s line %s", file_name, line_no)
+        else:
+            logging.info(error_message)
 
         return error_message
     
@@ -1,18 +1,151 @@
 import logging
-from datetime import datetime
+import logging.handlers
+from datetime import datetime, timezone
 import os
+import json
+import queue
+import sys
+import atexit
+import threading
+import uuid
 
 
 LOG_FILE_NAME = f"{datetime.now().strftime('%m%d%Y__%H%M%S')}.log"
 
 LOG_DIR = "datadir/logs"
 
-os.makedirs(LOG_DIR, exist_ok=True)
-
 LOG_FILE_PATH = os.path.join(LOG_DIR, LOG_FILE_NAME)
 
+# "text" for the classic log lines, "json" for one JSON object per line
+LOG_FORMAT_ENV_KEY = "SENSOR_LOG_FORMAT"
+# DEBUG adds the full column lists and other large payloads
+LOG_LEVEL_ENV_KEY = "SENSOR_LOG_LEVEL"
+# set it to correlate the logs of processes belonging to one run, a random id otherwise
+RUN_ID_ENV_KEY = "SENSOR_RUN_ID"
+
+# the settings above are read by configure_logging, once the .env file is loaded
+RUN_ID = None
+
+TEXT_LOG_FORMAT = "[ %(asctime)s] %(lineno)d %(name)s - %(levelname)s %(message)s"
+
+
+class LazyFileHandler(logging.FileHandler):
+    # the log directory and file are created by the first record, not on import
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record:logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "run_id": RUN_ID,
+            "level": record.levelname,
+            "name": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # Records are put on a queue and written by a listener thread, so the calling thread never
+    # waits for the disk. The listener starts with the first record, and a forked child gets its
+    # own queue and listener since the parent's thread does not exist there.
+
+    def __init__(self, handler:logging.Handler) -> None:
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self.listener = None
+        self.listener_lock = threading.Lock()
+        # set once stopped at exit, records logged after that are written on the calling thread
+        self.stopped = False
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        # only the message is merged here, in case the arguments change later; the formatting
+        # (time, json, traceback text) happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record:logging.LogRecord) -> None:
+        if self.stopped:
+            self.handler.handle(record)
+            return
+        if self.listener is None:
+            self.start()
+        super().enqueue(record)
+
+    def start(self) -> None:
+        configure_logging()
+        with self.listener_lock:
+            if self.listener is None:
+                listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+                listener.start()
+                self.listener = listener
+                atexit.register(self.stop)
+                # multiprocessing children leave through os._exit, skipping atexit but not its finalizers
+                if "multiprocessing" in sys.modules:
+                    import multiprocessing.util
+                    multiprocessing.util.Finalize(None, self.stop, exitpriority=100)
+
+    def stop(self) -> None:
+        # writes everything still queued, then stops the listener thread
+        with self.listener_lock:
+            self.stopped = True
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+        self.handler.flush()
+
+    def reset_after_fork(self) -> None:
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.listener_lock = threading.Lock()
+        self.stopped = False
+
+
+def get_log_formatter() -> logging.Formatter:
+    if os.getenv(LOG_FORMAT_ENV_KEY, "text").lower() == "json":
+        return JsonLinesFormatter()
+    return logging.Formatter(TEXT_LOG_FORMAT)
+
+
+_configured = False
+_configure_lock = threading.RLock()
+
+
+def configure_logging() -> None:
+    # Applies the log settings from the environment and the .env file. It runs with the first
+    # record or the first read of the environment, whichever comes first, since the .env file
+    # is not loaded on import; the root level is INFO until then.
+    global RUN_ID, _configured
+    with _configure_lock:
+        if _configured:
+            return
+        # set first, records logged while loading the .env file must not configure again
+        _configured = True
+        from sensor.config import load_env_file
+        load_env_file()
+        RUN_ID = os.getenv(RUN_ID_ENV_KEY) or uuid.uuid4().hex[:12]
+        file_handler.setFormatter(get_log_formatter())
+        logging.getLogger().setLevel(os.getenv(LOG_LEVEL_ENV_KEY, "INFO").upper())
+
+
+file_handler = LazyFileHandler(LOG_FILE_PATH, delay=True)
+queue_handler = LazyQueueHandler(file_handler)
+
 logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s] %(lineno)d %(name)s - %(levelname)s %(message)s",
+    handlers=[queue_handler],
     level=logging.INFO
-)
\ No newline at end of file
+)
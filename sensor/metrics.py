@@ -0,0 +1,158 @@
+import os, sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Callable, List, Optional
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+@dataclass
+class StageMetrics:
+    stage:str
+    started:str
+    status:str = "running"
+    wall_seconds:Optional[float] = None
+    # this process plus the worker processes that finished during the stage
+    cpu_seconds:Optional[float] = None
+    rows:Optional[int] = None
+    rows_per_second:Optional[float] = None
+    peak_rss_mb:Optional[float] = None
+    # False where the peak cannot be reset per stage and is the peak since the process started
+    peak_rss_is_stage_peak:bool = False
+    # restored from the stage cache instead of run
+    cached:bool = False
+
+
+_current_stage:ContextVar = ContextVar("current_stage", default=None)
+_metrics_hooks:List[Callable[[StageMetrics], None]] = []
+_metrics_hooks_lock = threading.Lock()
+
+
+def add_metrics_hook(hook:Callable[[StageMetrics], None]) -> None:
+    # hook(stage_metrics) is called after every measured stage, failed ones included
+    with _metrics_hooks_lock:
+        _metrics_hooks.append(hook)
+
+
+def remove_metrics_hook(hook:Callable[[StageMetrics], None]) -> None:
+    with _metrics_hooks_lock:
+        if hook in _metrics_hooks:
+            _metrics_hooks.remove(hook)
+
+
+def add_stage_rows(n_rows:int) -> None:
+    # rows processed by the stage measured in this context, a no-op outside of one
+    stage_metrics = _current_stage.get()
+    if stage_metrics is not None:
+        stage_metrics.rows = (stage_metrics.rows or 0) + int(n_rows)
+
+
+def set_stage_cached() -> None:
+    stage_metrics = _current_stage.get()
+    if stage_metrics is not None:
+        stage_metrics.cached = True
+
+
+def reset_peak_rss() -> bool:
+    # Linux lets a process reset its own high water mark
+    try:
+        with open("/proc/self/clear_refs", "w") as file_obj:
+            file_obj.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as file_obj:
+            for line in file_obj:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def get_children_cpu_seconds() -> float:
+    # cpu time of the child processes that finished and were waited for
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+    except ImportError:
+        return 0.0
+
+
+class MetricsRecorder:
+    # Measures stages one after the other and keeps their metrics in order. With a file path the
+    # metrics of every stage so far are rewritten there after each stage, so failed runs keep theirs.
+
+    def __init__(self, metrics_file_path:Optional[str]=None) -> None:
+        try:
+            self.metrics_file_path = metrics_file_path
+            self.stages:List[StageMetrics] = []
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    @contextmanager
+    def measure(self, stage_name:str):
+        stage_metrics = StageMetrics(stage=stage_name, started=datetime.now().isoformat(timespec="seconds"))
+        token = _current_stage.set(stage_metrics)
+        stage_metrics.peak_rss_is_stage_peak = reset_peak_rss()
+        cpu_start, children_cpu_start = time.process_time(), get_children_cpu_seconds()
+        start = time.perf_counter()
+        try:
+            yield stage_metrics
+            stage_metrics.status = "success"
+        except BaseException:
+            stage_metrics.status = "failed"
+            raise
+        finally:
+            _current_stage.reset(token)
+            wall_seconds = time.perf_counter() - start
+            stage_metrics.wall_seconds = round(wall_seconds, 3)
+            stage_metrics.cpu_seconds = round(time.process_time() - cpu_start + get_children_cpu_seconds() - children_cpu_start, 3)
+            if stage_metrics.rows is not None and wall_seconds > 0:
+                stage_metrics.rows_per_second = round(stage_metrics.rows / wall_seconds, 1)
+            peak_rss_mb = get_peak_rss_mb()
+            stage_metrics.peak_rss_mb = None if peak_rss_mb is None else round(peak_rss_mb, 1)
+            self.stages.append(stage_metrics)
+            logging.info("Stage metrics: %s", stage_metrics)
+            self.save()
+            self.call_hooks(stage_metrics)
+
+    def call_hooks(self, stage_metrics:StageMetrics) -> None:
+        # a failing collector is logged, it never fails the stage
+        with _metrics_hooks_lock:
+            hooks = list(_metrics_hooks)
+        for hook in hooks:
+            try:
+                hook(stage_metrics)
+            except Exception as e:
+                logging.info(f"Metrics hook {hook} failed: {e}")
+
+    def to_dict(self) -> dict:
+        return {"stages": [asdict(stage_metrics) for stage_metrics in self.stages]}
+
+    def save(self) -> None:
+        try:
+            if self.metrics_file_path is None:
+                return
+            os.makedirs(os.path.dirname(self.metrics_file_path) or ".", exist_ok=True)
+            with open(self.metrics_file_path + ".tmp", "w") as file_obj:
+                json.dump(self.to_dict(), file_obj, indent=2)
+            os.replace(self.metrics_file_path + ".tmp", self.metrics_file_path)
+        except Exception as e:
+            raise SensorException(e, sys)
@@ -0,0 +1,214 @@
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+from scipy.stats import kstwo, ks_2samp
+from sensor.exception import SensorException
+
+
+# auto: exact p-values while neither sample has more than KS_EXACT_MAX_ROWS values, like scipy's
+# ks_2samp default; asymp: always the asymptotic distribution; exact: always exact
+KS_METHODS = ("auto", "asymp", "exact")
+KS_EXACT_MAX_ROWS = 10_000
+
+
+def float32_sort_keys(arr:np.ndarray) -> np.ndarray:
+    # Order preserving uint32 keys of float32 values (nan sorts last), returned as uint64 so
+    # callers can pack extra bits around them. -0.0 and 0.0 share a key.
+    arr = arr + np.float32(0)
+    is_nan = np.isnan(arr)
+    bits = arr.view(np.uint32)
+    # negative floats get all bits flipped, positive ones only the sign bit
+    bits ^= (np.uint32(0) - (bits >> np.uint32(31))) | np.uint32(0x80000000)
+    return np.where(is_nan, np.uint32(0xFFFFFFFF), bits).astype(np.uint64)
+
+
+def sort_with_labels_float32(base_arr:np.ndarray, current_arr:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Sort every row of the pooled samples and count the base sample values seen so far.
+    # The sample label is packed into the lowest bit of the sort keys, so a plain sort
+    # (much faster than an argsort) carries the labels along.
+    keys = float32_sort_keys(np.concatenate([base_arr, current_arr], axis=1))
+    keys <<= 1
+    keys[:, :base_arr.shape[1]] |= 1
+    keys.sort(axis=1)
+    base_count = np.cumsum(keys & 1, axis=1, dtype=np.int64)
+    # equal keys are equal values, which is all the tie detection needs
+    return keys >> 1, base_count
+
+
+def ks_2samp_columns(base_arr:np.ndarray, current_arr:np.ndarray, method:str="auto") -> Tuple[np.ndarray, np.ndarray]:
+    # Two sample KS test of every column of base_arr against the same column of current_arr.
+    # NAN values are left out per column. Both samples are sorted together once, the empirical
+    # CDF difference is a cumulative sum over the sorted sample labels and is only evaluated
+    # at the last occurrence of every distinct value. P-values use the asymptotic KS distribution,
+    # columns that get exact p-values under method (see KS_METHODS) go through scipy's ks_2samp.
+    try:
+        if method not in KS_METHODS:
+            raise ValueError(f"Unknown KS method {method}, expected one of {KS_METHODS}")
+        # columns are laid out as rows so every sort and cumulative sum runs over contiguous memory
+        base_arr = np.ascontiguousarray(np.asarray(base_arr).T)
+        current_arr = np.ascontiguousarray(np.asarray(current_arr).T)
+        n_base = np.count_nonzero(~np.isnan(base_arr), axis=1).astype(np.int64)
+        n_current = np.count_nonzero(~np.isnan(current_arr), axis=1).astype(np.int64)
+
+        if base_arr.dtype == np.float32 and current_arr.dtype == np.float32:
+            pooled, base_count = sort_with_labels_float32(base_arr, current_arr)
+        else:
+            pooled = np.concatenate([base_arr, current_arr], axis=1)
+            # nan sorts last, so the valid values of every column are a prefix of its sorted order
+            order = np.argsort(pooled, axis=1)
+            pooled = np.take_along_axis(pooled, order, axis=1)
+            base_count = np.cumsum(order < base_arr.shape[1], axis=1, dtype=np.int64)
+            del order
+        current_count = np.arange(1, pooled.shape[1] + 1, dtype=np.int64) - base_count
+
+        # |F_base - F_current| scaled by n_base * n_current, exact in integers
+        base_count *= n_current[:, None]
+        current_count *= n_base[:, None]
+        base_count -= current_count
+        cdf_diff = np.abs(base_count, out=base_count)
+        del current_count
+
+        # evaluate only where the next value differs (last of a tie) and the value is not nan
+        is_step = np.arange(pooled.shape[1]) < (n_base + n_current)[:, None]
+        is_step[:, :-1] &= pooled[:, 1:] != pooled[:, :-1]
+        cdf_diff *= is_step
+        with np.errstate(divide="ignore", invalid="ignore"):
+            statistics = cdf_diff.max(axis=1) / (n_base * n_current)
+
+        larger, smaller = np.maximum(n_base, n_current).astype(np.float64), np.minimum(n_base, n_current).astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            effective_n = np.round(larger * smaller / (larger + smaller))
+        p_values = np.full(statistics.shape, np.nan)
+        is_valid = (n_base > 0) & (n_current > 0)
+        p_values[is_valid] = np.clip(kstwo.sf(statistics[is_valid], effective_n[is_valid]), 0, 1)
+        statistics[~is_valid] = np.nan
+
+        if method != "asymp":
+            is_exact = is_valid & ((method == "exact") | (np.maximum(n_base, n_current) <= KS_EXACT_MAX_ROWS))
+            for col_idx in np.flatnonzero(is_exact):
+                base_col, current_col = base_arr[col_idx], current_arr[col_idx]
+                p_values[col_idx] = ks_2samp(base_col[~np.isnan(base_col)], current_col[~np.isnan(current_col)],
+                                             method="exact").pvalue
+        return statistics, p_values
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def ks_2samp_column_blocks(base_arr:np.ndarray, current_arr:np.ndarray, n_jobs:int=1,
+                           block_size:int=16, method:str="auto") -> Tuple[np.ndarray, np.ndarray]:
+    # ks_2samp_columns over blocks of columns, which bounds the temporary arrays to a block.
+    # With n_jobs > 1 the blocks are spread across a process pool.
+    try:
+        n_columns = base_arr.shape[1]
+        blocks = [slice(start, start + block_size) for start in range(0, n_columns, block_size)]
+        base_blocks = [base_arr[:, block] for block in blocks]
+        current_blocks = [current_arr[:, block] for block in blocks]
+        if n_jobs <= 1 or len(blocks) == 1:
+            results = list(map(ks_2samp_columns, base_blocks, current_blocks, [method] * len(blocks)))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(ks_2samp_columns, base_blocks, current_blocks, [method] * len(blocks)))
+        statistics = np.concatenate([result[0] for result in results])
+        p_values = np.concatenate([result[1] for result in results])
+        return statistics, p_values
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+PROFILE_QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+PSI_EPSILON = 1e-4
+
+
+def count_at_edges(arr:np.ndarray, edges:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # For a (rows, columns) float32 array and (columns, n_edges) edges, the number of non nan
+    # values of every column that are <= each of its edges, plus the non nan count per column.
+    # Every column is sorted on its own and offset by its index in the upper 32 key bits, so the
+    # keys of all columns form one sorted array and a single searchsorted handles every edge.
+    try:
+        arr = np.asarray(arr, dtype=np.float32)
+        n_rows, n_columns = arr.shape
+        column_offsets = np.arange(n_columns, dtype=np.uint64) << np.uint64(32)
+        keys = float32_sort_keys(np.ascontiguousarray(arr.T))
+        keys.sort(axis=1)
+        keys |= column_offsets[:, None]
+        edge_keys = float32_sort_keys(np.ascontiguousarray(edges, dtype=np.float32)) | column_offsets[:, None]
+
+        n_valid = np.count_nonzero(~np.isnan(arr), axis=0)
+        counts = np.searchsorted(keys.ravel(), edge_keys.ravel(), side="right").reshape(edge_keys.shape)
+        counts -= (np.arange(n_columns) * n_rows)[:, None]
+        # nan keys sort after every value, a nan edge (all nan column) must not count them
+        counts = np.minimum(counts, n_valid[:, None])
+        counts[np.isnan(edges)] = 0
+        return counts, n_valid
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def build_feature_profile(arr:np.ndarray, columns:List[str], n_bins:int=10) -> Dict[str, np.ndarray]:
+    # Compact per feature baseline: quantile bin edges with the row counts per bin, a few
+    # quantiles and the null rate. Edges are actual data values, so they are exact in float32.
+    try:
+        arr = np.asarray(arr, dtype=np.float32)
+        with warnings.catch_warnings():
+            # all nan columns get nan edges and quantiles
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            bin_edges = np.nanquantile(arr, np.linspace(0, 1, n_bins + 1)[1:-1], axis=0, method="lower").T
+            quantiles = np.nanquantile(arr, PROFILE_QUANTILES, axis=0, method="lower").T
+        cumulative_counts, n_valid = count_at_edges(arr, bin_edges)
+        return {
+            "columns": np.array(columns, dtype=str),
+            "bin_edges": bin_edges.astype(np.float32),
+            "bin_counts": np.diff(cumulative_counts, prepend=0, append=n_valid[:, None], axis=1),
+            "quantile_levels": np.array(PROFILE_QUANTILES),
+            "quantiles": quantiles.astype(np.float32),
+            "null_rate": 1 - n_valid / max(arr.shape[0], 1),
+            "n_rows": np.array(arr.shape[0]),
+        }
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def count_profile_bins(profile:Dict[str, np.ndarray], arr:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # rows of every profiled column of arr in each profile bin plus the non nan count per column,
+    # both add up over row chunks
+    try:
+        cumulative_counts, n_valid = count_at_edges(arr, profile["bin_edges"])
+        return np.diff(cumulative_counts, prepend=0, append=n_valid[:, None], axis=1), n_valid
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def compare_to_profile(profile:Dict[str, np.ndarray], arr:np.ndarray) -> Dict[str, np.ndarray]:
+    # PSI and a KS approximation (largest CDF gap at the profile bin edges) of every profiled
+    # column of arr against the baseline, in a single pass over the data.
+    try:
+        current_counts, n_valid = count_profile_bins(profile, arr)
+        return compare_counts_to_profile(profile, current_counts, n_valid, n_rows=len(arr))
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def compare_counts_to_profile(profile:Dict[str, np.ndarray], current_counts:np.ndarray,
+                              n_valid:np.ndarray, n_rows:int) -> Dict[str, np.ndarray]:
+    # compare_to_profile from the bin counts of count_profile_bins
+    try:
+        baseline_counts = profile["bin_counts"]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            baseline_dist = np.maximum(baseline_counts / baseline_counts.sum(axis=1, keepdims=True), PSI_EPSILON)
+            current_dist = np.maximum(current_counts / current_counts.sum(axis=1, keepdims=True), PSI_EPSILON)
+            psi = np.sum((current_dist - baseline_dist) * np.log(current_dist / baseline_dist), axis=1)
+            ks_statistic = np.abs(np.cumsum(current_dist, axis=1) - np.cumsum(baseline_dist, axis=1)).max(axis=1)
+        # columns without values on either side cannot be compared
+        is_empty = (n_valid == 0) | (baseline_counts.sum(axis=1) == 0)
+        psi[is_empty] = np.nan
+        ks_statistic[is_empty] = np.nan
+        return {
+            "psi": psi,
+            "ks_statistic": ks_statistic,
+            "null_rate": 1 - n_valid / max(n_rows, 1),
+        }
+    except Exception as e:
+        raise SensorException(e, sys)
@@ -0,0 +1,179 @@
+import os, sys
+import json
+from typing import List, Optional, Union
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sensor.exception import SensorException
+
+
+MODEL_BUNDLE_FORMAT_VERSION = 1
+BUNDLE_META_FILE_NAME = "bundle.json"
+BUNDLE_BOOSTER_FILE_NAME = "model.ubj"
+# rows: imputer fill values, scaler centers, scaler scales
+BUNDLE_PREPROCESSING_FILE_NAME = "preprocessing.npy"
+# rows filled, scaled and checked for NaN together, small enough to stay in cache between the passes
+TRANSFORM_BLOCK_ROWS = 1024
+
+
+class ModelBundle:
+    # Everything prediction needs without unpickling: the booster, the imputer / robust scaler
+    # parameters as plain arrays, the feature order and the label classes. Saved as xgboost's
+    # native UBJSON, one .npy and a json file, so it does not depend on the pickled library versions.
+
+    def __init__(self, booster:xgb.Booster, feature_names:List[str], preprocessing:np.ndarray, classes:List[str]) -> None:
+        try:
+            self.booster = booster
+            self.feature_names = list(feature_names)
+            self.preprocessing = preprocessing
+            self.fill_values, self.center, self.scale = preprocessing
+            self.classes = np.array(classes, dtype=object)
+            # float32 operands where that is lossless: float32 arithmetic then rounds exactly like float64
+            # arithmetic cast back to float32, without numpy converting every block to float64
+            self.center_operand = self.get_operand(self.center)
+            self.scale_operand = self.get_operand(self.scale)
+            # NaNs are filled after scaling with the fill values put through the same float32 arithmetic
+            self.scaled_fill_values = self.fill_values.astype(np.float32)
+            self.scaled_fill_values -= self.center_operand
+            self.scaled_fill_values /= self.scale_operand
+            # column layout of the input -> positions of the model features in it, None when already in order
+            self.column_maps = dict()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    @staticmethod
+    def from_objects(transformer, model, target_encoder) -> "ModelBundle":
+        # bundle of the pickled training objects: an imputer + robust scaler pipeline, an xgboost
+        # classifier and the target label encoder
+        try:
+            imputer, scaler = transformer.steps[0][1], transformer.steps[-1][1]
+            n_features = len(imputer.statistics_)
+            center = scaler.center_ if scaler.center_ is not None else np.zeros(n_features)
+            scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+            preprocessing = np.vstack([imputer.statistics_, center, scale]).astype(np.float64)
+            booster = model.get_booster()
+            best_iteration = booster.attr("best_iteration")
+            if best_iteration is not None:
+                # XGBClassifier.predict only uses the trees up to the best iteration
+                booster = booster[:int(best_iteration) + 1]
+            return ModelBundle(booster, list(transformer.feature_names_in_), preprocessing,
+                               [str(label) for label in target_encoder.classes_])
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    @staticmethod
+    def get_operand(values:np.ndarray) -> np.ndarray:
+        try:
+            values_32 = values.astype(np.float32)
+            return values_32 if np.array_equal(values_32, values) else np.asarray(values)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_column_map(self, columns:pd.Index) -> Optional[np.ndarray]:
+        try:
+            key = tuple(columns)
+            if key not in self.column_maps:
+                column_map = columns.get_indexer(self.feature_names)
+                if (column_map < 0).any():
+                    missing_columns = [col for col, idx in zip(self.feature_names, column_map) if idx < 0]
+                    raise Exception(f"Missing feature columns: {missing_columns}")
+                if np.array_equal(column_map, np.arange(len(columns))):
+                    column_map = None
+                self.column_maps[key] = column_map
+            return self.column_maps[key]
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_feature_values(self, data:Union[pd.DataFrame, np.ndarray]):
+        # float32 values of the input and the model feature positions in them, without copying
+        # when the frame is a single float32 block
+        try:
+            if isinstance(data, np.ndarray):
+                if data.ndim != 2 or data.shape[1] != len(self.feature_names):
+                    raise Exception(f"Expected an array of {len(self.feature_names)} feature columns, got shape {data.shape}")
+                return data, None
+            column_map = self.get_column_map(data.columns)
+            if column_map is not None and not all(dtype.kind in "fiub" for dtype in data.dtypes):
+                # other non numeric columns (e.g. the target) are left out before converting
+                data, column_map = data.iloc[:, column_map], None
+            return data.to_numpy(dtype=np.float32, copy=False), column_map
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def transform(self, data:Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        # Same arithmetic as the sklearn pipeline on float32 input, fused into one float32 buffer:
+        # every block of rows is gathered in model feature order, (x - center) / scale in place,
+        # then NaNs take the scaled fill values.
+        try:
+            values, column_map = self.get_feature_values(data)
+            arr = np.empty((len(values), len(self.feature_names)), dtype=np.float32)
+            is_nan = np.empty((min(len(values), TRANSFORM_BLOCK_ROWS), len(self.feature_names)), dtype=bool)
+            for start in range(0, len(values), TRANSFORM_BLOCK_ROWS):
+                block = arr[start:start + TRANSFORM_BLOCK_ROWS]
+                if column_map is None:
+                    block[...] = values[start:start + TRANSFORM_BLOCK_ROWS]
+                else:
+                    np.take(values[start:start + TRANSFORM_BLOCK_ROWS], column_map, axis=1, out=block)
+                block -= self.center_operand
+                block /= self.scale_operand
+                block_is_nan = np.isnan(block, out=is_nan[:len(block)])
+                np.copyto(block, self.scaled_fill_values, where=block_is_nan)
+            return arr
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def predict(self, data:Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        try:
+            probabilities = self.booster.inplace_predict(self.transform(data))
+            return (probabilities > 0.5).astype(np.int64)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def inverse_transform(self, prediction:np.ndarray) -> np.ndarray:
+        try:
+            return self.classes[prediction]
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def transform_target(self, target:pd.Series) -> np.ndarray:
+        try:
+            codes = pd.Index(self.classes).get_indexer(target)
+            if (codes < 0).any():
+                raise Exception(f"Unknown target labels: {sorted(set(target[codes < 0]))}")
+            return codes
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save(self, bundle_dir:str) -> None:
+        try:
+            os.makedirs(bundle_dir, exist_ok=True)
+            self.booster.save_model(os.path.join(bundle_dir, BUNDLE_BOOSTER_FILE_NAME))
+            np.save(os.path.join(bundle_dir, BUNDLE_PREPROCESSING_FILE_NAME), self.preprocessing)
+            meta = {
+                "format_version": MODEL_BUNDLE_FORMAT_VERSION,
+                "feature_names": self.feature_names,
+                "classes": [str(label) for label in self.classes],
+                "xgboost_version": xgb.__version__,
+            }
+            # the meta file is written last, a bundle without it is incomplete
+            with open(os.path.join(bundle_dir, BUNDLE_META_FILE_NAME), "w") as file_obj:
+                json.dump(meta, file_obj, indent=2)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+def is_model_bundle(bundle_dir:Optional[str]) -> bool:
+    return bundle_dir is not None and os.path.exists(os.path.join(bundle_dir, BUNDLE_META_FILE_NAME))
+
+
+def load_model_bundle(bundle_dir:str) -> ModelBundle:
+    try:
+        with open(os.path.join(bundle_dir, BUNDLE_META_FILE_NAME), "r") as file_obj:
+            meta = json.load(file_obj)
+        if meta["format_version"] > MODEL_BUNDLE_FORMAT_VERSION:
+            raise Exception(f"Model bundle format {meta['format_version']} is newer than the supported {MODEL_BUNDLE_FORMAT_VERSION}")
+        booster = xgb.Booster(model_file=os.path.join(bundle_dir, BUNDLE_BOOSTER_FILE_NAME))
+        preprocessing = np.load(os.path.join(bundle_dir, BUNDLE_PREPROCESSING_FILE_NAME), mmap_mode="r")
+        return ModelBundle(booster, meta["feature_names"], preprocessing, meta["classes"])
+    except Exception as e:
+        raise SensorException(e, sys)
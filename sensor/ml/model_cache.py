@@ -0,0 +1,90 @@
+import os, sys
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+from sensor.entity.config_entity import FEATURE_PROFILE_FILE_NAME
+from sensor.exception import SensorException
+from sensor.logger import logging
+from sensor.ml.model_bundle import ModelBundle
+from sensor.ml.model_resolver import ModelResolver
+from sensor.utils import load_numpy_arrays
+
+
+@dataclass
+class CachedModel:
+    version:int
+    model_bundle:ModelBundle
+    feature_profile:Optional[dict]
+
+
+class ModelCache:
+    # The latest registry version, loaded once per process and kept in memory. Every get()
+    # checks the registry version (one stat of the manifest). When a new version is published,
+    # one caller loads it while the others keep being served the previous version, and the new
+    # version replaces it in a single assignment.
+
+    def __init__(self, model_registry:str) -> None:
+        try:
+            self.model_resolver = ModelResolver(model_registry=model_registry)
+            self._cached_model:Optional[CachedModel] = None
+            self._load_lock = threading.Lock()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load(self, version:int) -> CachedModel:
+        try:
+            version_dir = os.path.join(self.model_resolver.model_registry, str(version))
+            logging.info(f"Loading model version {version} into the model cache")
+            model_bundle = self.model_resolver.load_bundle(version_dir)
+            feature_profile = None
+            feature_profile_path = os.path.join(version_dir, self.model_resolver.feature_profile_dir_name, FEATURE_PROFILE_FILE_NAME)
+            if os.path.exists(feature_profile_path):
+                feature_profile = load_numpy_arrays(file_path=feature_profile_path)
+            return CachedModel(version=version, model_bundle=model_bundle, feature_profile=feature_profile)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get(self) -> CachedModel:
+        try:
+            latest_version = self.model_resolver.get_latest_version()
+            if latest_version is None:
+                raise Exception("Model is not available")
+            cached_model = self._cached_model
+            if cached_model is not None and cached_model.version == latest_version:
+                return cached_model
+
+            # only the very first load makes callers wait, a reload never does
+            if not self._load_lock.acquire(blocking=cached_model is None):
+                return cached_model
+            try:
+                cached_model = self._cached_model
+                if cached_model is None or cached_model.version != latest_version:
+                    try:
+                        cached_model = self.load(latest_version)
+                    except Exception as e:
+                        if cached_model is None:
+                            raise
+                        logging.info(f"Loading model version {latest_version} failed, serving version {cached_model.version}: {e}")
+                        return cached_model
+                    self._cached_model = cached_model
+                return cached_model
+            finally:
+                self._load_lock.release()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+_model_caches:Dict[str, ModelCache] = dict()
+_model_caches_lock = threading.Lock()
+
+
+def get_model_cache(model_registry:str='datadir/saved_models') -> ModelCache:
+    # one cache per registry for the whole process
+    try:
+        registry_path = os.path.abspath(model_registry)
+        with _model_caches_lock:
+            if registry_path not in _model_caches:
+                _model_caches[registry_path] = ModelCache(model_registry)
+            return _model_caches[registry_path]
+    except Exception as e:
+        raise SensorException(e, sys)
@@ -1,33 +1,174 @@
 import os, sys
-from typing import Optional
-from sensor.entity.config_entity import MODEL_FILE_NAME, TRANSFORMER_OBJECT_FILE_NAME, TARGET_ENCODER_OBJECT_FILE_NAME
+import json
+import time
+import uuid
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from sensor.entity.config_entity import MODEL_FILE_NAME, TRANSFORMER_OBJECT_FILE_NAME, TARGET_ENCODER_OBJECT_FILE_NAME, FEATURE_PROFILE_FILE_NAME
 from sensor.exception import SensorException
+from sensor.ml.model_bundle import ModelBundle, is_model_bundle, load_model_bundle
+from sensor.utils import load_object
+from sensor.logger import logging
+
+
+REGISTRY_MANIFEST_FILE_NAME = "manifest.json"
+REGISTRY_LOCK_FILE_NAME = "manifest.lock"
+REGISTRY_STAGING_PREFIX = ".staging-"
+
+_manifest_cache:Dict[str, Tuple[tuple, dict]] = dict()
+_manifest_cache_lock = threading.Lock()
+
+
+class RegistryLock:
+    # Cross process lock on the registry: an exclusive OS lock (flock, msvcrt on windows) on a lock
+    # file that is never removed. The OS releases it when the holder exits or crashes, so there is
+    # no stale lock to break and no window in which two publishers both hold it.
+
+    def __init__(self, lock_path:str, timeout:float=60) -> None:
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.file_obj = None
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        self.file_obj = open(self.lock_path, "a+b")
+        while True:
+            try:
+                lock_file(self.file_obj)
+                return self
+            except OSError:
+                if time.time() > deadline:
+                    self.file_obj.close()
+                    raise Exception(f"Timed out waiting for registry lock {self.lock_path}")
+                time.sleep(0.05)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            unlock_file(self.file_obj)
+        finally:
+            self.file_obj.close()
+
+
+def lock_file(file_obj) -> None:
+    # raises OSError when another process holds the lock
+    if os.name == "nt":
+        import msvcrt
+        file_obj.seek(0)
+        msvcrt.locking(file_obj.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def unlock_file(file_obj) -> None:
+    if os.name == "nt":
+        import msvcrt
+        file_obj.seek(0)
+        msvcrt.locking(file_obj.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_UN)
 
 
 class ModelResolver:
+    # Versions are published by renaming a fully written staging dir into place and recording
+    # them in manifest.json. The parsed manifest is cached per process and re-read only when
+    # the file changes, so resolving the latest version is a single stat. Registries written
+    # before the manifest are resolved from their numbered directories.
+
     def __init__(self, model_registry: str = 'datadir/saved_models',
                  transformer_dir_name = "transformer",
                  target_encoder_dir_name = "target_encoder",
-                 model_dir_name = "model") -> None:
+                 model_dir_name = "model",
+                 feature_profile_dir_name = "feature_profile",
+                 bundle_dir_name = "bundle") -> None:
         try:
             self.model_registry = model_registry
             os.makedirs(self.model_registry, exist_ok=True)
             self.transformer_dir_name = transformer_dir_name
             self.target_encoder_dir_name = target_encoder_dir_name
             self.model_dir_name = model_dir_name
+            self.feature_profile_dir_name = feature_profile_dir_name
+            self.bundle_dir_name = bundle_dir_name
+            self.manifest_path = os.path.join(self.model_registry, REGISTRY_MANIFEST_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def read_manifest(self) -> dict:
+        try:
+            try:
+                stat = os.stat(self.manifest_path)
+            except FileNotFoundError:
+                # legacy registry, every numbered directory is a version without metadata
+                versions = sorted(int(name) for name in os.listdir(self.model_registry) if name.isdigit())
+                return {"latest_version": versions[-1] if len(versions) > 0 else None,
+                        "versions": [{"version": version, "dir": str(version)} for version in versions]}
+            # os.replace gives every manifest write a new inode, even within one mtime tick
+            file_state = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+            with _manifest_cache_lock:
+                cached = _manifest_cache.get(self.manifest_path)
+                if cached is not None and cached[0] == file_state:
+                    return cached[1]
+            with open(self.manifest_path, "r") as file_obj:
+                manifest = json.load(file_obj)
+            with _manifest_cache_lock:
+                _manifest_cache[self.manifest_path] = (file_state, manifest)
+            return manifest
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_latest_version(self) -> Optional[int]:
+        try:
+            return self.read_manifest()["latest_version"]
         except Exception as e:
             raise SensorException(e, sys)
         
     def get_latest_dir_path(self) -> Optional[str]:
         try:
-            dir_names = os.listdir(self.model_registry)
-            if len(dir_names) == 0:
+            latest_version = self.get_latest_version()
+            if latest_version is None:
                 return None
-            dir_names = list(map(int, dir_names))
-            latest_dir_name = max(dir_names)
-            return os.path.join(self.model_registry, str(latest_dir_name))
+            return os.path.join(self.model_registry, str(latest_version))
         except Exception as e:
             raise SensorException(e, sys)
+
+    def get_staging_dir_path(self) -> str:
+        # private directory a publisher writes a new version into before publish renames it
+        try:
+            return os.path.join(self.model_registry, f"{REGISTRY_STAGING_PREFIX}{uuid.uuid4().hex}")
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def publish(self, staging_dir:str, metadata:dict) -> str:
+        # take the next version number and rename the staging dir into place under the registry
+        # lock, then atomically replace the manifest. Readers see the old or the new version only.
+        try:
+            with RegistryLock(os.path.join(self.model_registry, REGISTRY_LOCK_FILE_NAME)):
+                manifest = self.read_manifest()
+                # a version dir left by a publisher that died before writing the manifest is taken too
+                versions = [entry["version"] for entry in manifest["versions"]]
+                versions += [int(name) for name in os.listdir(self.model_registry) if name.isdigit()]
+                version = max(versions) + 1 if len(versions) > 0 else 0
+                version_dir = os.path.join(self.model_registry, str(version))
+                os.rename(staging_dir, version_dir)
+
+                try:
+                    entry = dict(metadata, version=version, dir=str(version), published_at=datetime.now().isoformat())
+                    manifest = {"latest_version": version, "versions": manifest["versions"] + [entry]}
+                    with open(self.manifest_path + ".tmp", "w") as file_obj:
+                        json.dump(manifest, file_obj, indent=2)
+                    os.replace(self.manifest_path + ".tmp", self.manifest_path)
+                except Exception:
+                    # the version was not published, move it back so it is removed with the staging dir
+                    os.rename(version_dir, staging_dir)
+                    raise
+            logging.info(f"Published model version {version} at {version_dir}")
+            return version_dir
+        except Exception as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise SensorException(e, sys)
         
     def get_latest_model_path(self):
         try:
@@ -56,35 +197,42 @@ class ModelResolver:
         except Exception as e:
             raise SensorException(e, sys)
         
-    def get_latest_save_dir_path(self) -> str:
+    def get_latest_feature_profile_path(self):
         try:
-            latest_dir_path = self.get_latest_dir_path()
-            if latest_dir_path == None:
-                return os.path.join(self.model_registry, f"{0}")
-            latest_dir_num = int(os.path.basename(latest_dir_path))
-            return os.path.join(self.model_registry, f"{latest_dir_num + 1}")
+            latest_dir = self.get_latest_dir_path()
+            if latest_dir is None:
+                raise Exception(f"Feature profile is not available")
+            return os.path.join(latest_dir, self.feature_profile_dir_name, FEATURE_PROFILE_FILE_NAME)
         except Exception as e:
             raise SensorException(e, sys)
         
-    def get_latest_save_model_path(self):
+    def get_latest_bundle_dir_path(self):
         try:
-            latest_save_dir_path = self.get_latest_save_dir_path()
-            return os.path.join(latest_save_dir_path, self.model_dir_name, MODEL_FILE_NAME)
+            latest_dir = self.get_latest_dir_path()
+            if latest_dir is None:
+                raise Exception(f"Model bundle is not available")
+            return os.path.join(latest_dir, self.bundle_dir_name)
         except Exception as e:
             raise SensorException(e, sys)
-        
-    def get_latest_save_transformer_path(self):
+
+    def load_bundle(self, version_dir:str) -> ModelBundle:
+        # registry entries saved before the bundle format only have the pickled objects
         try:
-            latest_dir = self.get_latest_save_dir_path()
-            return os.path.join(latest_dir, self.transformer_dir_name, TRANSFORMER_OBJECT_FILE_NAME)
+            bundle_dir = os.path.join(version_dir, self.bundle_dir_name)
+            if is_model_bundle(bundle_dir):
+                return load_model_bundle(bundle_dir)
+            return ModelBundle.from_objects(
+                transformer=load_object(os.path.join(version_dir, self.transformer_dir_name, TRANSFORMER_OBJECT_FILE_NAME)),
+                model=load_object(os.path.join(version_dir, self.model_dir_name, MODEL_FILE_NAME)),
+                target_encoder=load_object(os.path.join(version_dir, self.target_encoder_dir_name, TARGET_ENCODER_OBJECT_FILE_NAME)))
         except Exception as e:
             raise SensorException(e, sys)
 
-    def get_latest_save_target_encoder_path(self):
+    def load_latest_bundle(self) -> ModelBundle:
         try:
-            latest_dir = self.get_latest_save_dir_path()
-            return os.path.join(latest_dir, self.target_encoder_dir_name, TARGET_ENCODER_OBJECT_FILE_NAME)
+            latest_dir = self.get_latest_dir_path()
+            if latest_dir is None:
+                raise Exception(f"Model bundle is not available")
+            return self.load_bundle(latest_dir)
         except Exception as e:
             raise SensorException(e, sys)
-
-
@@ -0,0 +1,103 @@
+import sys
+from typing import Optional
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from sklearn.random_projection import GaussianRandomProjection
+from imblearn.over_sampling import SMOTE
+from imblearn.under_sampling import TomekLinks
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+# smote_tomek:        SMOTE oversampling followed by exact Tomek link cleaning (the original behaviour)
+# smote_tomek_approx: SMOTE followed by Tomek link cleaning on approximate nearest neighbours
+# smote:              SMOTE oversampling only
+# class_weight:       no resampling, the trainer weights the positive class by scale_pos_weight
+RESAMPLING_STRATEGIES = ("smote_tomek", "smote_tomek_approx", "smote", "class_weight")
+
+
+class ApproxTomekLinks:
+    # Tomek link cleaning (both samples of every link are removed, like SMOTETomek does) with the
+    # nearest neighbours searched in a random projection of the features. Distances are roughly
+    # preserved, while the low dimensional space lets the neighbour search use a tree instead of
+    # brute force. Only minority samples and the majority samples they point at are queried,
+    # since every link has one sample of each class.
+
+    def __init__(self, n_components:int=16, n_jobs:Optional[int]=None, random_state:Optional[int]=None) -> None:
+        try:
+            self.n_components = n_components
+            self.n_jobs = n_jobs
+            self.random_state = random_state
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def fit_resample(self, x:np.ndarray, y:np.ndarray):
+        try:
+            x, y = np.asarray(x), np.asarray(y)
+            classes, counts = np.unique(y, return_counts=True)
+            if len(classes) < 2:
+                return x, y
+            minority_class = classes[np.argmin(counts)]
+
+            x_search = x
+            if x.shape[1] > self.n_components:
+                projection = GaussianRandomProjection(n_components=self.n_components, random_state=self.random_state)
+                x_search = projection.fit_transform(x).astype(np.float32)
+            nn = NearestNeighbors(n_neighbors=2, n_jobs=self.n_jobs).fit(x_search)
+
+            # the first neighbour of a training sample is the sample itself
+            minority_idx = np.flatnonzero(y == minority_class)
+            minority_nearest = nn.kneighbors(x_search[minority_idx], return_distance=False)[:, 1]
+            candidate_idx = np.unique(minority_nearest[y[minority_nearest] != minority_class])
+            nearest = np.full(len(y), -1)
+            if len(candidate_idx) > 0:
+                nearest[candidate_idx] = nn.kneighbors(x_search[candidate_idx], return_distance=False)[:, 1]
+
+            is_link = (y[minority_nearest] != minority_class) & (nearest[minority_nearest] == minority_idx)
+            keep = np.ones(len(y), dtype=bool)
+            keep[minority_idx[is_link]] = False
+            keep[minority_nearest[is_link]] = False
+            logging.info(f"Removing {len(y) - keep.sum()} samples in {is_link.sum()} approximate tomek links")
+            return x[keep], y[keep]
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+class Resampler:
+    # The resampling steps of a strategy behind a single fit_resample, plus the positive class
+    # weight the trainer should use with it.
+
+    def __init__(self, strategy:str, n_jobs:Optional[int]=None, random_state:Optional[int]=42) -> None:
+        try:
+            if strategy not in RESAMPLING_STRATEGIES:
+                raise Exception(f"Unknown resampling strategy {strategy}, expected one of {RESAMPLING_STRATEGIES}")
+            self.strategy = strategy
+            self.steps = []
+            if strategy != "class_weight":
+                # k_neighbors=5 of SMOTE as an estimator, which is how imblearn takes n_jobs
+                self.steps.append(SMOTE(random_state=random_state,
+                                        k_neighbors=NearestNeighbors(n_neighbors=6, n_jobs=n_jobs)))
+            if strategy == "smote_tomek":
+                self.steps.append(TomekLinks(sampling_strategy="all", n_jobs=n_jobs))
+            elif strategy == "smote_tomek_approx":
+                self.steps.append(ApproxTomekLinks(n_jobs=n_jobs, random_state=random_state))
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def fit_resample(self, x:np.ndarray, y:np.ndarray):
+        try:
+            for step in self.steps:
+                x, y = step.fit_resample(x, y)
+            return x, y
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_scale_pos_weight(self, y:np.ndarray) -> float:
+        # negative / positive sample ratio of the label encoded target, 1 when the data is resampled
+        try:
+            if self.strategy != "class_weight":
+                return 1.0
+            n_positive = int(np.count_nonzero(y == 1))
+            return float((len(y) - n_positive) / max(n_positive, 1))
+        except Exception as e:
+            raise SensorException(e, sys)
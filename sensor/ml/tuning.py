@@ -0,0 +1,171 @@
+import os, sys
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import f1_score
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+# Hyperband over xgboost boosting rounds. Every trial trains a sampled configuration for a
+# number of rounds (the resource) and is scored by F1 on a validation split. Trials run in a
+# process pool whose workers memory map the same feature file and build their training
+# matrices once, so the arrays are neither pickled per trial nor copied per worker.
+
+_trial_data = dict()
+
+
+def sample_params(search_space:Dict[str, list], rng:np.random.Generator) -> dict:
+    # search_space maps a parameter to [low, high, kind] with kind "int", "float" or "log"
+    try:
+        params = dict()
+        for name, (low, high, kind) in search_space.items():
+            if kind == "int":
+                params[name] = int(rng.integers(low, high + 1))
+            elif kind == "log":
+                params[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+            else:
+                params[name] = float(rng.uniform(low, high))
+        return params
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def get_brackets(min_resource:int, max_resource:int, eta:int, strategy:str="hyperband") -> List[List[Tuple[int, int]]]:
+    # Rungs of every bracket as (number of trials, rounds per trial). successive_halving runs
+    # only the most exploratory bracket, hyperband runs all of them.
+    try:
+        s_max = int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9))
+        brackets = []
+        for s in range(s_max, -1, -1):
+            n_configs = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            rungs = [(max(int(n_configs * eta ** -i), 1), int(round(max_resource * eta ** (i - s)))) for i in range(s + 1)]
+            brackets.append(rungs)
+            if strategy == "successive_halving":
+                break
+        return brackets
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def init_trial_worker(features_path:str, target_path:str, n_fit:int, max_bin:int, nthread:int) -> None:
+    # the first n_fit rows of the memory mapped arrays are trained on, the rest validate
+    try:
+        features = np.load(features_path, mmap_mode="r")
+        target = np.load(target_path, mmap_mode="r")
+        dtrain = xgb.QuantileDMatrix(features[:n_fit], target[:n_fit], max_bin=max_bin, nthread=nthread)
+        _trial_data["dtrain"] = dtrain
+        _trial_data["dvalid"] = xgb.QuantileDMatrix(features[n_fit:], target[n_fit:], ref=dtrain, max_bin=max_bin, nthread=nthread)
+        _trial_data["y_valid"] = np.asarray(target[n_fit:])
+        _trial_data["max_bin"] = max_bin
+        _trial_data["nthread"] = nthread
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+class DeadlineCallback(xgb.callback.TrainingCallback):
+    # stops boosting once the search's wall clock budget is spent
+
+    def __init__(self, deadline:float) -> None:
+        super().__init__()
+        self.deadline = deadline
+        self.timed_out = False
+
+    def after_iteration(self, model, epoch, evals_log) -> bool:
+        self.timed_out = time.time() > self.deadline
+        return self.timed_out
+
+
+def run_trial(trial_id:int, params:dict, n_rounds:int, deadline:float) -> dict:
+    try:
+        start = time.perf_counter()
+        train_params = {"objective": "binary:logistic", "eval_metric": "logloss", "tree_method": "hist",
+                        "max_bin": _trial_data["max_bin"], "nthread": _trial_data["nthread"], **params}
+        deadline_callback = DeadlineCallback(deadline)
+        booster = xgb.train(train_params, _trial_data["dtrain"], num_boost_round=n_rounds, callbacks=[deadline_callback])
+        y_hat = (booster.predict(_trial_data["dvalid"]) > 0.5).astype(int)
+        return {
+            "trial_id": trial_id,
+            "params": params,
+            "n_estimators": n_rounds,
+            "f1_score": float(f1_score(_trial_data["y_valid"], y_hat)),
+            "seconds": round(time.perf_counter() - start, 3),
+            "timed_out": deadline_callback.timed_out,
+        }
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def run_hyperband(features_path:str, target_path:str, n_fit:int, search_space:Dict[str, list],
+                  min_resource:int, max_resource:int, eta:int=3, strategy:str="hyperband",
+                  time_budget:float=600, n_jobs:int=1, max_bin:int=256, random_state:int=42) -> List[dict]:
+    # Runs the brackets until done or out of time and returns every trial record. Trials still
+    # queued at the deadline are cancelled, running ones stop at their next boosting round.
+    try:
+        rng = np.random.default_rng(random_state)
+        deadline = time.time() + time_budget
+        n_jobs = max(int(n_jobs), 1)
+        initargs = (features_path, target_path, n_fit, max_bin, max((os.cpu_count() or 1) // n_jobs, 1))
+        executor = None
+        if n_jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=init_trial_worker, initargs=initargs)
+        else:
+            init_trial_worker(*initargs)
+
+        trials = []
+        try:
+            for bracket_id, rungs in enumerate(get_brackets(min_resource, max_resource, eta, strategy)):
+                candidates = [sample_params(search_space, rng) for _ in range(rungs[0][0])]
+                for rung_id, (n_trials, n_rounds) in enumerate(rungs):
+                    if time.time() > deadline:
+                        break
+                    rung_trials = []
+                    trial_args = [(len(trials) + idx, params, n_rounds, deadline) for idx, params in enumerate(candidates[:n_trials])]
+                    if executor is None:
+                        for args in trial_args:
+                            if time.time() > deadline:
+                                break
+                            rung_trials.append(run_trial(*args))
+                    else:
+                        pending = {executor.submit(run_trial, *args) for args in trial_args}
+                        while pending:
+                            done, pending = wait(pending, timeout=max(deadline - time.time(), 0), return_when=FIRST_COMPLETED)
+                            rung_trials.extend(future.result() for future in done if not future.cancelled())
+                            if time.time() > deadline:
+                                for future in pending:
+                                    future.cancel()
+                                rung_trials.extend(future.result() for future in pending if not future.cancelled())
+                                break
+                    for trial in rung_trials:
+                        trial.update(bracket=bracket_id, rung=rung_id)
+                        logging.info(f"Trial {trial['trial_id']} ({n_rounds} rounds): f1 {trial['f1_score']:.4f} in {trial['seconds']}s")
+                    trials.extend(rung_trials)
+
+                    # the best 1/eta of the finished trials move on to the next rung
+                    finished = sorted((trial for trial in rung_trials if not trial["timed_out"]),
+                                      key=lambda trial: trial["f1_score"], reverse=True)
+                    candidates = [trial["params"] for trial in finished]
+                if time.time() > deadline:
+                    logging.info(f"Search time budget of {time_budget}s spent after {len(trials)} trials")
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            _trial_data.clear()
+        return trials
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def get_best_trial(trials:List[dict]) -> Optional[dict]:
+    # highest validation F1, ties go to the trial trained with more rounds
+    try:
+        finished = [trial for trial in trials if not trial["timed_out"]]
+        if len(finished) == 0:
+            return None
+        return max(finished, key=lambda trial: (trial["f1_score"], trial["n_estimators"]))
+    except Exception as e:
+        raise SensorException(e, sys)
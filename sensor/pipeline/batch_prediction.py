@@ -2,8 +2,15 @@ from sensor.entity.config_entity import BatchPredictionConfig
 from sensor.exception import SensorException
 from sensor.logger import logging
 import os, sys 
-from sensor.utils import load_object
-from sensor.ml.model_resolver import ModelResolver
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List
+from sensor.utils import iter_csv_text_chunks, get_float32_frame, write_csv_text_chunk, write_yaml_file
+from sensor.metrics import MetricsRecorder, add_stage_rows
+from dataclasses import asdict
 import pandas as pd
 from datetime import datetime
 import numpy as np
@@ -17,54 +24,297 @@ class SensorBatchPrediction:
     def __init__(self, batch_config:BatchPredictionConfig):
         try:
             self.batch_config = batch_config 
+            # the batch report carries the metrics instead of a metrics file
+            self.metrics_recorder = MetricsRecorder()
         except Exception as e:
             raise SensorException(e, sys)
 
-    def start_prediction(self):
+    def get_drift_summary(self, feature_profile:dict, bin_counts:np.ndarray, n_valid:np.ndarray, n_rows:int) -> dict:
+        # summary of the profile bin counts of every chunk of a file, see count_profile_bins
         try:
-            input_files = glob(f"{self.batch_config.inbox_dir}/*.csv")
+            from sensor.ml.drift import compare_counts_to_profile
+            columns = [str(col) for col in feature_profile["columns"]]
+            drift = compare_counts_to_profile(feature_profile, bin_counts, n_valid, n_rows)
+            column_summary = dict()
+            for col_idx, col in enumerate(columns):
+                column_summary[col] = {
+                    "psi": float(drift["psi"][col_idx]),
+                    "ks_statistic": float(drift["ks_statistic"][col_idx]),
+                    "null_rate": float(drift["null_rate"][col_idx]),
+                    "baseline_null_rate": float(feature_profile["null_rate"][col_idx]),
+                }
+            drifted_columns = [col for col_idx, col in enumerate(columns)
+                               if drift["psi"][col_idx] > self.batch_config.psi_threshold]
+            return {
+                "n_rows": n_rows,
+                "psi_threshold": self.batch_config.psi_threshold,
+                "drifted_columns": drifted_columns,
+                "columns": column_summary,
+            }
+        except Exception as e:
+            raise SensorException(e, sys)
 
-            if len(input_files)==0:
-                logging.info(f"No file found hence closing the batch prediction")
-                raise Exception("No file found hence closing the batch prediction")
+    def predict_file(self, file_path:str) -> dict:
+        # predict one inbox file; failures are logged and reported instead of raised so the
+        # rest of the batch goes on, the failed file stays in the inbox
+        start = time.perf_counter()
+        result = {"input_file": file_path, "status": "failed", "rows": 0, "prediction_file": None, "error": None}
+        try:
+            # xgboost and scipy are only imported once something is predicted
+            import pyarrow as pa
+            from sensor.ml.drift import count_profile_bins
+            from sensor.ml.model_cache import get_model_cache
+            cached_model = get_model_cache().get()
+            model_bundle = cached_model.model_bundle
+            feature_profile = cached_model.feature_profile
 
-            model_resolver = ModelResolver()
+            file_name = os.path.basename(file_path)
+            file_name = file_name.replace(".csv", f"_{datetime.now().strftime('%m%d%Y__%H%M%S')}.csv")
+            prediction_file_path = os.path.join(self.batch_config.outbox_dir, file_name)
 
-            logging.info(f"Loading transformer to transform dataset")
-            transformer = load_object(file_path=model_resolver.get_latest_transformer_path())
+            logging.info(f"Reading file : {file_path}, saving prediction file : {prediction_file_path}")
+            # every column is read as text in chunks of chunk_size rows and written back as it was, with
+            # the predictions appended; only the features the model was fitted on are parsed as float32
+            chunks = iter_csv_text_chunks(file_path, chunk_rows=self.batch_config.chunk_size)
+            header = list(pd.read_csv(file_path, nrows=0).columns) + ["prediction", "cat_pred"]
 
-            logging.info(f"Loading model to make prediction")
-            model = load_object(file_path=model_resolver.get_latest_model_path())
+            profile_columns = None if feature_profile is None else [str(col) for col in feature_profile["columns"]]
+            bin_counts, n_valid, n_rows = 0, 0, 0
+            # every chunk is appended as it is predicted; the file only appears in the outbox once complete
+            part_file_path = prediction_file_path + ".part"
+            try:
+                with open(part_file_path, "wb") as file_obj:
+                    file_obj.write(pd.DataFrame(columns=header).to_csv(index=False).encode())
+                    # the next chunks are parsed and the previous ones written in background threads
+                    # while this one is predicted
+                    pipeline_depth = self.batch_config.pipeline_depth if self.batch_config.chunk_size is not None else 0
+                    chunk_writer = ChunkWriter(file_obj, pipeline_depth)
+                    try:
+                        for table in prefetch_chunks(chunks, pipeline_depth):
+                            df = get_float32_frame(table, model_bundle.feature_names)
+                            prediction = model_bundle.predict(df)
+                            cat_prediction = model_bundle.inverse_transform(prediction)
+                            table = table.append_column("prediction", pa.array(prediction))
+                            table = table.append_column("cat_pred", pa.array(cat_prediction, type=pa.string()))
 
-            logging.info(f"Target encoder to convert predicted column into categorical")
-            target_encoder = load_object(file_path=model_resolver.get_latest_target_encoder_path())
+                            if feature_profile is not None:
+                                chunk_bin_counts, chunk_n_valid = count_profile_bins(feature_profile, df[profile_columns].to_numpy(dtype=np.float32))
+                                bin_counts, n_valid = bin_counts + chunk_bin_counts, n_valid + chunk_n_valid
+                            n_rows += len(df)
+                            chunk_writer.write(table)
+                    finally:
+                        chunk_writer.close()
+                os.replace(part_file_path, prediction_file_path)
+            finally:
+                if os.path.exists(part_file_path):
+                    os.remove(part_file_path)
 
-            for file_path in input_files:
-                logging.info(f"Reading file : {file_path}")
-                df = pd.read_csv(file_path)
-                df.replace({"na": np.NAN}, inplace=True)
+            if feature_profile is not None:
+                drift_file_path = os.path.splitext(prediction_file_path)[0] + "_drift.yaml"
+                drift_summary = self.get_drift_summary(feature_profile, bin_counts, n_valid, n_rows)
+                logging.info(f"{len(drift_summary['drifted_columns'])} drifted columns, saving drift summary: {drift_file_path}")
+                logging.debug("Drifted columns: %s", drift_summary["drifted_columns"])
+                write_yaml_file(drift_file_path, drift_summary)
+                result["drifted_columns"] = drift_summary["drifted_columns"]
 
-                input_feature_names =  list(transformer.feature_names_in_)
-                input_arr = transformer.transform(df[input_feature_names])
+            archive_file_path = os.path.join(self.batch_config.archive_dir, file_name)
 
-                prediction = model.predict(input_arr)
-                cat_prediction = target_encoder.inverse_transform(prediction)
-                df["prediction"]=prediction
-                df["cat_pred"]=cat_prediction
+            shutil.copyfile(src=file_path, dst=archive_file_path)
+            logging.info(f"Copying input file into archive: {archive_file_path}")
+            logging.info(f"Removing file from inbox")
+            os.remove(file_path)
 
-                file_name = os.path.basename(file_path)
-                file_name = file_name.replace(".csv", f"_{datetime.now().strftime('%m%d%Y__%H%M%S')}.csv")
-                prediction_file_path = os.path.join(self.batch_config.outbox_dir, file_name)
-                
-                logging.info(f"Saving prediction  file : {prediction_file_path}")
-                df.to_csv(prediction_file_path, index=False, header=True)
+            result.update(status="success", rows=n_rows, prediction_file=prediction_file_path, model_version=cached_model.version)
+        except Exception as e:
+            logging.info(f"Prediction failed for {file_path}: {e}")
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
 
-                archive_file_path = os.path.join(self.batch_config.archive_dir, file_name)
+    def predict_files_in_pool(self, remaining_files:List[str], n_workers:int, max_pending:int):
+        # Predicts files popped from remaining_files in a process pool with at most max_pending
+        # files queued. An error raised by a file's future becomes a failed result. When a worker
+        # dies (out of memory, segfault) the pool is broken: the files in flight are returned
+        # without a result and the rest stay in remaining_files for a new pool.
+        try:
+            results, in_flight_files = [], []
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=init_prediction_worker,
+                                     initargs=(n_workers,)) as executor:
+                pending = dict()
+                while (remaining_files or pending) and not in_flight_files:
+                    while remaining_files and len(pending) < max_pending:
+                        file_path = remaining_files.pop()
+                        pending[executor.submit(run_file_prediction, self.batch_config, file_path)] = file_path
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path = pending.pop(future)
+                        try:
+                            results.append(future.result())
+                        except BrokenProcessPool:
+                            in_flight_files.append(file_path)
+                        except Exception as e:
+                            results.append(get_failed_result(file_path, str(e)))
+                    if in_flight_files:
+                        in_flight_files.extend(pending.values())
+                        logging.info(f"A prediction worker died with {len(in_flight_files)} files in flight")
+            return results, in_flight_files
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def start_prediction(self) -> List[dict]:
+        try:
+            with self.metrics_recorder.measure("batch_prediction") as stage_metrics:
+                input_files = sorted(glob(f"{self.batch_config.inbox_dir}/*.csv"))
 
-                shutil.copyfile(src=file_path, dst=archive_file_path)
-                logging.info(f"Copying input file into archive: {archive_file_path}")
-                logging.info(f"Removing file from inbox")
-                os.remove(file_path)
+                if len(input_files)==0:
+                    logging.info(f"No file found hence closing the batch prediction")
+                    raise Exception("No file found hence closing the batch prediction")
+
+                # loaded once per process, reloaded only when a new version is published. Loading it
+                # before the pool starts lets forked workers share it copy on write.
+                from sensor.ml.model_cache import get_model_cache
+                cached_model = get_model_cache().get()
+                logging.info(f"Predicting {len(input_files)} files with model version {cached_model.version}")
+                if cached_model.feature_profile is None:
+                    logging.info(f"No feature profile saved with the model, skipping drift checks")
+
+                n_workers = max(min(self.batch_config.n_workers or 1, len(input_files)), 1)
+                if n_workers == 1:
+                    results = [self.predict_file(file_path) for file_path in input_files]
+                else:
+                    # files are spread over worker processes, each file is pipelined inside its worker;
+                    # a pool broken by a dying worker is replaced until every file has been tried
+                    results, suspect_files = [], []
+                    remaining_files = list(reversed(input_files))
+                    while remaining_files:
+                        pool_results, in_flight_files = self.predict_files_in_pool(remaining_files, n_workers, 2 * n_workers)
+                        results.extend(pool_results)
+                        suspect_files.extend(in_flight_files)
+                    # the files in flight when a worker died are retried one at a time, so only a file
+                    # that kills its worker again fails
+                    suspect_files.reverse()
+                    while suspect_files:
+                        pool_results, in_flight_files = self.predict_files_in_pool(suspect_files, 1, 1)
+                        results.extend(pool_results)
+                        results.extend(get_failed_result(file_path, "The prediction worker died while predicting this file")
+                                       for file_path in in_flight_files)
+                    results.sort(key=lambda result: input_files.index(result["input_file"]))
+                add_stage_rows(sum(result["rows"] for result in results))
+
+            n_failed = sum(result["status"] != "success" for result in results)
+            report_file_path = os.path.join(self.batch_config.report_dir, f"batch_{datetime.now().strftime('%m%d%Y__%H%M%S')}.yaml")
+            write_yaml_file(report_file_path, {"model_version": cached_model.version, "files": results,
+                                               "metrics": asdict(stage_metrics)})
+            logging.info(f"Batch prediction done, {len(results) - n_failed} files succeeded and {n_failed} failed, report: {report_file_path}")
+            return results
     
         except Exception as e:
-            raise SensorException(e, sys)
\ No newline at end of file
+            raise SensorException(e, sys)
+
+
+def get_failed_result(file_path:str, error:str) -> dict:
+    logging.info(f"Prediction failed for {file_path}: {error}")
+    return {"input_file": file_path, "status": "failed", "rows": 0, "prediction_file": None, "error": error}
+
+
+def prefetch_chunks(chunks:Iterable, max_queued:int) -> Iterator:
+    # iterates chunks in a background thread, up to max_queued chunks ahead of the caller
+    if max_queued <= 0:
+        yield from chunks
+        return
+    chunk_queue = queue.Queue(maxsize=max_queued)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read_chunks() -> None:
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+
+    reader = threading.Thread(target=read_chunks, name="chunk-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            chunk, error = chunk_queue.get()
+            if error is not None:
+                raise error
+            if chunk is end:
+                return
+            yield chunk
+    finally:
+        # the caller stopped early or failed: let the reader finish instead of blocking on a full queue
+        stopped.set()
+        reader.join()
+
+
+class ChunkWriter:
+    # Writes predicted arrow tables to the binary file_obj in order from a background thread, with at
+    # most max_queued chunks waiting. A write error is raised by the next write or by close.
+
+    def __init__(self, file_obj, max_queued:int) -> None:
+        try:
+            self.file_obj = file_obj
+            self.error = None
+            self.thread = None
+            if max_queued > 0:
+                self.chunk_queue = queue.Queue(maxsize=max_queued)
+                self.thread = threading.Thread(target=self.run, name="chunk-writer", daemon=True)
+                self.thread.start()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def run(self) -> None:
+        while True:
+            item = self.chunk_queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    write_csv_text_chunk(self.file_obj, item)
+                except BaseException as e:
+                    self.error = e
+
+    def write(self, table) -> None:
+        if self.thread is None:
+            write_csv_text_chunk(self.file_obj, table)
+            return
+        if self.error is not None:
+            raise self.error
+        self.chunk_queue.put(table)
+
+    def close(self) -> None:
+        # waits until every queued chunk is written
+        if self.thread is None:
+            return
+        self.chunk_queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+
+def init_prediction_worker(n_workers:int) -> None:
+    # split the cores between the workers instead of every booster using all of them
+    try:
+        from sensor.ml.model_cache import get_model_cache
+        booster = get_model_cache().get().model_bundle.booster
+        booster.set_param({"nthread": max((os.cpu_count() or 1) // n_workers, 1)})
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def run_file_prediction(batch_config:BatchPredictionConfig, file_path:str) -> dict:
+    return SensorBatchPrediction(batch_config).predict_file(file_path)
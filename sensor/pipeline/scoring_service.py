@@ -0,0 +1,341 @@
+import os, sys
+import io
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Union
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sensor.entity.config_entity import ScoringServiceConfig
+from sensor.entity.schema_entity import load_schema
+from sensor.ml.model_cache import get_model_cache
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+NA_VALUES = ("na", "", None)
+
+
+def records_to_features(records:List[dict], feature_names:List[str]) -> np.ndarray:
+    # rows of a JSON request in model feature order, missing and "na" readings are NaN like in the inbox files
+    try:
+        return np.array([[math.nan if record.get(name) in NA_VALUES else record[name] for name in feature_names]
+                         for record in records], dtype=np.float32)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def frame_to_features(df:pd.DataFrame, feature_names:List[str]) -> np.ndarray:
+    try:
+        return df.reindex(columns=feature_names).to_numpy(dtype=np.float32)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+@dataclass
+class ScoringRequest:
+    # rows of one request, converted to the feature order of the model version that was
+    # current when it arrived
+    rows:Union[List[dict], pd.DataFrame]
+    feature_names:List[str]
+    features:np.ndarray
+    received:float = field(default_factory=time.perf_counter)
+    done:threading.Event = field(default_factory=threading.Event)
+    prediction:Optional[np.ndarray] = None
+    cat_prediction:Optional[np.ndarray] = None
+    model_version:Optional[int] = None
+    error:Optional[str] = None
+
+    def get_features(self, feature_names:List[str]) -> np.ndarray:
+        # a new model version with another feature order was published in the meantime
+        if feature_names is self.feature_names or feature_names == self.feature_names:
+            return self.features
+        if isinstance(self.rows, pd.DataFrame):
+            return frame_to_features(self.rows, feature_names)
+        return records_to_features(self.rows, feature_names)
+
+
+class ScoringStats:
+    # request, row and batch counters since start and the latencies of the most recent requests
+
+    def __init__(self, latency_sample_size:int) -> None:
+        try:
+            self.lock = threading.Lock()
+            self.started = time.time()
+            self.latencies = deque(maxlen=latency_sample_size)
+            self.requests = 0
+            self.rows = 0
+            self.batches = 0
+            self.batch_rows = 0
+            self.errors = 0
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def add_batch(self, n_rows:int) -> None:
+        with self.lock:
+            self.batches += 1
+            self.batch_rows += n_rows
+
+    def add_request(self, n_rows:int, seconds:float, failed:bool=False) -> None:
+        with self.lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.errors += int(failed)
+            self.latencies.append(seconds)
+
+    def get_stats(self) -> dict:
+        try:
+            with self.lock:
+                latencies = np.array(self.latencies)
+                uptime = time.time() - self.started
+                stats = {
+                    "uptime_seconds": round(uptime, 3),
+                    "requests": self.requests,
+                    "rows": self.rows,
+                    "errors": self.errors,
+                    "batches": self.batches,
+                    "mean_batch_rows": round(self.batch_rows / self.batches, 2) if self.batches else 0.0,
+                    "requests_per_second": round(self.requests / uptime, 2),
+                    "rows_per_second": round(self.rows / uptime, 2),
+                }
+            latency_ms = {"p50": None, "p99": None, "max": None}
+            if len(latencies):
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                latency_ms = {"p50": round(float(p50), 3), "p99": round(float(p99), 3), "max": round(float(latencies.max() * 1000), 3)}
+            stats["latency_ms"] = latency_ms
+            return stats
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+class MicroBatcher:
+    # Requests from all HTTP threads are queued and scored together by one thread: the first
+    # request opens a batch, which closes after batch_window_ms or at max_batch_rows rows.
+
+    def __init__(self, scoring_config:ScoringServiceConfig, stats:ScoringStats) -> None:
+        try:
+            self.scoring_config = scoring_config
+            self.stats = stats
+            self.model_cache = get_model_cache(scoring_config.model_registry)
+            self.requests = queue.Queue()
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self.run, name="micro-batcher", daemon=True)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def submit(self, scoring_request:ScoringRequest) -> ScoringRequest:
+        # blocks until the batch the request went into is scored
+        try:
+            if self.stopped.is_set():
+                raise Exception("Scoring service is shutting down")
+            self.requests.put(scoring_request)
+            scoring_request.done.wait()
+            return scoring_request
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def collect_batch(self) -> List[ScoringRequest]:
+        try:
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                return []
+            n_rows = len(batch[0].features)
+            deadline = time.perf_counter() + self.scoring_config.batch_window_ms / 1000
+            while n_rows < self.scoring_config.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                try:
+                    scoring_request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(scoring_request)
+                n_rows += len(scoring_request.features)
+            return batch
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def score_batch(self, batch:List[ScoringRequest]) -> None:
+        # one prediction for the whole batch, then every request gets its slice
+        try:
+            cached_model = self.model_cache.get()
+            model_bundle = cached_model.model_bundle
+            features = [scoring_request.get_features(model_bundle.feature_names) for scoring_request in batch]
+            prediction = model_bundle.predict(features[0] if len(features) == 1 else np.concatenate(features))
+            cat_prediction = model_bundle.inverse_transform(prediction)
+            self.stats.add_batch(len(prediction))
+            offsets = np.cumsum([0] + [len(arr) for arr in features])
+            for scoring_request, start, end in zip(batch, offsets[:-1], offsets[1:]):
+                scoring_request.prediction = prediction[start:end]
+                scoring_request.cat_prediction = cat_prediction[start:end]
+                scoring_request.model_version = cached_model.version
+        except Exception as e:
+            logging.info(f"Scoring a batch of {len(batch)} requests failed: {e}")
+            for scoring_request in batch:
+                scoring_request.error = str(e)
+        finally:
+            for scoring_request in batch:
+                scoring_request.done.set()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            batch = self.collect_batch()
+            if len(batch):
+                self.score_batch(batch)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        try:
+            self.stopped.set()
+            if self.thread.ident is not None:
+                self.thread.join()
+            # requests queued while stopping are failed instead of left waiting
+            while not self.requests.empty():
+                scoring_request = self.requests.get_nowait()
+                scoring_request.error = "Scoring service is shutting down"
+                scoring_request.done.set()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    # POST /predict with a JSON reading, a JSON list of readings or an Arrow IPC stream;
+    # GET /stats for the counters and GET /health for the served model version
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, Nagle would hold the body back for the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def send_json(self, status:int, body:dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def parse_request_rows(self, feature_names:List[str]):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith(ARROW_CONTENT_TYPE):
+            rows = pa.ipc.open_stream(io.BytesIO(body)).read_all().to_pandas()
+            columns = list(rows.columns)
+        else:
+            rows = json.loads(body)
+            rows = [rows] if isinstance(rows, dict) else rows
+            if not isinstance(rows, list) or not all(isinstance(record, dict) for record in rows):
+                raise ValueError("Expected a JSON object or a list of JSON objects")
+            columns = set().union(*rows)
+        if len(rows) == 0:
+            raise ValueError("No rows to score")
+        if len(rows) > self.server.scoring_config.max_request_rows:
+            raise OverflowError(f"{len(rows)} rows is more than the {self.server.scoring_config.max_request_rows} rows allowed per request")
+        unknown_columns = set(columns) - set(feature_names) - self.server.known_columns
+        if unknown_columns:
+            raise ValueError(f"Unknown columns: {sorted(unknown_columns)}")
+        if isinstance(rows, pd.DataFrame):
+            return rows, frame_to_features(rows, feature_names)
+        return rows, records_to_features(rows, feature_names)
+
+    def do_POST(self) -> None:
+        received = time.perf_counter()
+        if self.path != "/predict":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            feature_names = self.server.micro_batcher.model_cache.get().model_bundle.feature_names
+            rows, features = self.parse_request_rows(feature_names)
+        except OverflowError as e:
+            self.send_json(413, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        scoring_request = ScoringRequest(rows=rows, feature_names=feature_names, features=features, received=received)
+        try:
+            self.server.micro_batcher.submit(scoring_request)
+        except Exception as e:
+            scoring_request.error = str(e)
+        seconds = time.perf_counter() - received
+        self.server.stats.add_request(len(features), seconds, failed=scoring_request.error is not None)
+        if scoring_request.error is not None:
+            self.send_json(503, {"error": scoring_request.error})
+            return
+        self.send_json(200, {
+            "model_version": scoring_request.model_version,
+            "prediction": scoring_request.prediction.tolist(),
+            "cat_pred": scoring_request.cat_prediction.tolist(),
+        })
+
+    def do_GET(self) -> None:
+        try:
+            if self.path == "/stats":
+                self.send_json(200, self.server.stats.get_stats())
+            elif self.path == "/health":
+                self.send_json(200, {"status": "ok", "model_version": self.server.micro_batcher.model_cache.get().version})
+            else:
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+        except Exception as e:
+            self.send_json(503, {"error": str(e)})
+
+    def log_message(self, format, *args) -> None:
+        # one log line per request would cost more than scoring it
+        pass
+
+
+class SensorScoringService:
+
+    def __init__(self, scoring_config:ScoringServiceConfig) -> None:
+        try:
+            self.scoring_config = scoring_config
+            self.stats = ScoringStats(scoring_config.latency_sample_size)
+            self.micro_batcher = MicroBatcher(scoring_config, self.stats)
+            self.server = ThreadingHTTPServer((scoring_config.host, scoring_config.port), ScoringRequestHandler)
+            self.server.daemon_threads = True
+            self.server.scoring_config = scoring_config
+            # full inbox rows are accepted, the target and dropped columns are ignored
+            schema = load_schema(scoring_config.schema_file_path)
+            self.server.known_columns = schema.required_column_set | set(schema.drop_columns)
+            self.server.stats = self.stats
+            self.server.micro_batcher = self.micro_batcher
+            # set while serve_forever runs its request loop
+            self.serving = threading.Event()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        try:
+            cached_model = self.micro_batcher.model_cache.get()
+            self.micro_batcher.start()
+            logging.info(f"Scoring service with model version {cached_model.version} listening on {self.address}")
+            self.serving.set()
+            try:
+                self.server.serve_forever()
+            finally:
+                self.serving.clear()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def shutdown(self) -> None:
+        # Safe from another thread while serve_forever runs, which stops its loop, and from the
+        # thread that ran serve_forever after it returned (KeyboardInterrupt in serve.py)
+        try:
+            if self.serving.is_set():
+                self.server.shutdown()
+            self.micro_batcher.stop()
+            self.server.server_close()
+            logging.info(f"Scoring service stopped: {self.stats.get_stats()}")
+        except Exception as e:
+            raise SensorException(e, sys)
@@ -1,13 +1,15 @@
 import os, sys
-from sensor.entity.config_entity import TrainingPipelineConfig, DataIngestionConfig, DataValidationConfig, DataTransformationConfig, ModelTrainerConfig, ModelEvaluationConfig, ModelPusherConfig
-from sensor.entity.artifact_entity import DataIngestionArtifact, DataValidationArtifact, DataTransformationArtifact, ModelTrainerArtifact, ModelEvaluationArtifact, ModelPusherArtifact
-from sensor.components.data_ingestion import DataIngestion
-from sensor.components.data_validation import DataValidation
-from sensor.components.data_transformation import DataTransformation
-from sensor.components.model_trainer import ModelTrainer
-from sensor.components.model_evaluation import ModelEvaluation
-from sensor.components.model_pusher import ModelPusher
+from typing import Optional
+from sensor.entity.config_entity import TrainingPipelineConfig, DataIngestionConfig, DataValidationConfig, DataTransformationConfig, ModelTunerConfig, ModelTrainerConfig, ModelEvaluationConfig, ModelPusherConfig
+from sensor.entity.artifact_entity import DataIngestionArtifact, DataValidationArtifact, DataTransformationArtifact, ModelTunerArtifact, ModelTrainerArtifact, ModelEvaluationArtifact, ModelPusherArtifact
+from sensor.artifact_store import ArtifactStore
+from sensor.stage_cache import StageCache
+from sensor.utils import get_collection_state
+from sensor.metrics import MetricsRecorder, set_stage_cached
 from sensor.exception import SensorException
+# the components import sklearn, xgboost and imblearn at module level, so they are imported by
+# the stage that runs them and importing the pipeline stays cheap; importing a component
+# module directly still loads those libraries
 
 
 class TrainingPipeline:
@@ -15,49 +17,112 @@ class TrainingPipeline:
     def __init__(self, training_pipeline_config:TrainingPipelineConfig) -> None:
         try:
             self.training_pipeline_config = training_pipeline_config
+            self.artifact_store = ArtifactStore(in_memory=training_pipeline_config.in_memory_artifacts)
+            self.stage_cache = None
+            if training_pipeline_config.use_stage_cache:
+                self.stage_cache = StageCache(training_pipeline_config.artifact_root_dir,
+                                              max_size=training_pipeline_config.stage_cache_max_size)
+                # keeps other runs from evicting this run's directory until it is closed
+                self.stage_cache.lock_run(training_pipeline_config.artifact_dir)
+            # cache key of every stage run so far, consumed by the next stage's key
+            self.stage_keys = dict()
+            self.metrics_recorder = MetricsRecorder(training_pipeline_config.metrics_file_path)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def run_stage(self, stage_name:str, config, artifact_class, upstream_key:Optional[str], initiate_stage):
+        # run a stage through the stage cache, upstream_key None means the input is unknown
+        try:
+            artifact_dir = self.training_pipeline_config.artifact_dir
+            cache_key = None
+            if self.stage_cache is not None and upstream_key is not None:
+                cache_key = self.stage_cache.get_key(stage_name, config, artifact_dir, upstream_key)
+                artifact_fields = self.stage_cache.restore(cache_key, artifact_dir)
+                if artifact_fields is not None:
+                    self.stage_keys[stage_name] = cache_key
+                    set_stage_cached()
+                    return artifact_class(**artifact_fields)
+
+            artifact = initiate_stage()
+            if cache_key is not None:
+                self.stage_keys[stage_name] = cache_key
+                self.stage_cache.add(cache_key, stage_name, artifact, artifact_dir)
+            return artifact
         except Exception as e:
             raise SensorException(e, sys)
         
     def start_data_ingestion(self) -> DataIngestionArtifact:
         try:
-            # initialize data Ingestion Configurations
-            data_ingestion_config = DataIngestionConfig(self.training_pipeline_config)
-            data_ingestion = DataIngestion(data_ingestion_config)
-            data_ingestion_artifact = data_ingestion.initiate_data_ingestion()
+            with self.metrics_recorder.measure("data_ingestion"):
+                # initialize data Ingestion Configurations
+                data_ingestion_config = DataIngestionConfig(self.training_pipeline_config)
+                from sensor.components.data_ingestion import DataIngestion
+                data_ingestion = DataIngestion(data_ingestion_config, artifact_store=self.artifact_store)
+                upstream_key = None
+                if self.stage_cache is not None:
+                    # uploads are append only, so count and max _id identify the collection content
+                    upstream_key = str(get_collection_state(data_ingestion_config.database_name, data_ingestion_config.collection_name))
+                data_ingestion_artifact = self.run_stage("data_ingestion", data_ingestion_config, DataIngestionArtifact,
+                                                         upstream_key, data_ingestion.initiate_data_ingestion)
 
-            return data_ingestion_artifact
+                return data_ingestion_artifact
         except Exception as e:
             raise SensorException(e, sys)
         
     def start_data_validation(self, data_ingestion_artifact)-> DataValidationArtifact:
         try:
-            # initiate data validation
-            data_validation_config = DataValidationConfig(self.training_pipeline_config)
-            data_validation = DataValidation(data_validation_config, data_ingestion_artifact)
-            data_validation_artifact = data_validation.initiate_data_validation()
+            with self.metrics_recorder.measure("data_validation"):
+                # initiate data validation
+                data_validation_config = DataValidationConfig(self.training_pipeline_config)
+                from sensor.components.data_validation import DataValidation
+                data_validation = DataValidation(data_validation_config, data_ingestion_artifact, artifact_store=self.artifact_store)
+                data_validation_artifact = self.run_stage("data_validation", data_validation_config, DataValidationArtifact,
+                                                          self.stage_keys.get("data_ingestion"), data_validation.initiate_data_validation)
 
-            return data_validation_artifact
+                return data_validation_artifact
         except Exception as e:
             raise SensorException(e, sys)
         
     def start_data_transformation(self, data_validation_artifact)-> DataTransformationArtifact:
         try:
-            #initiate data transformation
-            data_transformation_config = DataTransformationConfig(self.training_pipeline_config)
-            data_transformation = DataTransformation(data_transformation_config, data_validation_artifact)
-            data_transformation_artifact = data_transformation.initiate_data_transformation()
+            with self.metrics_recorder.measure("data_transformation"):
+                #initiate data transformation
+                data_transformation_config = DataTransformationConfig(self.training_pipeline_config)
+                from sensor.components.data_transformation import DataTransformation
+                data_transformation = DataTransformation(data_transformation_config, data_validation_artifact, artifact_store=self.artifact_store)
+                data_transformation_artifact = self.run_stage("data_transformation", data_transformation_config, DataTransformationArtifact,
+                                                              self.stage_keys.get("data_validation"), data_transformation.initiate_data_transformation)
+
+                return data_transformation_artifact
+        except Exception as e:
+            raise SensorException(e, sys)
+        
+    def start_model_tuner(self, data_transformation_artifact) -> ModelTunerArtifact:
+        try:
+            with self.metrics_recorder.measure("model_tuner"):
+                model_tuner_config = ModelTunerConfig(self.training_pipeline_config)
+                from sensor.components.model_tuner import ModelTuner
+                model_tuner = ModelTuner(model_tuner_config, data_transformation_artifact, artifact_store=self.artifact_store)
+                model_tuner_artifact = self.run_stage("model_tuner", model_tuner_config, ModelTunerArtifact,
+                                                      self.stage_keys.get("data_transformation"), model_tuner.initiate_model_tuner)
 
-            return data_transformation_artifact
+                return model_tuner_artifact
         except Exception as e:
             raise SensorException(e, sys)
         
-    def start_model_trainer(self, data_transformation_artifact) -> ModelTrainerArtifact:
+    def start_model_trainer(self, data_transformation_artifact, model_tuner_artifact=None) -> ModelTrainerArtifact:
         try:
-            model_trainer_config = ModelTrainerConfig(self.training_pipeline_config)
-            model_trainer = ModelTrainer(model_trainer_config, data_transformation_artifact)
-            model_trainer_artifact = model_trainer.initiate_model_trainer()
+            with self.metrics_recorder.measure("model_trainer"):
+                model_trainer_config = ModelTrainerConfig(self.training_pipeline_config)
+                from sensor.components.model_trainer import ModelTrainer
+                model_trainer = ModelTrainer(model_trainer_config, data_transformation_artifact, artifact_store=self.artifact_store,
+                                             model_tuner_artifact=model_tuner_artifact)
+                # a tuned trainer depends on the search results, whose key already covers the transformation
+                upstream_stage = "data_transformation" if model_tuner_artifact is None else "model_tuner"
+                model_trainer_artifact = self.run_stage("model_trainer", model_trainer_config, ModelTrainerArtifact,
+                                                        self.stage_keys.get(upstream_stage), model_trainer.initiate_model_trainer)
 
-            return model_trainer_artifact
+                return model_trainer_artifact
         except Exception as e:
             raise SensorException(e, sys)
         
@@ -65,23 +130,29 @@ class TrainingPipeline:
         data_transformation_artifact:DataTransformationArtifact,
         model_trainer_artifact:ModelTrainerArtifact)->ModelEvaluationArtifact:
         try:
-            model_eval_config = ModelEvaluationConfig(training_pipeline_config=self.training_pipeline_config)
-            model_eval = ModelEvaluation(model_evaluation_config=model_eval_config,
-             data_validation_artifact=data_validation_artifact,
-             data_transformation_artifact=data_transformation_artifact,
-             model_trainer_artifact=model_trainer_artifact)
-            return model_eval.initiate_model_evaluation()
+            with self.metrics_recorder.measure("model_evaluation"):
+                model_eval_config = ModelEvaluationConfig(training_pipeline_config=self.training_pipeline_config)
+                from sensor.components.model_evaluation import ModelEvaluation
+                model_eval = ModelEvaluation(model_evaluation_config=model_eval_config,
+                 data_validation_artifact=data_validation_artifact,
+                 data_transformation_artifact=data_transformation_artifact,
+                 model_trainer_artifact=model_trainer_artifact,
+                 artifact_store=self.artifact_store)
+                return model_eval.initiate_model_evaluation()
         except Exception as e:
             raise SensorException(e, sys)
         
     def start_model_pusher(self,  data_transformation_artifact:DataTransformationArtifact,
         model_trainer_artifact:ModelTrainerArtifact)->ModelPusherArtifact:
         try:
-            model_pusher_config = ModelPusherConfig(training_pipeline_config=self.training_pipeline_config)
-            model_pusher = ModelPusher(model_pusher_config=model_pusher_config,
-             data_transformation_artifact=data_transformation_artifact, 
-             model_trainer_artifact=model_trainer_artifact)
-            return model_pusher.initiate_model_pusher()
+            with self.metrics_recorder.measure("model_pusher"):
+                model_pusher_config = ModelPusherConfig(training_pipeline_config=self.training_pipeline_config)
+                from sensor.components.model_pusher import ModelPusher
+                model_pusher = ModelPusher(model_pusher_config=model_pusher_config,
+                 data_transformation_artifact=data_transformation_artifact, 
+                 model_trainer_artifact=model_trainer_artifact,
+                 artifact_store=self.artifact_store)
+                return model_pusher.initiate_model_pusher()
         except Exception as e:
             raise SensorException(e, sys)
         
@@ -90,7 +161,10 @@ class TrainingPipeline:
             data_ingestion_artifact = self.start_data_ingestion()
             data_validation_artifact = self.start_data_validation(data_ingestion_artifact)
             data_transformation_artifact = self.start_data_transformation(data_validation_artifact)
-            model_trainer_artifact = self.start_model_trainer(data_transformation_artifact)
+            model_tuner_artifact = None
+            if self.training_pipeline_config.use_model_tuner:
+                model_tuner_artifact = self.start_model_tuner(data_transformation_artifact)
+            model_trainer_artifact = self.start_model_trainer(data_transformation_artifact, model_tuner_artifact)
             
             model_evaluation_artifact = self.start_model_evaluation(data_validation_artifact=data_validation_artifact,
                                                                     data_transformation_artifact=data_transformation_artifact,
@@ -98,5 +172,19 @@ class TrainingPipeline:
             
             model_pusher_artifact = self.start_model_pusher(data_transformation_artifact=data_transformation_artifact,
                                                             model_trainer_artifact=model_trainer_artifact)
+        except Exception as e:
+            raise SensorException(e, sys)
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            # make sure every artifact of the run reached the disk before it is cached
+            self.artifact_store.close()
+            if self.stage_cache is not None:
+                try:
+                    self.stage_cache.commit(self.training_pipeline_config.artifact_dir)
+                finally:
+                    self.stage_cache.release_run()
         except Exception as e:
             raise SensorException(e, sys)
\ No newline at end of file
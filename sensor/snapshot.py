@@ -0,0 +1,142 @@
+import os, sys
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from bson import json_util
+from sensor.exception import SensorException
+from sensor.logger import logging
+from sensor.utils import export_collection_as_arrays, get_collection_state, add_unparsable_values_column
+
+
+SNAPSHOT_FEATURES_FILE_NAME = "features.npy"
+SNAPSHOT_TARGET_FILE_NAME = "target.npy"
+SNAPSHOT_META_FILE_NAME = "meta.json"
+
+
+class CollectionSnapshot:
+    # Local columnar copy of a mongodb collection keyed by (document count, max _id).
+    # Features live in one fortran ordered float32 .npy (every column contiguous on disk)
+    # which is memory mapped on load, so an unchanged collection is never re-downloaded.
+    # Collections are append only (see dump_csv_to_mongodb), so a grown collection only
+    # needs the documents with a larger _id; any other change triggers a full export. Feature
+    # values that did not parse as numbers are kept by row in the meta file.
+
+    def __init__(self, snapshot_dir:str, database_name:str, collection_name:str,
+                 columns:List[str], target_column:str, batch_size:int, n_workers:int=1) -> None:
+        try:
+            self.snapshot_dir = os.path.join(snapshot_dir, database_name, collection_name)
+            self.database_name = database_name
+            self.collection_name = collection_name
+            self.columns = list(columns)
+            self.target_column = target_column
+            self.feature_columns = [col for col in self.columns if col != target_column]
+            self.batch_size = batch_size
+            self.n_workers = n_workers
+            self.features_path = os.path.join(self.snapshot_dir, SNAPSHOT_FEATURES_FILE_NAME)
+            self.target_path = os.path.join(self.snapshot_dir, SNAPSHOT_TARGET_FILE_NAME)
+            self.meta_path = os.path.join(self.snapshot_dir, SNAPSHOT_META_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def read_meta(self) -> Optional[dict]:
+        try:
+            if not os.path.exists(self.meta_path):
+                return None
+            with open(self.meta_path, "r") as file_obj:
+                meta = json_util.loads(file_obj.read())
+            if meta["columns"] != self.columns or meta["target_column"] != self.target_column:
+                logging.info("Snapshot columns differ from the requested columns, ignoring snapshot")
+                return None
+            return meta
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def load_snapshot(self, meta:dict) -> pd.DataFrame:
+        try:
+            features = np.load(self.features_path, mmap_mode="r")
+            target = np.load(self.target_path)
+            return self.to_dataframe(features, target, get_unparsable_values(meta))
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def to_dataframe(self, features:np.ndarray, target:np.ndarray, unparsable_values:Dict[int, dict]) -> pd.DataFrame:
+        try:
+            df = pd.DataFrame(features, columns=self.feature_columns, copy=False)
+            df.insert(0, self.target_column, target.astype(object))
+            add_unparsable_values_column(df, unparsable_values)
+            return df
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def save_snapshot(self, features:np.ndarray, target:np.ndarray, unparsable_values:Dict[int, dict],
+                      count:int, max_id) -> None:
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            # write next to the live files and rename, so a crash never leaves a torn snapshot
+            for file_path, data in [(self.features_path, features), (self.target_path, target)]:
+                with open(file_path + ".tmp", "wb") as file_obj:
+                    np.save(file_obj, data)
+                os.replace(file_path + ".tmp", file_path)
+            meta = {"count": count, "max_id": max_id, "columns": self.columns, "target_column": self.target_column,
+                    "unparsable_values": {str(row): values for row, values in unparsable_values.items()}}
+            with open(self.meta_path + ".tmp", "w") as file_obj:
+                file_obj.write(json_util.dumps(meta))
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+            logging.info(f"Snapshot saved at {self.snapshot_dir} with {count} rows")
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def export(self, query:dict):
+        try:
+            features, target, unparsable_values = export_collection_as_arrays(
+                self.database_name, self.collection_name, columns=self.columns, target_column=self.target_column,
+                batch_size=self.batch_size, query=query, n_workers=self.n_workers)
+            return features, target.astype(str), unparsable_values
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_dataframe(self) -> pd.DataFrame:
+        try:
+            meta = self.read_meta()
+            count, max_id = get_collection_state(self.database_name, self.collection_name)
+            if count == 0:
+                raise Exception(f"No documents found in {self.database_name}.{self.collection_name}")
+
+            if meta is not None and meta["max_id"] == max_id and meta["count"] == count:
+                logging.info(f"Collection unchanged since last snapshot, loading {count} rows from {self.snapshot_dir}")
+                return self.load_snapshot(meta)
+
+            if meta is not None and meta["max_id"] is not None and max_id is not None:
+                cached_count, _ = get_collection_state(self.database_name, self.collection_name, max_id=meta["max_id"])
+                if cached_count == meta["count"]:
+                    query = {"_id": {"$gt": meta["max_id"], "$lte": max_id}}
+                    logging.info(f"Fetching {count - cached_count} new documents since last snapshot")
+                    delta_features, delta_target, delta_unparsable_values = self.export(query=query)
+                    cached_features = np.load(self.features_path, mmap_mode="r")
+                    cached_target = np.load(self.target_path)
+
+                    features = np.empty((cached_features.shape[0] + delta_features.shape[0], len(self.feature_columns)),
+                                        dtype=np.float32, order="F")
+                    features[:cached_features.shape[0]] = cached_features
+                    features[cached_features.shape[0]:] = delta_features
+                    target = np.concatenate([cached_target, delta_target])
+                    unparsable_values = get_unparsable_values(meta)
+                    unparsable_values.update((cached_features.shape[0] + row, values)
+                                             for row, values in delta_unparsable_values.items())
+                    del cached_features
+
+                    self.save_snapshot(features, target, unparsable_values, count=features.shape[0], max_id=max_id)
+                    return self.to_dataframe(features, target, unparsable_values)
+
+            logging.info(f"No usable snapshot, exporting full collection")
+            query = {"_id": {"$lte": max_id}}
+            features, target, unparsable_values = self.export(query=query)
+            self.save_snapshot(features, target, unparsable_values, count=features.shape[0], max_id=max_id)
+            return self.to_dataframe(features, target, unparsable_values)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+
+def get_unparsable_values(meta:dict) -> Dict[int, dict]:
+    # snapshots saved before unparsable values were tracked have none
+    return {int(row): values for row, values in meta.get("unparsable_values", dict()).items()}
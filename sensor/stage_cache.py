@@ -0,0 +1,266 @@
+import os, sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+from dataclasses import asdict
+from typing import Dict, List, Optional
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+STAGE_CACHE_INDEX_FILE_NAME = "stage_cache.json"
+# locked by the run writing the directory until it is closed, eviction skips locked run directories
+RUN_LOCK_FILE_NAME = "run.lock"
+# younger run directories are never evicted, a run may have created its directory but not locked it yet
+RUN_DIR_MIN_AGE_SECONDS = 600
+
+_code_version = None
+_code_version_lock = threading.Lock()
+
+
+def get_code_version() -> str:
+    # hash of every source file of the sensor package, any code change invalidates the cache
+    global _code_version
+    with _code_version_lock:
+        if _code_version is None:
+            package_dir = os.path.dirname(os.path.abspath(__file__))
+            code_hash = hashlib.sha256()
+            for root, dirs, files in os.walk(package_dir):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if file_name.endswith(".py"):
+                        file_path = os.path.join(root, file_name)
+                        code_hash.update(os.path.relpath(file_path, package_dir).encode())
+                        with open(file_path, "rb") as file_obj:
+                            code_hash.update(file_obj.read())
+            _code_version = code_hash.hexdigest()
+        return _code_version
+
+
+def get_file_hash(file_path:str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class StageCache:
+    # Content addressed cache of pipeline stage outputs inside the artifact root.
+    # A stage is keyed by its name, config, schema, the source code version and the key of
+    # the stage it consumes (or the collection state for ingestion), so a key identifies the
+    # stage output without hashing large artifact files. A hit hard links the earlier run's
+    # artifact files into the current run directory. Run directories are evicted least
+    # recently used first once the artifact root grows beyond max_size bytes, except those of
+    # runs still in progress, which hold an OS lock on their run.lock file.
+
+    def __init__(self, artifact_root_dir:str, max_size:int) -> None:
+        try:
+            self.artifact_root_dir = artifact_root_dir
+            self.max_size = max_size
+            self.index_path = os.path.join(artifact_root_dir, STAGE_CACHE_INDEX_FILE_NAME)
+            self.pending_entries:List[dict] = []
+            self.run_lock_file = None
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def lock_run(self, artifact_dir:str) -> None:
+        # held until release_run, or until the process exits
+        try:
+            from sensor.ml.model_resolver import lock_file
+            os.makedirs(artifact_dir, exist_ok=True)
+            file_obj = open(os.path.join(artifact_dir, RUN_LOCK_FILE_NAME), "a+b")
+            try:
+                lock_file(file_obj)
+            except OSError:
+                file_obj.close()
+                raise Exception(f"Run directory {artifact_dir} is locked by another run")
+            self.run_lock_file = file_obj
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def release_run(self) -> None:
+        try:
+            from sensor.ml.model_resolver import unlock_file
+            if self.run_lock_file is not None:
+                try:
+                    unlock_file(self.run_lock_file)
+                finally:
+                    self.run_lock_file.close()
+                    self.run_lock_file = None
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def lock_inactive_run(self, run_dir:str):
+        # the locked run.lock file of a run directory no run is writing, None for an active run
+        try:
+            from sensor.ml.model_resolver import lock_file
+            if time.time() - os.path.getmtime(run_dir) < RUN_DIR_MIN_AGE_SECONDS:
+                return None
+            file_obj = open(os.path.join(run_dir, RUN_LOCK_FILE_NAME), "a+b")
+            try:
+                lock_file(file_obj)
+            except OSError:
+                file_obj.close()
+                return None
+            return file_obj
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def read_index(self) -> Dict[str, dict]:
+        try:
+            if not os.path.exists(self.index_path):
+                return dict()
+            with open(self.index_path, "r") as file_obj:
+                return json.load(file_obj)
+        except Exception as e:
+            logging.info(f"Stage cache index unreadable, starting with an empty cache: {e}")
+            return dict()
+
+    def write_index(self, index:Dict[str, dict]) -> None:
+        try:
+            os.makedirs(self.artifact_root_dir, exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as file_obj:
+                json.dump(index, file_obj, indent=2)
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def get_key(self, stage_name:str, config:object, artifact_dir:str, upstream_key:str) -> str:
+        try:
+            # run specific paths are not part of the key, everything else in the config is
+            config_items = {name: value for name, value in vars(config).items()
+                            if not (isinstance(value, str) and value.startswith(artifact_dir))}
+            key_data = {
+                "stage": stage_name,
+                "config": config_items,
+                "code_version": get_code_version(),
+                "upstream_key": upstream_key,
+            }
+            schema_file_path = getattr(config, "schema_file_path", None)
+            if schema_file_path is not None:
+                key_data["schema"] = get_file_hash(schema_file_path)
+            return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def restore(self, cache_key:str, artifact_dir:str) -> Optional[dict]:
+        # on a hit, link the cached files into artifact_dir and return the artifact fields
+        try:
+            index = self.read_index()
+            entry = index.get(cache_key)
+            if entry is None:
+                return None
+            source_dir = entry["artifact_dir"]
+            file_fields = entry["file_fields"]
+            artifact_fields = dict(entry["artifact_fields"])
+            if not all(os.path.exists(artifact_fields[field]) for field in file_fields):
+                logging.info(f"Stage cache entry {cache_key} lost its files, dropping it")
+                index.pop(cache_key)
+                self.write_index(index)
+                return None
+
+            for field in file_fields:
+                source_path = artifact_fields[field]
+                target_path = os.path.join(artifact_dir, os.path.relpath(source_path, source_dir))
+                if os.path.abspath(source_path) != os.path.abspath(target_path):
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    if os.path.exists(target_path):
+                        os.remove(target_path)
+                    try:
+                        os.link(source_path, target_path)
+                    except OSError:
+                        shutil.copy2(source_path, target_path)
+                artifact_fields[field] = target_path
+
+            # the entry now points at the newest copy so older run directories can be evicted
+            entry["artifact_dir"] = artifact_dir
+            entry["artifact_fields"] = artifact_fields
+            entry["last_used"] = time.time()
+            self.write_index(index)
+            logging.info(f"Stage cache hit for {entry['stage']}, reusing artifacts from {source_dir}")
+            return artifact_fields
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def add(self, cache_key:str, stage_name:str, artifact:object, artifact_dir:str) -> None:
+        # entries are only written by commit, once their files are known to be on disk
+        try:
+            artifact_fields = asdict(artifact)
+            file_fields = [field for field, value in artifact_fields.items()
+                           if isinstance(value, str) and value.startswith(artifact_dir)]
+            self.pending_entries.append({
+                "key": cache_key,
+                "stage": stage_name,
+                "artifact_dir": artifact_dir,
+                "artifact_fields": artifact_fields,
+                "file_fields": file_fields,
+                "last_used": time.time(),
+            })
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def commit(self, current_artifact_dir:str) -> None:
+        try:
+            index = self.read_index()
+            for entry in self.pending_entries:
+                if all(os.path.exists(entry["artifact_fields"][field]) for field in entry["file_fields"]):
+                    index[entry.pop("key")] = entry
+            self.pending_entries = []
+            self.write_index(index)
+            self.evict(index, current_artifact_dir)
+        except Exception as e:
+            raise SensorException(e, sys)
+
+    def evict(self, index:Dict[str, dict], current_artifact_dir:str) -> None:
+        try:
+            run_dirs = [os.path.normpath(os.path.join(self.artifact_root_dir, name)) for name in os.listdir(self.artifact_root_dir)
+                        if os.path.isdir(os.path.join(self.artifact_root_dir, name))]
+            last_used = {run_dir: os.path.getmtime(run_dir) for run_dir in run_dirs}
+            for entry in index.values():
+                run_dir = os.path.normpath(entry["artifact_dir"])
+                if run_dir in last_used:
+                    last_used[run_dir] = max(last_used[run_dir], entry["last_used"])
+
+            # hard linked files are shared between runs, count every inode once
+            inode_sizes = dict()
+            run_inodes = dict()
+            for run_dir in run_dirs:
+                run_inodes[run_dir] = set()
+                for root, _, files in os.walk(run_dir):
+                    for file_name in files:
+                        stat = os.stat(os.path.join(root, file_name))
+                        inode_sizes[(stat.st_dev, stat.st_ino)] = stat.st_size
+                        run_inodes[run_dir].add((stat.st_dev, stat.st_ino))
+
+            total_size = sum(inode_sizes.values())
+            # the current run is never evicted
+            candidate_dirs = [run_dir for run_dir in run_dirs if run_dir != os.path.normpath(current_artifact_dir)]
+            for run_dir in sorted(candidate_dirs, key=lambda run_dir: last_used[run_dir]):
+                if total_size <= self.max_size:
+                    break
+                run_lock_file = self.lock_inactive_run(run_dir)
+                if run_lock_file is None:
+                    logging.info(f"Not evicting artifact directory {run_dir}, its run is still in progress")
+                    continue
+                try:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+                finally:
+                    run_lock_file.close()
+                remaining_inodes = set().union(*[inodes for other_dir, inodes in run_inodes.items()
+                                                 if other_dir != run_dir])
+                total_size -= sum(size for inode, size in inode_sizes.items()
+                                  if inode in run_inodes[run_dir] and inode not in remaining_inodes)
+                run_inodes.pop(run_dir)
+                logging.info(f"Evicted artifact directory {run_dir}, artifact size now {total_size} bytes")
+
+            stale_keys = [key for key, entry in index.items()
+                          if not all(os.path.exists(entry["artifact_fields"][field]) for field in entry["file_fields"])]
+            for key in stale_keys:
+                index.pop(key)
+            if len(stale_keys) > 0:
+                self.write_index(index)
+        except Exception as e:
+            raise SensorException(e, sys)
@@ -0,0 +1,113 @@
+import os, sys
+from typing import Iterator, Optional
+import numpy as np
+import pandas as pd
+from sensor.entity.schema_entity import load_schema
+from sensor.exception import SensorException
+from sensor.logger import logging
+
+
+# Deterministic APS shaped data for tests and benchmarks: the schema columns in the order of
+# the original file, about 1 positive per 59 negatives, sparse zero heavy integer counters and
+# "na" markers, with the dropped columns mostly missing. Positives get larger and fewer zero
+# readings on a subset of informative columns, so the pipeline can learn something, and a few
+# rows of either class read like the other class, so it cannot learn everything.
+
+SYNTHETIC_POS_FRACTION = 1 / 60
+# rows generated at a time, every chunk draws from its own generator seeded with (row seed, chunk index)
+SYNTHETIC_CHUNK_SIZE = 10_000
+INFORMATIVE_COLUMN_FRACTION = 0.15
+# fraction of positives reading like negatives; as many negatives read like positives
+SYNTHETIC_LABEL_NOISE = 0.05
+
+
+def get_column_profiles(n_features:int, n_dropped:int, rng:np.random.Generator) -> dict:
+    # per column missing rate, zero rate, log normal size and the positive class shift;
+    # the dropped columns come last
+    try:
+        n_columns = n_features + n_dropped
+        na_rate = np.concatenate([
+            np.where(rng.random(n_features) < 0.75, rng.uniform(0, 0.02, n_features), rng.uniform(0.02, 0.3, n_features)),
+            rng.uniform(0.6, 0.85, n_dropped),
+        ])
+        informative = np.zeros(n_columns, dtype=bool)
+        informative[rng.choice(n_features, max(int(n_features * INFORMATIVE_COLUMN_FRACTION), 1), replace=False)] = True
+        return {
+            "na_rate": na_rate,
+            "zero_rate": rng.uniform(0.2, 0.95, n_columns),
+            "log_mean": rng.uniform(2, 12, n_columns),
+            "log_sigma": rng.uniform(0.5, 2.5, n_columns),
+            "informative": informative,
+            "pos_log_shift": np.where(informative, rng.uniform(0.5, 1.5, n_columns), 0.0),
+        }
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def iter_aps_chunks(n_rows:int, schema_file_path:str="schema.yaml", seed:int=42,
+                    pos_fraction:float=SYNTHETIC_POS_FRACTION, row_seed:Optional[int]=None) -> Iterator[pd.DataFrame]:
+    # seed picks the column distributions and row_seed (seed by default) the rows drawn from
+    # them, so another row_seed gives new rows of the same distribution. The first n rows are the
+    # same for any larger n_rows. Missing readings are NaN.
+    try:
+        row_seed = seed if row_seed is None else row_seed
+        schema = load_schema(schema_file_path)
+        feature_columns = schema.feature_columns
+        columns = feature_columns + schema.drop_columns
+        profiles = get_column_profiles(len(feature_columns), len(schema.drop_columns), np.random.default_rng(seed))
+        negative_label, positive_label = schema.target_values or ["neg", "pos"]
+        # the original file lists the target first and the sensors alphabetically
+        column_order = [schema.target_column] + sorted(columns)
+
+        for chunk_idx, start in enumerate(range(0, n_rows, SYNTHETIC_CHUNK_SIZE)):
+            rng = np.random.default_rng([row_seed, chunk_idx])
+            # a last partial chunk is cut from a full one so it matches the rows of longer runs
+            n_chunk = SYNTHETIC_CHUNK_SIZE
+            is_pos = rng.random(n_chunk) < pos_fraction
+            # the class the readings are drawn from, the label stays is_pos
+            label_noise = np.where(is_pos, SYNTHETIC_LABEL_NOISE, SYNTHETIC_LABEL_NOISE * pos_fraction / (1 - pos_fraction))
+            reads_pos = is_pos ^ (rng.random(n_chunk) < label_noise)
+            pos_rows = reads_pos[:, None] & profiles["informative"]
+
+            values = rng.lognormal(profiles["log_mean"], profiles["log_sigma"], (n_chunk, len(columns)))
+            values *= np.exp(np.where(pos_rows, profiles["pos_log_shift"], 0.0))
+            values = np.maximum(np.round(values), 1)
+            # positives read zero less often on the informative columns
+            zero_rate = np.where(pos_rows, profiles["zero_rate"] * 0.3, profiles["zero_rate"])
+            values[rng.random((n_chunk, len(columns))) < zero_rate] = 0
+            values[rng.random((n_chunk, len(columns))) < profiles["na_rate"]] = np.nan
+
+            n_keep = min(SYNTHETIC_CHUNK_SIZE, n_rows - start)
+            df = pd.DataFrame(values[:n_keep], columns=columns, index=pd.RangeIndex(start, start + n_keep))
+            df.insert(0, schema.target_column, np.where(is_pos[:n_keep], positive_label, negative_label))
+            yield df[column_order]
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def generate_aps_dataframe(n_rows:int, schema_file_path:str="schema.yaml", seed:int=42,
+                           pos_fraction:float=SYNTHETIC_POS_FRACTION, row_seed:Optional[int]=None) -> pd.DataFrame:
+    try:
+        chunks = list(iter_aps_chunks(n_rows, schema_file_path, seed=seed, pos_fraction=pos_fraction, row_seed=row_seed))
+        return chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+
+def write_aps_csv(file_path:str, n_rows:int, schema_file_path:str="schema.yaml", seed:int=42,
+                  pos_fraction:float=SYNTHETIC_POS_FRACTION, row_seed:Optional[int]=None) -> str:
+    # written chunk by chunk with "na" for missing readings, like the original training file
+    try:
+        dir_path = os.path.dirname(file_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        logging.info(f"Writing {n_rows} synthetic APS rows with seed {seed} and row seed {row_seed} to {file_path}")
+        with open(file_path, "w", newline="") as file_obj:
+            chunks = iter_aps_chunks(n_rows, schema_file_path, seed=seed, pos_fraction=pos_fraction, row_seed=row_seed)
+            for chunk_idx, df in enumerate(chunks):
+                # nullable integers format several times faster than a float_format
+                df = df.astype({col: "Int64" for col in df.columns[1:]})
+                df.to_csv(file_obj, index=False, header=chunk_idx == 0, na_rep="na")
+        return file_path
+    except Exception as e:
+        raise SensorException(e, sys)
@@ -5,62 +5,433 @@ import numpy as np
 import json
 import yaml
 import dill
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from .exception import SensorException
 from .logger import logging
-from .config import mongo_client
+from .config import get_mongo_client, get_env_var
+from .entity.schema_entity import load_schema
 
 
-def export_collection_as_dataframe(database_name, collection_name)->pd.DataFrame:
+EXPORT_BATCH_SIZE = 10_000
+INSERT_BATCH_SIZE = 10_000
+ROW_HASH_FIELD = "row_hash"
+DUPLICATE_KEY_ERROR_CODE = 11000
+MISSING_VALUE_MARKERS = ["na"]
+# stored text that is a missing reading rather than an unparsable one
+MISSING_VALUE_TEXT = MISSING_VALUE_MARKERS + ["", "nan", "NaN", "NA", "null", "None"]
+# exported dataframe column with the raw feature values of a row that did not parse as numbers,
+# as json {column: value}; only present when some row has one
+UNPARSABLE_VALUES_COLUMN = "unparsable_values"
+
+
+def read_collection_partition(collection, query:dict, projection:dict, feature_columns:List[str],
+                              target_column:Optional[str], feature_arr:np.ndarray, target_arr:Optional[np.ndarray],
+                              start:int, n_rows:int, batch_size:int)->Tuple[int, Dict[int, dict]]:
+    # Stream the documents matching `query` into rows [start, start + n_rows) of the shared
+    # buffers and return how many were read, with the feature values that did not parse as
+    # numbers by buffer row ({row: {column: value}}); those cells are NAN in the buffer.
+    # Partitions never overlap, so concurrent readers write to the same buffers without locking.
     try:
-        if collection_name in mongo_client[database_name].list_collection_names():
-            df = pd.DataFrame(list(mongo_client[database_name][collection_name].find()))
-            if "_id" in df.columns:
-                df.drop(['_id'], axis=1, inplace=True)
+        n_filled = 0
+        unparsable_values = dict()
+        # every cursor gets its own copy of the projection, mongomock modifies it while iterating
+        cursor = collection.find(query, dict(projection), batch_size=batch_size)
+        try:
+            while n_filled < n_rows:
+                batch = list(itertools.islice(cursor, batch_size))
+                if len(batch) == 0:
+                    break
+                # documents inserted while streaming are ignored, the buffer is already sized
+                batch = batch[:n_rows - n_filled]
+                batch_start, batch_end = start + n_filled, start + n_filled + len(batch)
+                for col_idx, col in enumerate(feature_columns):
+                    values = pd.Series([doc.get(col) for doc in batch], dtype=object)
+                    parsed = pd.to_numeric(values, errors="coerce")
+                    feature_arr[batch_start:batch_end, col_idx] = parsed
+                    is_nan = parsed.isna().to_numpy()
+                    if is_nan.any():
+                        nan_values = values[is_nan]
+                        unparsable = nan_values[nan_values.notna() & ~nan_values.isin(MISSING_VALUE_TEXT)]
+                        for row_idx, value in unparsable.items():
+                            unparsable_values.setdefault(batch_start + row_idx, dict())[col] = str(value)
+                if target_arr is not None:
+                    target_arr[batch_start:batch_end] = [doc.get(target_column) for doc in batch]
+                n_filled += len(batch)
+        finally:
+            cursor.close()
+        return n_filled, unparsable_values
+    except Exception as e:
+        raise SensorException(e, sys)
 
-            return df
+def get_partition_queries(collection, query:dict, n_rows:int, n_partitions:int)->List[Tuple[dict, int, int]]:
+    # (query, first row, number of rows) of `n_partitions` _id ranges holding about the same
+    # number of documents. The boundaries are read off the _id index, nothing is sampled.
+    try:
+        offsets = [n_rows * part_idx // n_partitions for part_idx in range(n_partitions + 1)]
+        boundaries = []
+        for offset in offsets[1:-1]:
+            boundary_doc = next(collection.find(query, {"_id": 1}).sort("_id", 1).skip(offset).limit(1), None)
+            if boundary_doc is None:
+                break
+            boundaries.append(boundary_doc["_id"])
+        offsets = offsets[:len(boundaries) + 1] + [n_rows]
+
+        partition_queries = []
+        for part_idx in range(len(offsets) - 1):
+            id_range = dict()
+            if part_idx > 0:
+                id_range["$gte"] = boundaries[part_idx - 1]
+            if part_idx < len(boundaries):
+                id_range["$lt"] = boundaries[part_idx]
+            partition_query = {"$and": [query, {"_id": id_range}]} if id_range else query
+            partition_queries.append((partition_query, offsets[part_idx], offsets[part_idx + 1] - offsets[part_idx]))
+        return partition_queries
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def export_collection_as_arrays(database_name, collection_name, columns:List[str],
+                               target_column:Optional[str]=None,
+                               batch_size:int=EXPORT_BATCH_SIZE,
+                               query:Optional[dict]=None,
+                               n_workers:int=1)->Tuple[np.ndarray, Optional[np.ndarray], Dict[int, dict]]:
+    # Stream a collection into a preallocated (rows, features) float32 buffer and an object
+    # target array. Only `columns` are projected on the server (no _id) and the cursor is read
+    # in batches of `batch_size`, so peak memory stays close to the final array size. Feature
+    # values that are not numbers are NAN and returned by row as {row: {column: value}}.
+    # With n_workers > 1 the collection is split into _id ranges read concurrently over the
+    # client's connection pool, each straight into its own rows of the same buffers.
+    try:
+        collection = get_mongo_client()[database_name][collection_name]
+        feature_columns = [col for col in columns if col != target_column]
+        projection = {col: 1 for col in columns}
+        projection["_id"] = 0
+
+        query = query or {}
+        n_rows = collection.count_documents(query)
+        # every concurrent cursor holds a pooled connection
+        n_workers = max(min(n_workers, get_env_var().mongo_max_pool_size, n_rows // batch_size + 1), 1)
+        logging.info(f"Streaming {n_rows} documents from {database_name}.{collection_name} in batches of {batch_size} "
+                     f"with {n_workers} readers")
+        # fortran order keeps every column contiguous and lets pandas wrap the buffer without a copy
+        feature_arr = np.empty((n_rows, len(feature_columns)), dtype=np.float32, order="F")
+        target_arr = np.empty(n_rows, dtype=object) if target_column in columns else None
+
+        if n_workers == 1:
+            partition_queries = [(query, 0, n_rows)]
+        else:
+            partition_queries = get_partition_queries(collection, query, n_rows, n_workers)
+        read_args = [(collection, partition_query, projection, feature_columns, target_column, feature_arr, target_arr,
+                      start, part_rows, batch_size) for partition_query, start, part_rows in partition_queries]
+        if len(read_args) == 1:
+            part_results = [read_collection_partition(*read_args[0])]
         else:
+            with ThreadPoolExecutor(max_workers=len(read_args)) as executor:
+                part_results = list(executor.map(lambda args: read_collection_partition(*args), read_args))
+
+        # documents deleted while streaming leave partitions short, close the gaps
+        n_filled = 0
+        unparsable_values = dict()
+        for (_, start, _), (part_filled, part_unparsable) in zip(partition_queries, part_results):
+            if start != n_filled:
+                feature_arr[n_filled:n_filled + part_filled] = feature_arr[start:start + part_filled]
+                if target_arr is not None:
+                    target_arr[n_filled:n_filled + part_filled] = target_arr[start:start + part_filled]
+            unparsable_values.update((row - start + n_filled, values) for row, values in part_unparsable.items())
+            n_filled += part_filled
+
+        if len(unparsable_values) > 0:
+            logging.info(f"{len(unparsable_values)} documents hold feature values that are not numbers")
+        if target_arr is not None:
+            target_arr = target_arr[:n_filled]
+        return feature_arr[:n_filled], target_arr, unparsable_values
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def export_collection_as_dataframe(database_name, collection_name,
+                                   columns:Optional[List[str]]=None,
+                                   target_column:Optional[str]=None,
+                                   batch_size:int=EXPORT_BATCH_SIZE,
+                                   query:Optional[dict]=None,
+                                   n_workers:int=1)->pd.DataFrame:
+    # With `columns` the collection is streamed through export_collection_as_arrays
+    # instead of being materialised as a list of documents.
+    try:
+        if collection_name not in get_mongo_client()[database_name].list_collection_names():
             return None
+
+        if columns is None:
+            df = pd.DataFrame(list(get_mongo_client()[database_name][collection_name].find()))
+            df.drop(['_id', ROW_HASH_FIELD], axis=1, inplace=True, errors="ignore")
+            return df
+
+        feature_arr, target_arr, unparsable_values = export_collection_as_arrays(
+            database_name, collection_name, columns=columns, target_column=target_column, batch_size=batch_size,
+            query=query, n_workers=n_workers)
+        feature_columns = [col for col in columns if col != target_column]
+        df = pd.DataFrame(feature_arr, columns=feature_columns, copy=False)
+        if target_arr is not None:
+            df.insert(0, target_column, target_arr)
+        add_unparsable_values_column(df, unparsable_values)
+        logging.info(f"Exported dataframe shape: {df.shape}")
+        return df
     except Exception as e:
         raise SensorException(e, sys)
     
-def dump_csv_to_mongodb(file_path:str, database_name:str, collection_name:str):
-    try:
-        # load saved data if available
-        prev_df = export_collection_as_dataframe(database_name, collection_name)
-        logging.info("imported existing data")
-        if prev_df is not None:
-            # read new data with pandas
-            df = pd.read_csv(file_path)
-            logging.info(f"Rows and columns shape: {df.shape}")
-            # drop index column
-            df.reset_index(drop=True, inplace=True)
-            # concat both data
-            df = pd.concat([df, prev_df], ignore_index=True)
-            logging.info("Concatenated new data")
-            # drop duplicates
-            df = df.drop_duplicates()
-            df.reset_index(drop=True, inplace=True)
-            logging.info("duplicate datapoints dropped")
-            # convert to json
-            json_records = list(json.loads(df.T.to_json()).values())
-            # delete previous collection if exist
-            mongo_client[database_name][collection_name].drop()
-            logging.info("existing collection dropped")
-            # dump records in mongodb
-            mongo_client[database_name][collection_name].insert_many(json_records)
-        else:
-            logging.info("No existing data found, inserting new data")
-            df = pd.read_csv(file_path)
-            logging.info(f"Rows and columns shape: {df.shape}")
-            # drop index column
-            df.reset_index(drop=True, inplace=True)
-            # convert to json
-            json_records = list(json.loads(df.T.to_json()).values())
-            # dump records in mongodb
-            mongo_client[database_name][collection_name].insert_many(json_records)
+def add_unparsable_values_column(df:pd.DataFrame, unparsable_values:Dict[int, dict]) -> None:
+    # UNPARSABLE_VALUES_COLUMN of an exported frame from the {row position: {column: value}} of the export
+    try:
+        if len(unparsable_values) == 0:
+            return
+        column = np.full(len(df), None, dtype=object)
+        for row, values in unparsable_values.items():
+            column[row] = json.dumps(values, sort_keys=True)
+        df[UNPARSABLE_VALUES_COLUMN] = column
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def get_collection_state(database_name:str, collection_name:str, max_id=None)->Tuple[int, object]:
+    # (document count, largest _id) of a collection, counting only documents up to `max_id` if given
+    try:
+        collection = get_mongo_client()[database_name][collection_name]
+        if max_id is None:
+            latest_doc = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if latest_doc is None:
+                return 0, None
+            max_id = latest_doc["_id"]
+        return collection.count_documents({"_id": {"$lte": max_id}}), max_id
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def compute_row_hash(df:pd.DataFrame)->np.ndarray:
+    # content hash of every row, independent of column order, as signed int64 (bson has no uint64)
+    try:
+        return pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).values.view(np.int64)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def stored_value_as_text(value)->str:
+    # the csv text a value stored by an upload was parsed from: numbers as pandas writes them
+    # back (whole floats of int columns that had missing cells as ints), null as an empty cell
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def get_stored_records(df:pd.DataFrame)->List[dict]:
+    # documents for the rows of a csv read with the default pandas dtypes, as uploads always
+    # stored them: numbers as numbers, text (the "na" markers included) as text, missing as null
+    try:
+        df = df.astype(object).where(df.notna(), None)
+        return df.to_dict(orient="records")
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def backfill_row_hashes(collection)->int:
+    # Add the row hash to documents uploaded before rows were hashed, computed on their values
+    # written back as csv text so a re-upload of their file matches them. Documents repeating a
+    # row that is already hashed are deleted. Returns the number of documents hashed.
+    try:
+        query = {ROW_HASH_FIELD: {"$exists": False}}
+        if collection.find_one(query, {"_id": 1}) is None:
+            return 0
+
+        n_hashed, n_deleted = 0, 0
+        while True:
+            docs = list(collection.find(query, limit=INSERT_BATCH_SIZE))
+            if len(docs) == 0:
+                break
+            ids = np.array([doc.pop("_id") for doc in docs], dtype=object)
+            df = pd.DataFrame(docs).apply(lambda col: col.map(stored_value_as_text))
+            row_hashes = compute_row_hash(df)
+            existing_hashes = [doc[ROW_HASH_FIELD] for doc in
+                               collection.find({ROW_HASH_FIELD: {"$in": row_hashes.tolist()}}, {ROW_HASH_FIELD: 1})]
+            is_duplicate = pd.Series(row_hashes).duplicated().values | np.isin(row_hashes, existing_hashes)
+            if is_duplicate.any():
+                n_deleted += collection.delete_many({"_id": {"$in": ids[is_duplicate].tolist()}}).deleted_count
+            # one update per document, this runs once per collection
+            for _id, row_hash in zip(ids[~is_duplicate], row_hashes[~is_duplicate].tolist()):
+                n_hashed += collection.update_one({"_id": _id}, {"$set": {ROW_HASH_FIELD: row_hash}}).modified_count
+        logging.info(f"Added the row hash to {n_hashed} documents, deleted {n_deleted} duplicate documents")
+        return n_hashed
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def dump_csv_to_mongodb(file_path:str, database_name:str, collection_name:str)->int:
+    try:
+        from pymongo.errors import BulkWriteError
+        collection = get_mongo_client()[database_name][collection_name]
+        # rows stored before hashing was introduced are hashed first, so the unique index on
+        # the row hash covers every document and rejects their rows too
+        backfill_row_hashes(collection)
+        collection.create_index(ROW_HASH_FIELD, unique=True,
+                                partialFilterExpression={ROW_HASH_FIELD: {"$exists": True}})
+
+        # hash every field as raw text so the hash does not depend on per-file dtype inference,
+        # store the values with the default dtypes
+        text_df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+        df = pd.read_csv(file_path)
+        if len(df) != len(text_df):
+            raise Exception(f"{file_path} parsed to {len(df)} rows with dtypes and {len(text_df)} rows as text")
+        logging.info(f"Rows and columns shape: {df.shape}")
+        df[ROW_HASH_FIELD] = compute_row_hash(text_df)
+        del text_df
+        df = df[~df[ROW_HASH_FIELD].duplicated()]
+        logging.info(f"Rows left after dropping duplicates within the file: {len(df)}")
+
+        # append only, rows already in the collection are rejected by the unique index
+        n_inserted = 0
+        for start in range(0, len(df), INSERT_BATCH_SIZE):
+            records = get_stored_records(df.iloc[start:start + INSERT_BATCH_SIZE])
+            try:
+                n_inserted += len(collection.insert_many(records, ordered=False).inserted_ids)
+            except BulkWriteError as bwe:
+                write_errors = bwe.details.get("writeErrors", [])
+                if any(error["code"] != DUPLICATE_KEY_ERROR_CODE for error in write_errors):
+                    raise
+                n_inserted += bwe.details.get("nInserted", 0)
+        logging.info(f"Inserted {n_inserted} new rows, skipped {len(df) - n_inserted} existing rows")
+        return n_inserted
     except Exception as e:
         raise SensorException(e, sys)
     
+def read_csv_with_schema(file_path:str, schema_file_path:str, columns:Optional[List[str]]=None,
+                         engine:Optional[str]=None, chunksize:Optional[int]=None):
+    # Parse a csv with the dtypes from the schema: features as float32 with the na markers
+    # read as NAN, the target as str. Only `columns` (default: schema required columns) that
+    # exist in the file are parsed, missing ones are left for validation to report. With
+    # chunksize an iterator of dataframes of that many rows is returned instead, always read
+    # with the C engine.
+    try:
+        schema = load_schema(schema_file_path)
+        target_column = schema.target_column
+        columns = schema.required_column_set if columns is None else set(columns)
+        header = pd.read_csv(file_path, nrows=0).columns
+        usecols = [col for col in header if col in columns]
+        dtype = {col: (str if col == target_column else np.float32) for col in usecols}
+        engine = engine or get_env_var().csv_engine
+        if chunksize is not None and engine == "pyarrow":
+            # pandas cannot read in chunks with the pyarrow engine
+            engine = "c"
+        logging.info(f"Reading {len(usecols)} of {len(header)} columns from {file_path} with {engine} engine")
+        return pd.read_csv(file_path, usecols=usecols, dtype=dtype, na_values=MISSING_VALUE_MARKERS, engine=engine,
+                           chunksize=chunksize)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def iter_csv_text_chunks(file_path:str, chunk_rows:Optional[int]=None):
+    # Every column of a csv as arrow string columns holding the text as written, in tables of
+    # chunk_rows rows (None reads the whole file as one table). The na markers and the missing
+    # value strings pandas recognises are nulls, so output written from these tables repeats the
+    # input values unchanged with empty missing cells, like the file read by pandas and written back.
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+        columns = list(pd.read_csv(file_path, nrows=0).columns)
+        convert_options = pa_csv.ConvertOptions(column_types={col: pa.string() for col in columns},
+                                                null_values=pa_csv.ConvertOptions().null_values + MISSING_VALUE_MARKERS,
+                                                strings_can_be_null=True)
+        if chunk_rows is None:
+            yield pa_csv.read_csv(file_path, convert_options=convert_options)
+            return
+
+        reader = pa_csv.open_csv(file_path, convert_options=convert_options)
+        batches, n_batched = [], 0
+        for batch in reader:
+            batches.append(batch)
+            n_batched += batch.num_rows
+            while n_batched >= chunk_rows:
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+                yield table.slice(0, chunk_rows)
+                rest = table.slice(chunk_rows)
+                batches, n_batched = rest.to_batches(), rest.num_rows
+        if n_batched > 0:
+            yield pa.Table.from_batches(batches, schema=reader.schema)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def get_float32_frame(table, columns:List[str]) -> pd.DataFrame:
+    # float32 dataframe of `columns` parsed from the text columns of an iter_csv_text_chunks table,
+    # through float64 like the csv and mongodb readers; text that is not a number raises
+    try:
+        import pyarrow as pa
+        missing_columns = [col for col in columns if col not in table.column_names]
+        if len(missing_columns) > 0:
+            raise Exception(f"Missing columns: {missing_columns}")
+        arr = np.empty((table.num_rows, len(columns)), dtype=np.float32, order="F")
+        for col_idx, col in enumerate(columns):
+            arr[:, col_idx] = table[col].cast(pa.float64()).to_numpy()
+        return pd.DataFrame(arr, columns=columns, copy=False)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def write_csv_text_chunk(file_obj, table) -> None:
+    # Rows of an arrow table to a binary file, formatted like DataFrame.to_csv without header.
+    # Arrow quotes every string, so it only writes chunks where no value needs quotes.
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        from pyarrow import csv as pa_csv
+        needs_quotes = any(pc.any(pc.match_substring_regex(table[col], r'[",\r\n]')).as_py()
+                           for col in table.column_names if pa.types.is_string(table.schema.field(col).type))
+        if needs_quotes:
+            file_obj.write(table.to_pandas().to_csv(index=False, header=False).encode())
+        else:
+            pa_csv.write_csv(table, file_obj, write_options=pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def save_dataframe(file_path:str, df:pd.DataFrame):
+    # the format follows the file extension: .feather / .parquet (zstd compressed) or .csv
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file_format = os.path.splitext(file_path)[1].lstrip(".")
+        if file_format == "csv":
+            df.to_csv(file_path, index=False, header=True)
+        elif file_format in ("feather", "parquet"):
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if file_format == "feather":
+                from pyarrow import feather
+                feather.write_feather(table, file_path, compression="zstd")
+            else:
+                from pyarrow import parquet
+                parquet.write_table(table, file_path, compression="zstd")
+        else:
+            raise Exception(f"Unsupported dataframe file format: {file_format}")
+        logging.info(f"Dataframe {df.shape} saved at {file_path}")
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def load_dataframe(file_path:str, schema_file_path:str, columns:Optional[List[str]]=None)->pd.DataFrame:
+    # counterpart of save_dataframe, with the same column selection as read_csv_with_schema
+    try:
+        file_format = os.path.splitext(file_path)[1].lstrip(".")
+        if file_format == "csv":
+            return read_csv_with_schema(file_path, schema_file_path, columns=columns)
+        if file_format not in ("feather", "parquet"):
+            raise Exception(f"Unsupported dataframe file format: {file_format}")
+
+        import pyarrow as pa
+        columns = load_schema(schema_file_path).required_column_set if columns is None else set(columns)
+        if file_format == "feather":
+            from pyarrow import feather
+            with pa.memory_map(file_path) as source:
+                header = pa.ipc.open_file(source).schema.names
+            usecols = [col for col in header if col in columns]
+            df = feather.read_feather(file_path, columns=usecols, memory_map=True)
+        else:
+            from pyarrow import parquet
+            header = parquet.read_schema(file_path).names
+            usecols = [col for col in header if col in columns]
+            df = parquet.read_table(file_path, columns=usecols).to_pandas()
+        logging.info(f"Loaded {len(usecols)} of {len(header)} columns from {file_path}")
+        return df
+    except Exception as e:
+        raise SensorException(e, sys)
+
 def write_yaml_file(file_path, data:dict):
     try:
         file_dir = os.path.dirname(file_path)
@@ -113,4 +484,22 @@ def load_numpy_array(file_path:str):
             data = np.load(file_obj)
         return data
     except Exception as e:
-        raise SensorException(e, sys)
\ No newline at end of file
+        raise SensorException(e, sys)
+    
+def save_numpy_arrays(file_path:str, arrays:dict):
+    try:
+        logging.info(f"Saving numpy arrays")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file_obj:
+            np.savez(file_obj, **arrays)
+        logging.info(f"Numpy arrays saved at {file_path}")
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def load_numpy_arrays(file_path:str)->dict:
+    try:
+        logging.info(f"Loading numpy arrays: {file_path}")
+        with np.load(file_path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    except Exception as e:
+        raise SensorException(e, sys)
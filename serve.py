@@ -0,0 +1,22 @@
+import sys
+from sensor.pipeline.scoring_service import SensorScoringService
+from sensor.entity.config_entity import ScoringServiceConfig
+from sensor.logger import logging
+
+
+if __name__ == "__main__":
+    try:
+        host = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+        scoring_service = SensorScoringService(ScoringServiceConfig(host=host, port=port))
+        print(f"Scoring service listening on {scoring_service.address}, POST /predict, GET /stats")
+        try:
+            scoring_service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scoring_service.shutdown()
+
+    except Exception as e:
+        logging.info(f"Error occured: {e}")
+        print(e)
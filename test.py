@@ -1,10 +1,26 @@
 import os
 import sys
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
 from sensor.utils import dump_csv_to_mongodb
 from sensor.exception import SensorException
 from sensor.logger import logging
 
 
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE_PATH = os.path.join(REPO_DIR, "schema.yaml")
+TEST_DATABASE_NAME = "sensor_test"
+TEST_COLLECTION_NAME = "sensor_readings"
+
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+# importing the pipeline modules must not import these; the component and sensor.ml modules
+# import them at module level and are only imported by the stage or prediction that runs them
+DEFERRED_MODULES = ["xgboost", "sklearn", "imblearn", "scipy", "pymongo", "dotenv"]
+
+
 def storing_data_in_mongo():
     try:
         file_path = "E:/sensor_fault_detection/aps_failure_training_set1.csv"
@@ -22,6 +38,594 @@ def test_exception_and_logger():
     except Exception as e:
         raise SensorException(e, sys)
 
+def test_exception_message():
+    # the wrapped error names the original exception and the file it was raised in
+    try:
+        x = 1/0
+    except Exception as e:
+        error = SensorException(e, sys)
+    assert "division by zero" in str(error)
+    assert "test.py" in str(error)
+
+def upload_test_collection(file_path:str, n_rows:int, seed:int=42):
+    # a fresh in-process mongomock client holding n_rows synthetic rows uploaded like upload_data.py does
+    try:
+        import mongomock
+        from sensor.config import set_mongo_client
+        from sensor.synthetic_data import write_aps_csv
+        mongo_client = mongomock.MongoClient()
+        set_mongo_client(mongo_client)
+        write_aps_csv(file_path, n_rows, schema_file_path=SCHEMA_FILE_PATH, seed=seed)
+        dump_csv_to_mongodb(file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME)
+        return mongo_client[TEST_DATABASE_NAME][TEST_COLLECTION_NAME]
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def get_test_columns(n_features:int=8):
+    # the target and the first few features keep the mongomock tests fast
+    try:
+        from sensor.entity.schema_entity import load_schema
+        schema = load_schema(SCHEMA_FILE_PATH)
+        return [schema.target_column] + schema.feature_columns[:n_features], schema.target_column
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_parallel_export_matches_sequential_export():
+    try:
+        from sensor.utils import export_collection_as_dataframe
+        columns, target_column = get_test_columns()
+        with tempfile.TemporaryDirectory() as work_dir:
+            upload_test_collection(os.path.join(work_dir, "train.csv"), n_rows=300)
+            sequential_df = export_collection_as_dataframe(TEST_DATABASE_NAME, TEST_COLLECTION_NAME, columns=columns,
+                                                           target_column=target_column, batch_size=50)
+            parallel_df = export_collection_as_dataframe(TEST_DATABASE_NAME, TEST_COLLECTION_NAME, columns=columns,
+                                                         target_column=target_column, batch_size=50, n_workers=3)
+        assert sequential_df.shape == (300, len(columns))
+        pd.testing.assert_frame_equal(parallel_df, sequential_df)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_snapshot_delta_matches_full_export():
+    # the first export, the unchanged reload and the delta after an append all equal a full export
+    try:
+        from sensor.snapshot import CollectionSnapshot
+        from sensor.synthetic_data import write_aps_csv
+        from sensor.utils import export_collection_as_dataframe
+        columns, target_column = get_test_columns()
+        with tempfile.TemporaryDirectory() as work_dir:
+            upload_test_collection(os.path.join(work_dir, "train.csv"), n_rows=200)
+            snapshot = CollectionSnapshot(os.path.join(work_dir, "snapshots"), TEST_DATABASE_NAME, TEST_COLLECTION_NAME,
+                                          columns=columns, target_column=target_column, batch_size=50)
+            for append_rows in [0, 0, 100]:
+                if append_rows > 0:
+                    new_file_path = write_aps_csv(os.path.join(work_dir, "new.csv"), append_rows,
+                                                  schema_file_path=SCHEMA_FILE_PATH, row_seed=7)
+                    dump_csv_to_mongodb(new_file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME)
+                full_df = export_collection_as_dataframe(TEST_DATABASE_NAME, TEST_COLLECTION_NAME, columns=columns,
+                                                         target_column=target_column)
+                pd.testing.assert_frame_equal(snapshot.get_dataframe(), full_df)
+            assert snapshot.read_meta()["count"] == 300
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_upload_skips_existing_rows():
+    # uploading the same file again, or a file overlapping the collection, adds only the new rows
+    try:
+        from sensor.synthetic_data import write_aps_csv
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_path = os.path.join(work_dir, "train.csv")
+            collection = upload_test_collection(file_path, n_rows=100)
+            assert collection.count_documents({}) == 100
+            assert dump_csv_to_mongodb(file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME) == 0
+
+            # the first rows of a larger file are the rows already uploaded
+            overlap_file_path = write_aps_csv(os.path.join(work_dir, "overlap.csv"), 150, schema_file_path=SCHEMA_FILE_PATH)
+            assert dump_csv_to_mongodb(overlap_file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME) == 50
+            assert collection.count_documents({}) == 150
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_upload_hashes_legacy_rows():
+    # documents stored before rows were hashed get the hash of their csv text, so re-uploading
+    # their file adds nothing, and uploaded values keep their numeric types
+    try:
+        import json
+        import mongomock
+        from sensor.config import set_mongo_client
+        from sensor.synthetic_data import write_aps_csv
+        from sensor.utils import ROW_HASH_FIELD
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_path = write_aps_csv(os.path.join(work_dir, "train.csv"), 100, schema_file_path=SCHEMA_FILE_PATH)
+            mongo_client = mongomock.MongoClient()
+            set_mongo_client(mongo_client)
+            collection = mongo_client[TEST_DATABASE_NAME][TEST_COLLECTION_NAME]
+            # the records the upload stored before rows were hashed
+            df = pd.read_csv(file_path)
+            collection.insert_many(list(json.loads(df.T.to_json()).values()))
+
+            assert dump_csv_to_mongodb(file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME) == 0
+            assert collection.count_documents({}) == 100
+            assert collection.count_documents({ROW_HASH_FIELD: {"$exists": False}}) == 0
+
+            collection.drop()
+            assert dump_csv_to_mongodb(file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME) == 100
+            stored_df = pd.DataFrame(list(collection.find({}, {"_id": 0, ROW_HASH_FIELD: 0})))
+            pd.testing.assert_frame_equal(stored_df[df.columns], df)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_ks_columns_match_scipy():
+    # float32 (packed sort keys) and float64 (argsort) columns with ties and NANs, every KS method
+    try:
+        from scipy.stats import ks_2samp
+        from sensor.ml.drift import ks_2samp_columns, ks_2samp_column_blocks
+        rng = np.random.default_rng(0)
+        base_arr = np.round(rng.normal(0, 1, (300, 6)), 1)
+        current_arr = np.round(rng.normal(0.2, 1.2, (200, 6)), 1)
+        base_arr[rng.random(base_arr.shape) < 0.1] = np.nan
+        current_arr[rng.random(current_arr.shape) < 0.1] = np.nan
+        for dtype in [np.float32, np.float64]:
+            base, current = base_arr.astype(dtype), current_arr.astype(dtype)
+            for method in ["asymp", "exact"]:
+                statistics, p_values = ks_2samp_columns(base, current, method=method)
+                for col_idx in range(base.shape[1]):
+                    base_col, current_col = base[:, col_idx], current[:, col_idx]
+                    expected = ks_2samp(base_col[~np.isnan(base_col)], current_col[~np.isnan(current_col)], method=method)
+                    assert np.isclose(statistics[col_idx], expected.statistic, rtol=1e-12, atol=0)
+                    assert np.isclose(p_values[col_idx], expected.pvalue, rtol=1e-9, atol=1e-300)
+            # auto matches scipy's default, which is exact for samples this small
+            statistics, p_values = ks_2samp_column_blocks(base, current, block_size=4)
+            assert np.allclose(p_values, ks_2samp_columns(base, current, method="exact")[1], rtol=1e-12, atol=0)
+
+        # a column without values on one side has no result
+        current_arr[:, 0] = np.nan
+        statistics, p_values = ks_2samp_columns(base_arr, current_arr)
+        assert np.isnan(statistics[0]) and np.isnan(p_values[0])
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_profile_psi_matches_numpy():
+    # PSI against the profile bins recomputed column by column, and bin counts that add up over chunks
+    try:
+        from sensor.ml.drift import PSI_EPSILON, build_feature_profile, count_profile_bins, compare_counts_to_profile
+        rng = np.random.default_rng(1)
+        base_arr = np.round(rng.lognormal(0, 1, (500, 5)), 1).astype(np.float32)
+        current_arr = np.round(rng.lognormal(0.3, 1, (400, 5)), 1).astype(np.float32)
+        base_arr[rng.random(base_arr.shape) < 0.2] = np.nan
+        current_arr[rng.random(current_arr.shape) < 0.2] = np.nan
+        profile = build_feature_profile(base_arr, [f"col_{idx}" for idx in range(5)], n_bins=10)
+
+        chunk_counts = [count_profile_bins(profile, chunk) for chunk in np.array_split(current_arr, 3)]
+        current_counts = sum(counts for counts, _ in chunk_counts)
+        n_valid = sum(n for _, n in chunk_counts)
+        result = compare_counts_to_profile(profile, current_counts, n_valid, n_rows=len(current_arr))
+
+        for col_idx in range(base_arr.shape[1]):
+            edges = profile["bin_edges"][col_idx]
+            # a value equal to an edge belongs to the bin that edge closes
+            base_col, current_col = base_arr[:, col_idx], current_arr[:, col_idx]
+            base_counts = np.bincount(np.searchsorted(edges, base_col[~np.isnan(base_col)]), minlength=len(edges) + 1)
+            counts = np.bincount(np.searchsorted(edges, current_col[~np.isnan(current_col)]), minlength=len(edges) + 1)
+            assert np.array_equal(profile["bin_counts"][col_idx], base_counts)
+            assert np.array_equal(current_counts[col_idx], counts)
+            base_dist = np.maximum(base_counts / base_counts.sum(), PSI_EPSILON)
+            current_dist = np.maximum(counts / counts.sum(), PSI_EPSILON)
+            expected_psi = np.sum((current_dist - base_dist) * np.log(current_dist / base_dist))
+            assert np.isclose(result["psi"][col_idx], expected_psi, rtol=1e-12)
+            assert np.isclose(result["null_rate"][col_idx], np.isnan(current_col).mean())
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_stage_cache_hit_and_invalidation():
+    # a second run with the same inputs gets the first run's files, a changed config or input misses
+    try:
+        from sensor.entity.artifact_entity import DataIngestionArtifact
+        from sensor.entity.config_entity import TrainingPipelineConfig, DataIngestionConfig
+        from sensor.stage_cache import StageCache
+        with tempfile.TemporaryDirectory() as artifact_root_dir:
+            stage_cache = StageCache(artifact_root_dir, max_size=1024**3)
+            run_configs = []
+            for run_name in ["run_1", "run_2"]:
+                training_pipeline_config = TrainingPipelineConfig()
+                training_pipeline_config.artifact_dir = os.path.join(artifact_root_dir, run_name)
+                data_ingestion_config = DataIngestionConfig(training_pipeline_config)
+                data_ingestion_config.schema_file_path = SCHEMA_FILE_PATH
+                run_configs.append((training_pipeline_config.artifact_dir, data_ingestion_config))
+
+            first_dir, first_config = run_configs[0]
+            cache_key = stage_cache.get_key("data_ingestion", first_config, first_dir, upstream_key="(200, 199)")
+            assert stage_cache.restore(cache_key, first_dir) is None
+            os.makedirs(first_config.dataset_dir)
+            for file_path in [first_config.train_file_path, first_config.test_file_path]:
+                with open(file_path, "w") as file_obj:
+                    file_obj.write(os.path.basename(file_path))
+            stage_cache.add(cache_key, "data_ingestion",
+                            DataIngestionArtifact(first_config.train_file_path, first_config.test_file_path), first_dir)
+            stage_cache.commit(first_dir)
+
+            second_dir, second_config = run_configs[1]
+            assert stage_cache.get_key("data_ingestion", second_config, second_dir, upstream_key="(200, 199)") == cache_key
+            artifact = DataIngestionArtifact(**stage_cache.restore(cache_key, second_dir))
+            assert artifact == DataIngestionArtifact(second_config.train_file_path, second_config.test_file_path)
+            with open(artifact.train_file_path, "r") as file_obj:
+                assert file_obj.read() == os.path.basename(first_config.train_file_path)
+
+            assert stage_cache.get_key("data_ingestion", second_config, second_dir, upstream_key="(300, 299)") != cache_key
+            second_config.test_size = 0.3
+            changed_key = stage_cache.get_key("data_ingestion", second_config, second_dir, upstream_key="(200, 199)")
+            assert changed_key != cache_key
+            assert stage_cache.restore(changed_key, second_dir) is None
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_stage_cache_evicts_only_finished_runs():
+    # with the artifact root over its size, the directory of a run still in progress survives
+    # eviction by another run and is evicted once that run has released it
+    try:
+        import time
+        from sensor.stage_cache import StageCache, RUN_DIR_MIN_AGE_SECONDS
+        with tempfile.TemporaryDirectory() as artifact_root_dir:
+            run_dirs = [os.path.join(artifact_root_dir, run_name) for run_name in ["run_1", "run_2", "run_3"]]
+            stage_caches = [StageCache(artifact_root_dir, max_size=1024) for _ in run_dirs]
+            for stage_cache, run_dir in zip(stage_caches, run_dirs):
+                stage_cache.lock_run(run_dir)
+                with open(os.path.join(run_dir, "data.bin"), "wb") as file_obj:
+                    file_obj.write(b"0" * 4096)
+            # run_1 is finished, run_2 still in progress, both old enough to be evicted
+            stage_caches[0].release_run()
+            old_time = time.time() - 2 * RUN_DIR_MIN_AGE_SECONDS
+            for run_dir in run_dirs[:2]:
+                os.utime(run_dir, (old_time, old_time))
+
+            stage_caches[2].commit(run_dirs[2])
+            assert not os.path.exists(run_dirs[0])
+            assert os.path.exists(os.path.join(run_dirs[1], "data.bin"))
+
+            stage_caches[1].release_run()
+            stage_caches[2].commit(run_dirs[2])
+            assert not os.path.exists(run_dirs[1])
+            assert os.path.exists(os.path.join(run_dirs[2], "data.bin"))
+            stage_caches[2].release_run()
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_registry_publish_and_read():
+    try:
+        from sensor.ml.model_resolver import ModelResolver
+        with tempfile.TemporaryDirectory() as model_registry:
+            # a registry written before the manifest resolves its numbered directories
+            os.makedirs(os.path.join(model_registry, "0"))
+            model_resolver = ModelResolver(model_registry=model_registry)
+            assert model_resolver.get_latest_version() == 0
+
+            for accuracy in [0.9, 0.95]:
+                staging_dir = model_resolver.get_staging_dir_path()
+                os.makedirs(os.path.join(staging_dir, model_resolver.model_dir_name))
+                version_dir = model_resolver.publish(staging_dir, metadata={"accuracy": accuracy})
+                assert not os.path.exists(staging_dir)
+                assert os.path.isdir(os.path.join(version_dir, model_resolver.model_dir_name))
+
+            manifest = ModelResolver(model_registry=model_registry).read_manifest()
+            assert manifest["latest_version"] == 2
+            assert [entry["version"] for entry in manifest["versions"]] == [0, 1, 2]
+            assert [entry.get("accuracy") for entry in manifest["versions"]] == [None, 0.9, 0.95]
+            assert model_resolver.get_latest_dir_path() == os.path.join(model_registry, "2")
+
+            # a failed publish leaves the published versions alone
+            try:
+                model_resolver.publish(model_resolver.get_staging_dir_path(), metadata={})
+                raise AssertionError("Publishing a missing staging dir succeeded")
+            except SensorException:
+                pass
+            assert model_resolver.get_latest_version() == 2
+            assert not os.path.exists(os.path.join(model_registry, "3"))
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_registry_publish_failures_and_concurrency():
+    # a failed manifest write leaves no version dir behind, a dir left by a crashed publisher is
+    # skipped, and concurrent publishers each get their own version
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        from sensor.ml.model_resolver import ModelResolver
+        with tempfile.TemporaryDirectory() as model_registry:
+            model_resolver = ModelResolver(model_registry=model_registry)
+            staging_dir = model_resolver.get_staging_dir_path()
+            os.makedirs(staging_dir)
+            try:
+                model_resolver.publish(staging_dir, metadata={"not_json": object()})
+                raise AssertionError("Publishing metadata that is not json succeeded")
+            except SensorException:
+                pass
+            assert model_resolver.get_latest_version() is None
+            assert [name for name in os.listdir(model_registry) if not name.startswith("manifest")] == []
+
+            def publish(idx:int) -> str:
+                staging_dir = model_resolver.get_staging_dir_path()
+                os.makedirs(staging_dir)
+                return model_resolver.publish(staging_dir, metadata={"idx": idx})
+            assert publish(0) == os.path.join(model_registry, "0")
+            os.makedirs(os.path.join(model_registry, "1"))
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                version_dirs = list(executor.map(publish, range(1, 17)))
+            assert sorted(version_dirs, key=lambda path: int(os.path.basename(path))) == \
+                [os.path.join(model_registry, str(version)) for version in range(2, 18)]
+            manifest = model_resolver.read_manifest()
+            assert sorted(entry["idx"] for entry in manifest["versions"]) == list(range(17))
+            assert manifest["latest_version"] == 17
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def fit_test_model(n_rows:int=400):
+    # the pickled training objects the pipeline publishes: imputer + robust scaler, an early
+    # stopped xgboost classifier and the target encoder, fitted on a small synthetic dataset
+    try:
+        from sklearn.impute import SimpleImputer
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import LabelEncoder, RobustScaler
+        from xgboost import XGBClassifier
+        from sensor.synthetic_data import generate_aps_dataframe
+        df = generate_aps_dataframe(n_rows, schema_file_path=SCHEMA_FILE_PATH, pos_fraction=0.3)
+        _, target_column = get_test_columns()
+        # the pipeline reads every feature as float32
+        input_df = df.drop(columns=[target_column]).astype(np.float32)
+        transformer = Pipeline(steps=[("Imputer", SimpleImputer(strategy="constant", fill_value=0)),
+                                      ("RobustScaler", RobustScaler())])
+        transformer.fit(input_df)
+        target_encoder = LabelEncoder().fit(df[target_column])
+        arr, target = transformer.transform(input_df), target_encoder.transform(df[target_column])
+        model = XGBClassifier(n_estimators=50, max_depth=3, early_stopping_rounds=3)
+        model.fit(arr[:300], target[:300], eval_set=[(arr[300:], target[300:])], verbose=False)
+        return transformer, model, target_encoder
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_model_bundle_matches_pickled_objects():
+    # the bundle predicts like the sklearn transformer + classifier, also with reordered columns
+    # and after a save / load round trip
+    try:
+        from sensor.ml.model_bundle import ModelBundle, load_model_bundle
+        from sensor.synthetic_data import generate_aps_dataframe
+        transformer, model, target_encoder = fit_test_model()
+        model_bundle = ModelBundle.from_objects(transformer=transformer, model=model, target_encoder=target_encoder)
+        df = generate_aps_dataframe(500, schema_file_path=SCHEMA_FILE_PATH, pos_fraction=0.3, row_seed=7)
+        input_df = df[list(transformer.feature_names_in_)].astype(np.float32)
+        expected = model.predict(transformer.transform(input_df))
+        assert 0 < expected.sum() < len(expected)
+
+        assert np.array_equal(model_bundle.transform(input_df), transformer.transform(input_df).astype(np.float32))
+        assert np.array_equal(model_bundle.predict(input_df), expected)
+        assert np.array_equal(model_bundle.predict(input_df[input_df.columns[::-1]]), expected)
+        assert np.array_equal(model_bundle.inverse_transform(expected), target_encoder.inverse_transform(expected))
+        with tempfile.TemporaryDirectory() as bundle_dir:
+            model_bundle.save(bundle_dir)
+            assert np.array_equal(load_model_bundle(bundle_dir).predict(input_df), expected)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def publish_test_model():
+    # fit_test_model published with a feature profile to the default registry under the working directory
+    try:
+        from sensor.entity.config_entity import FEATURE_PROFILE_FILE_NAME
+        from sensor.ml.drift import build_feature_profile
+        from sensor.ml.model_bundle import ModelBundle
+        from sensor.ml.model_resolver import ModelResolver
+        from sensor.synthetic_data import generate_aps_dataframe
+        from sensor.utils import save_numpy_arrays
+        transformer, model, target_encoder = fit_test_model()
+        model_bundle = ModelBundle.from_objects(transformer=transformer, model=model, target_encoder=target_encoder)
+        model_resolver = ModelResolver()
+        staging_dir = model_resolver.get_staging_dir_path()
+        model_bundle.save(os.path.join(staging_dir, model_resolver.bundle_dir_name))
+        baseline_df = generate_aps_dataframe(400, schema_file_path=SCHEMA_FILE_PATH)[model_bundle.feature_names]
+        save_numpy_arrays(file_path=os.path.join(staging_dir, model_resolver.feature_profile_dir_name, FEATURE_PROFILE_FILE_NAME),
+                          arrays=build_feature_profile(baseline_df.to_numpy(dtype=np.float32), model_bundle.feature_names))
+        model_resolver.publish(staging_dir, metadata={"format": "bundle"})
+        return transformer, model, target_encoder, model_bundle
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_batch_prediction_reports_every_file():
+    # two good files predicted in worker processes chunk by chunk and one file that fails: the
+    # failure is reported for that file only and it stays in the inbox
+    try:
+        from sensor.entity.config_entity import BatchPredictionConfig
+        from sensor.pipeline.batch_prediction import SensorBatchPrediction
+        from sensor.synthetic_data import write_aps_csv
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                model_bundle = publish_test_model()[-1]
+
+                batch_config = BatchPredictionConfig()
+                batch_config.schema_file_path = SCHEMA_FILE_PATH
+                batch_config.n_workers = 2
+                batch_config.chunk_size = 100
+                good_file_paths = [write_aps_csv(os.path.join(batch_config.inbox_dir, f"good_{idx}.csv"), 250 + idx,
+                                                 schema_file_path=SCHEMA_FILE_PATH, row_seed=idx) for idx in range(2)]
+                bad_file_path = os.path.join(batch_config.inbox_dir, "bad.csv")
+                pd.DataFrame({"not_a_sensor": [1, 2, 3]}).to_csv(bad_file_path, index=False)
+                input_dfs = {file_path: pd.read_csv(file_path, na_values="na") for file_path in good_file_paths}
+
+                results = SensorBatchPrediction(batch_config).start_prediction()
+                assert [result["input_file"] for result in results] == sorted(good_file_paths + [bad_file_path])
+                results = {result["input_file"]: result for result in results}
+                assert results[bad_file_path]["status"] == "failed" and results[bad_file_path]["error"]
+                assert os.path.exists(bad_file_path)
+                for file_path, input_df in input_dfs.items():
+                    result = results[file_path]
+                    assert result["status"] == "success" and result["rows"] == len(input_df)
+                    assert not os.path.exists(file_path) and "drifted_columns" in result
+                    prediction_df = pd.read_csv(result["prediction_file"])
+                    expected = model_bundle.predict(input_df[model_bundle.feature_names].astype(np.float32))
+                    assert np.array_equal(prediction_df["prediction"].to_numpy(), expected)
+                    assert list(prediction_df["cat_pred"]) == list(model_bundle.inverse_transform(expected))
+            finally:
+                os.chdir(cwd)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_chunked_batch_output_matches_baseline():
+    # the outbox file written chunk by chunk equals what the original batch prediction wrote for the
+    # whole file: every input column with its value as written, missing cells empty, plus the predictions
+    try:
+        from sensor.entity.config_entity import BatchPredictionConfig
+        from sensor.pipeline.batch_prediction import SensorBatchPrediction
+        from sensor.synthetic_data import write_aps_csv
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                transformer, model, target_encoder, _ = publish_test_model()
+                batch_config = BatchPredictionConfig()
+                batch_config.schema_file_path = SCHEMA_FILE_PATH
+                batch_config.n_workers = 1
+                batch_config.chunk_size = 64
+                file_path = write_aps_csv(os.path.join(work_dir, "input.csv"), 300, schema_file_path=SCHEMA_FILE_PATH, row_seed=3)
+                df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+                # large readings that float32 cannot hold, text and ids that are not model features
+                df[transformer.feature_names_in_[0]] = [str(2130706538 + idx) if idx % 7 else "na" for idx in range(len(df))]
+                df[transformer.feature_names_in_[1]] = [str(9007199254740993 + idx) for idx in range(len(df))]
+                df["truck_id"] = [str(10**15 + idx) for idx in range(len(df))]
+                df["note"] = ["" if idx % 5 else f'axle {idx}, "rear"' for idx in range(len(df))]
+                input_file_path = os.path.join(batch_config.inbox_dir, "input.csv")
+                df.to_csv(input_file_path, index=False)
+
+                # the original batch prediction: pandas dtypes, "na" replaced, the pickled objects on the features
+                expected_df = pd.read_csv(input_file_path)
+                expected_df.replace({"na": np.nan}, inplace=True)
+                prediction = model.predict(transformer.transform(expected_df[list(transformer.feature_names_in_)]))
+                expected_df["prediction"] = prediction
+                expected_df["cat_pred"] = target_encoder.inverse_transform(prediction)
+                expected = expected_df.to_csv(index=False, header=True)
+
+                for pipeline_depth in [0, 2]:
+                    df.to_csv(input_file_path, index=False)
+                    batch_config.pipeline_depth = pipeline_depth
+                    result = SensorBatchPrediction(batch_config).start_prediction()[0]
+                    assert result["status"] == "success", result["error"]
+                    with open(result["prediction_file"], "r", newline="") as file_obj:
+                        assert file_obj.read() == expected
+                    os.remove(result["prediction_file"])
+            finally:
+                os.chdir(cwd)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_chunked_csv_read_with_pyarrow_engine():
+    # chunked reads fall back to the C engine and parse like a whole file read with pyarrow
+    try:
+        from sensor.synthetic_data import write_aps_csv
+        from sensor.utils import read_csv_with_schema
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_path = write_aps_csv(os.path.join(work_dir, "input.csv"), 120, schema_file_path=SCHEMA_FILE_PATH)
+            expected_df = read_csv_with_schema(file_path, SCHEMA_FILE_PATH, engine="pyarrow")
+            chunks = list(read_csv_with_schema(file_path, SCHEMA_FILE_PATH, engine="pyarrow", chunksize=50))
+        assert [len(chunk) for chunk in chunks] == [50, 50, 20]
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected_df)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_unparsable_values_are_quarantined():
+    # a reading that is not a number is caught by the export, through the snapshot or straight from
+    # the collection, and its row is moved to the invalid dir by validation with the raw value
+    try:
+        import mongomock
+        from sensor.config import set_mongo_client
+        from sensor.components.data_ingestion import DataIngestion
+        from sensor.components.data_validation import DataValidation
+        from sensor.entity.config_entity import TrainingPipelineConfig, DataIngestionConfig, DataValidationConfig
+        from sensor.synthetic_data import write_aps_csv
+        from sensor.utils import UNPARSABLE_VALUES_COLUMN, load_dataframe, read_yaml_file
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                shutil.copyfile(SCHEMA_FILE_PATH, "schema.yaml")
+                file_path = write_aps_csv(os.path.join(work_dir, "train.csv"), 300, schema_file_path=SCHEMA_FILE_PATH)
+                df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+                feature_column = get_test_columns()[0][1]
+                df.loc[17, feature_column] = "12,5 bar"
+                df.to_csv(file_path, index=False)
+                set_mongo_client(mongomock.MongoClient())
+                dump_csv_to_mongodb(file_path, TEST_DATABASE_NAME, TEST_COLLECTION_NAME)
+
+                for run_idx, use_snapshot in enumerate([True, True, False]):
+                    training_pipeline_config = TrainingPipelineConfig()
+                    training_pipeline_config.artifact_dir = os.path.join(work_dir, "artifact", str(run_idx))
+                    data_ingestion_config = DataIngestionConfig(training_pipeline_config)
+                    data_ingestion_config.database_name = TEST_DATABASE_NAME
+                    data_ingestion_config.use_snapshot = use_snapshot
+                    data_ingestion_artifact = DataIngestion(data_ingestion_config).initiate_data_ingestion()
+                    data_validation_config = DataValidationConfig(training_pipeline_config)
+                    data_validation_artifact = DataValidation(data_validation_config, data_ingestion_artifact).initiate_data_validation()
+
+                    invalid_dfs = [load_dataframe(invalid_file_path, "schema.yaml", columns=df.columns.tolist() + [UNPARSABLE_VALUES_COLUMN])
+                                   for invalid_file_path in [data_validation_config.invalid_train_file_path,
+                                                             data_validation_config.invalid_test_file_path]
+                                   if os.path.exists(invalid_file_path)]
+                    invalid_df = pd.concat(invalid_dfs, ignore_index=True)
+                    is_unparsable = invalid_df[UNPARSABLE_VALUES_COLUMN].notna()
+                    assert list(invalid_df.loc[is_unparsable, UNPARSABLE_VALUES_COLUMN]) == ['{"%s": "12,5 bar"}' % feature_column]
+                    assert invalid_df.loc[is_unparsable, feature_column].isna().all()
+                    valid_rows = sum(len(load_dataframe(valid_file_path, "schema.yaml"))
+                                     for valid_file_path in [data_validation_artifact.train_file_path, data_validation_artifact.test_file_path])
+                    assert valid_rows == 300 - len(invalid_df)
+                    report = read_yaml_file(data_validation_artifact.report_file_path)
+                    unparsable_counts = [report[key].get("unparsable_values", {}) for key in ["train_invalid_rows", "test_invalid_rows"]]
+                    assert sum(counts.get(feature_column, 0) for counts in unparsable_counts) == 1
+            finally:
+                os.chdir(cwd)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_log_settings_from_env_file():
+    # the log format, level and run id set in the .env file apply, although it is loaded after
+    # the logger is imported
+    try:
+        import json
+        code = ("import logging; from sensor.logger import queue_handler; "
+                "logging.info('info record'); logging.debug('debug record'); queue_handler.stop()")
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        env = {key: value for key, value in os.environ.items() if not key.startswith("SENSOR_LOG") and key != "SENSOR_RUN_ID"}
+        with tempfile.TemporaryDirectory() as work_dir:
+            with open(os.path.join(work_dir, ".env"), "w") as env_file:
+                env_file.write("SENSOR_LOG_FORMAT=json\nSENSOR_LOG_LEVEL=DEBUG\nSENSOR_RUN_ID=env-file-run\n")
+            subprocess.run([sys.executable, "-c", code], cwd=work_dir, check=True, env=dict(env, PYTHONPATH=repo_dir))
+            log_dir = os.path.join(work_dir, "datadir", "logs")
+            with open(os.path.join(log_dir, os.listdir(log_dir)[0])) as log_file:
+                entries = [json.loads(line) for line in log_file]
+        assert [(entry["level"], entry["message"]) for entry in entries] == \
+            [("INFO", "info record"), ("DEBUG", "debug record")]
+        assert all(entry["run_id"] == "env-file-run" for entry in entries)
+    except Exception as e:
+        raise SensorException(e, sys)
+
+def test_import_time():
+    # import the pipeline and config modules app.py imports in a fresh interpreter and an empty
+    # directory: within the budget, without the heavy libraries, without printing and without
+    # creating files
+    try:
+        code = ("import sys, time; start = time.perf_counter(); "
+                "import sensor.pipeline.training_pipeline, sensor.pipeline.batch_prediction, sensor.entity.config_entity; "
+                "seconds = time.perf_counter() - start; "
+                f"print(seconds, ','.join(m for m in {DEFERRED_MODULES} if m in sys.modules))")
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = subprocess.run([sys.executable, "-c", code], cwd=work_dir, capture_output=True, text=True, check=True,
+                                    env=dict(os.environ, PYTHONPATH=repo_dir))
+            created_files = os.listdir(work_dir)
+        output = result.stdout.split()
+        assert len(output) <= 2, f"Import printed: {result.stdout}"
+        seconds, imported_modules = float(output[0]), output[1:]
+        assert not imported_modules, f"Imported on import: {imported_modules}"
+        assert not created_files, f"Created on import: {created_files}"
+        assert seconds < IMPORT_TIME_BUDGET_SECONDS, f"Import took {seconds:.3f}s, budget is {IMPORT_TIME_BUDGET_SECONDS}s"
+        logging.info(f"Pipeline modules imported in {seconds:.3f}s")
+    except Exception as e:
+        raise SensorException(e, sys)
+
 if __name__ == '__main__':
     try:
         print("Dockerized")